@@ -14,3 +14,9 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tracegpt.settings')
 
 application = get_asgi_application()
+
+# Spawn the chart render workers now rather than on the first chart request;
+# management commands never import this module, so they start no workers
+from tracegptapp.renderer import warm_on_start  # noqa: E402
+
+warm_on_start()
@@ -213,3 +213,56 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # LangSmith settings
 LANGSMITH_API_KEY = ""
 LANGSMITH_PROJECT = "tracegpt-local"
+LANGSMITH_ENDPOINT = "https://api.smith.langchain.com"
+LANGSMITH_HTTP_POOL_SIZE = 10  # keep-alive connections shared by the client and the exporter
+
+# LangSmith span export
+# Finished traces are buffered in memory and posted to <LANGSMITH_ENDPOINT>/runs/batch from a background thread
+LANGSMITH_EXPORT = None  # None exports whenever LANGSMITH_API_KEY is set
+LANGSMITH_EXPORT_BATCH_SIZE = 100  # spans per request
+LANGSMITH_EXPORT_FLUSH_INTERVAL = 1.0  # seconds before a partial batch is sent
+LANGSMITH_EXPORT_QUEUE_SIZE = 10000  # buffered spans; the oldest are dropped beyond this
+LANGSMITH_EXPORT_MAX_RETRIES = 5
+LANGSMITH_EXPORT_BACKOFF = 0.5  # base seconds of the jittered exponential backoff
+LANGSMITH_EXPORT_TIMEOUT = 10  # seconds per request
+
+# Trace ingestion settings
+# When enabled, process_chat hands finished traces to a background worker pool
+TRACE_INGEST_ASYNC = True
+TRACE_INGEST_QUEUE_SIZE = 1000
+TRACE_INGEST_BATCH_SIZE = 100
+TRACE_INGEST_WORKERS = 2
+TRACE_INGEST_FLUSH_INTERVAL = 0.5  # seconds a worker waits for a batch to fill
+TRACE_INGEST_PUT_TIMEOUT = 0.05  # seconds a request waits for buffer room before spilling
+TRACE_INGEST_SPILL_PATH = BASE_DIR / 'trace_ingest_spill.ndjson'  # each process spills to trace_ingest_spill.<pid>.ndjson
+
+# Bulk ingest endpoint (/api/traces/bulk/)
+TRACE_BULK_CHUNK_SIZE = 500  # records per bulk_create round trip
+TRACE_INGEST_API_TOKEN = ""  # clients must send "Authorization: Bearer <token>"; the endpoint refuses every request while unset
+
+# Example suite runs (manage.py run_examples, /api/examples/run/)
+EXAMPLE_RUN_CONCURRENCY = 50  # examples in flight at once, also the cap of /api/examples/run/
+EXAMPLE_RUN_REPORT_TTL = 24 * 60 * 60  # seconds the status and report of a background run are kept in the cache
+
+# Rendered chart cache
+CHART_CACHE_MAX_ENTRIES = 128  # charts kept in the in-process LRU
+CHART_CACHE_DIR = None  # set to a directory (e.g. BASE_DIR / 'chart_cache') to share charts between processes
+CHART_CACHE_VERSION_TTL = 5  # seconds a data-version stamp is reused before re-querying
+
+# Chart render pool
+CHART_RENDER_WORKERS = 4  # spawned worker processes; 0 renders charts in the request process
+CHART_RENDER_TIMEOUT = 30  # seconds a request waits for a chart before answering 503
+CHART_RENDER_WARM_ON_START = True  # spawn the workers when the WSGI/ASGI application loads
+CHART_IMAGE_MAX_AGE = 60  # seconds browsers may reuse a /charts/ image before revalidating
+
+# Columnar trace snapshots (manage.py export_trace_snapshot)
+TRACE_SNAPSHOT_DIR = BASE_DIR / 'trace_snapshots'
+TRACE_SNAPSHOT_READS = False  # read chart data from the snapshot instead of the database
+
+# Analytics API (/api/analytics/)
+ANALYTICS_MAX_POINTS = 5000  # upper bound of the `points` budget of downsampled series
+DASHBOARD_SUMMARY_TTL = 10  # seconds the analytics dashboard summary is cached
+
+# Compressed trace payloads (manage.py train_compression_dictionary)
+TRACE_COMPRESSION_LEVEL = 3  # zstd level for trace_data and step input/output payloads
+TRACE_COMPRESSION_DICT_TTL = 60  # seconds a process keeps its active dictionary before checking for a newer one
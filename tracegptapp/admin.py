@@ -1,14 +1,14 @@
 from django.contrib import admin
 from django.urls import path
 from django.shortcuts import render
-from django.http import JsonResponse, HttpResponse
+from django.http import HttpResponse
 from django.utils.html import format_html
 from django.db.models import Count, Sum, Avg
 from django.utils.translation import gettext_lazy as _
 
 from .models import ChatExample, ChatTrace, TraceStep, ContactMessage
-from .analytics import ChartDataGenerator
-from .visualizations import DashboardVisualizations
+from .analytics import ChartDataGenerator, parse_window
+from .serialization import JsonResponse, dumps
 
 # Custom admin theme
 admin.site.site_header = "TraceGPT Admin Dashboard"
@@ -18,9 +18,10 @@ admin.site.index_title = "Welcome to TraceGPT Analytics"
 class TraceStepInline(admin.TabularInline):
     model = TraceStep
     extra = 0
-    readonly_fields = ('step_name', 'step_type', 'runtime_display', 'start_time', 'end_time')
+    readonly_fields = ('path', 'step_name', 'step_type', 'runtime_display', 'start_time', 'end_time')
     can_delete = False
-    fields = ('step_name', 'step_type', 'runtime_display', 'start_time', 'end_time')
+    fields = ('path', 'step_name', 'step_type', 'runtime_display', 'start_time', 'end_time')
+    ordering = ('path', 'start_time')
     
     def has_add_permission(self, request, obj=None):
         return False
@@ -92,7 +93,7 @@ class ChatTraceAdmin(admin.ModelAdmin):
     search_fields = ('run_id', 'input_prompt', 'output_response')
     inlines = [TraceStepInline]
     readonly_fields = ('run_id', 'input_prompt', 'output_response', 'status',
-                      'tags', 'runtime_seconds', 'trace_data', 'created_at')
+                      'tags', 'runtime_seconds', 'trace_data_display', 'created_at')
     
     fieldsets = (
         ('Trace Information', {
@@ -103,7 +104,7 @@ class ChatTraceAdmin(admin.ModelAdmin):
             'classes': ('wide',)
         }),
         ('Trace Data', {
-            'fields': ('trace_data',),
+            'fields': ('trace_data_display',),
             'classes': ('collapse',)
         }),
         ('Metadata', {
@@ -157,6 +158,12 @@ class ChatTraceAdmin(admin.ModelAdmin):
     
     status_badge.short_description = 'Status'
     
+    def trace_data_display(self, obj):
+        """Display the decompressed trace data as indented JSON"""
+        return format_html('<pre>{}</pre>', dumps(obj.trace_data, indent=True).decode())
+    
+    trace_data_display.short_description = 'Trace data'
+    
     def runtime_display(self, obj):
         """Display runtime with color coding"""
         if obj.runtime_seconds < 1:
@@ -196,24 +203,40 @@ class ChatTraceAdmin(admin.ModelAdmin):
         return extra_urls + urls
     
     def traces_by_date_view(self, request):
-        """JSON view for traces by date chart"""
-        days = int(request.GET.get('days', 30))
-        chart_data = ChartDataGenerator.traces_by_date(days)
+        """JSON view for traces by date chart over the last `days` days or a start/end window"""
+        try:
+            window = parse_window(request.GET)
+            days = int(request.GET.get('days', 30))
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        chart_data = ChartDataGenerator.traces_by_date(days, **window)
         return JsonResponse(chart_data)
     
     def runtime_distribution_view(self, request):
-        """JSON view for runtime distribution chart"""
-        chart_data = ChartDataGenerator.runtime_distribution()
+        """JSON view for runtime distribution chart over an optional start/end window"""
+        try:
+            window = parse_window(request.GET)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        chart_data = ChartDataGenerator.runtime_distribution(start=window['start'], end=window['end'])
         return JsonResponse(chart_data)
     
     def tags_distribution_view(self, request):
-        """JSON view for tags distribution chart"""
-        chart_data = ChartDataGenerator.tags_distribution()
+        """JSON view for tags distribution chart over an optional start/end window"""
+        try:
+            window = parse_window(request.GET)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        chart_data = ChartDataGenerator.tags_distribution(start=window['start'], end=window['end'])
         return JsonResponse(chart_data)
     
     def step_runtime_view(self, request):
-        """JSON view for step runtime chart"""
-        chart_data = ChartDataGenerator.step_runtime_by_type()
+        """JSON view for step runtime chart over an optional start/end window"""
+        try:
+            window = parse_window(request.GET)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        chart_data = ChartDataGenerator.step_runtime_by_type(window['start'], window['end'])
         return JsonResponse(chart_data)
     
     def matplotlib_chart_view(self, request, chart_type):
@@ -229,12 +252,17 @@ class ChatTraceAdmin(admin.ModelAdmin):
             return JsonResponse({'error': str(e)}, status=500)
         
     def performance_report_view(self, request):
-        """View for performance reports"""
+        """View for performance reports over an optional start/end window"""
+        try:
+            window = parse_window(request.GET, default_bucket='week')
+        except ValueError as e:
+            return HttpResponse(str(e), status=400, content_type='text/plain')
+        
         # Get performance metrics
-        metrics = ChartDataGenerator.trace_performance_metrics()
+        metrics = ChartDataGenerator.trace_performance_metrics(**window)
         
         # Get hourly activity data
-        hourly_activity = ChartDataGenerator.hourly_activity_heatmap()
+        hourly_activity = ChartDataGenerator.hourly_activity_heatmap(window['start'], window['end'])
         
         context = {
             'title': 'Trace Performance Report',
@@ -246,22 +274,9 @@ class ChatTraceAdmin(admin.ModelAdmin):
 
     def visualizations_dashboard_view(self, request):
         """View for visualizations dashboard"""
-        # Get all visualizations
-        visualizations = DashboardVisualizations.get_all_visualizations()
-        
-        # Get existing chart images for compatibility with old templates
-        runtime_distribution_img = ChartDataGenerator.generate_matplotlib_chart('runtime_histogram')
-        traces_by_date_img = ChartDataGenerator.generate_matplotlib_chart('trace_count_by_day')
-        tags_distribution_img = ChartDataGenerator.generate_matplotlib_chart('tags_pie')
-        step_runtime_img = ChartDataGenerator.generate_matplotlib_chart('step_runtime')
-        
+        # Charts are lazy-loaded from the chart_image endpoint
         context = {
             'title': 'Data Visualizations Dashboard',
-            'visualizations': visualizations,
-            'runtime_distribution_img': runtime_distribution_img,
-            'traces_by_date_img': traces_by_date_img,
-            'tags_distribution_img': tags_distribution_img,
-            'step_runtime_img': step_runtime_img,
             'opts': self.model._meta,
         }
         return render(request, 'admin/tracegptapp/dashboard_visualizations.html', context)
@@ -8,12 +8,19 @@ from matplotlib.colors import LinearSegmentedColormap
 import seaborn as sns
 from io import BytesIO
 import base64
-from datetime import datetime, timedelta
+from datetime import datetime, time, timedelta
+from django.conf import settings
 from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from django.db.models import Count, Avg, Sum, F, ExpressionWrapper, fields, Max, Min
 from django.db.models.functions import TruncDay, TruncWeek, TruncMonth, ExtractHour
 
-from .models import ChatTrace, TraceStep, ContactMessage
+from .models import ChatTrace, TraceStep, ContactMessage, TraceRollup, StepRollup
+from .chart_cache import cached_chart, chart_format
+from .rollups import RollupManager
+from .frames import iter_frames, load_frame, local_naive
+from .snapshots import load_columns
+from .downsampling import MIN_POINTS, downsample
 
 # Set matplotlib style
 plt.style.use('ggplot')
@@ -24,72 +31,146 @@ TRACE_COLORS = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b'
 RUNTIME_CMAP = LinearSegmentedColormap.from_list("runtime_cmap", ["#d0f0c0", "#006400"])
 TAG_COLORS = {'correct': '#28a745', 'misleading': '#ffc107', 'incomplete': '#17a2b8', 'slow': '#dc3545'}
 
+# Time buckets accepted by the analytics API, as pandas period frequencies
+BUCKET_FREQUENCIES = {'hour': 'h', 'day': 'D', 'week': 'W', 'month': 'M'}
+
+# Default point budget of downsampled series
+DEFAULT_MAX_POINTS = 500
+
+
+def _parse_datetime_param(query, name):
+    """Parse an optional ISO date/datetime query parameter into an aware datetime"""
+    value = query.get(name)
+    if not value:
+        return None
+    
+    parsed = parse_datetime(value)
+    if parsed is None:
+        parsed_date = parse_date(value)
+        if parsed_date is None:
+            raise ValueError(f"Invalid {name} parameter: {value}")
+        parsed = datetime.combine(parsed_date, time.min)
+    
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def parse_window(query, default_bucket='day'):
+    """
+    Parse the start/end/bucket/points query parameters shared by the analytics endpoints.
+    
+    Raises ValueError for invalid values. The point budget is capped at
+    ANALYTICS_MAX_POINTS so responses stay bounded for any window.
+    """
+    start = _parse_datetime_param(query, 'start')
+    end = _parse_datetime_param(query, 'end')
+    if start is not None and end is not None and start > end:
+        raise ValueError("start must be before end")
+    
+    bucket = query.get('bucket', default_bucket)
+    if bucket not in BUCKET_FREQUENCIES:
+        raise ValueError(f"bucket must be one of: {', '.join(BUCKET_FREQUENCIES)}")
+    
+    try:
+        max_points = int(query.get('points', DEFAULT_MAX_POINTS))
+    except ValueError:
+        raise ValueError("points must be an integer")
+    if max_points < MIN_POINTS:
+        raise ValueError(f"points must be at least {MIN_POINTS}")
+    
+    return {
+        'start': start,
+        'end': end,
+        'bucket': bucket,
+        'max_points': min(max_points, settings.ANALYTICS_MAX_POINTS),
+    }
+
+
+def _rollup_series(start, end, bucket, fill=False):
+    """
+    Sum trace counts and runtimes of the rollups in a window per time bucket.
+
+    Hourly rollups back hourly buckets and windows, so windows are exact to
+    the hour, and daily rollups back everything else. Returns a DataFrame
+    indexed by local-time periods, with empty periods between start and end
+    included when fill is set.
+    """
+    freq = BUCKET_FREQUENCIES[bucket]
+    granularity = 'hour' if bucket == 'hour' else RollupManager.window_granularity(start, end)
+    rollups = RollupManager.buckets(granularity, start, end)
+
+    # Sum chunk by chunk so memory stays bounded by the chunk size, not the window
+    series = pd.DataFrame({'trace_count': pd.Series(dtype='int64'), 'runtime_sum': pd.Series(dtype='float64')},
+                          index=pd.PeriodIndex([], freq=freq, name='period'))
+    for chunk in iter_frames(rollups, ['bucket_start', 'trace_count', 'runtime_sum']):
+        chunk['period'] = local_naive(chunk['bucket_start']).dt.to_period(freq)
+        partial = chunk.groupby('period')[['trace_count', 'runtime_sum']].sum()
+        series = series.add(partial, fill_value=0)
+    series['trace_count'] = series['trace_count'].astype('int64')
+
+    if fill and start is not None and end is not None:
+        periods = pd.period_range(
+            timezone.localtime(start).replace(tzinfo=None),
+            timezone.localtime(end).replace(tzinfo=None),
+            freq=freq,
+        )
+        series = series.reindex(periods, fill_value=0)
+    return series
+
+
+def _downsample_series(labels, values, max_points):
+    """Downsample a bucketed series with LTTB, keeping labels aligned"""
+    if max_points is None or len(values) <= max_points:
+        return list(labels), list(values)
+    kept = downsample(np.arange(len(values)), values, max_points, 'lttb')
+    return [labels[i] for i in kept], [values[i] for i in kept]
+
+
 class ChartDataGenerator:
     @staticmethod
-    def traces_by_date(days=30):
-        """Generate data for traces created over time chart with pandas"""
-        end_date = timezone.now()
-        start_date = end_date - timedelta(days=days)
-        
-        # Get the data from database
-        traces = ChatTrace.objects.filter(
-            created_at__gte=start_date,
-            created_at__lte=end_date
-        ).annotate(
-            date=TruncDay('created_at')
-        ).values('date').annotate(
-            count=Count('id')
-        ).order_by('date')
-        
-        # Convert to pandas dataframe for analysis
-        df = pd.DataFrame(list(traces))
-        
-        if df.empty:
-            # Create sample data if no data exists
-            date_range = pd.date_range(start=start_date, end=end_date, freq='D')
-            df = pd.DataFrame({'date': date_range, 'count': [0] * len(date_range)})
-        else:
-            # Ensure we have all dates in range (pandas resampling)
-            df.set_index('date', inplace=True)
-            idx = pd.date_range(start=start_date.date(), end=end_date.date())
-            df = df.reindex(idx, fill_value=0).reset_index()
-            df.rename(columns={'index': 'date'}, inplace=True)
+    def traces_by_date(days=30, start=None, end=None, bucket='day', max_points=None):
+        """
+        Generate data for traces created over time chart from the rollups.
+        
+        The window defaults to the last ``days`` days. Counts are summed per
+        ``bucket`` and downsampled to ``max_points`` points.
+        """
+        end_date = end or timezone.now()
+        start_date = start or end_date - timedelta(days=days)
+        
+        # Read the per-bucket counts from the rollup table, including empty buckets
+        series = _rollup_series(start_date, end_date, bucket, fill=True)
+        labels, counts = _downsample_series(
+            series.index.astype(str).tolist(),
+            series['trace_count'].astype(int).tolist(),
+            max_points,
+        )
         
         return {
-            'dates': [d.strftime('%Y-%m-%d') for d in df['date']],
-            'counts': df['count'].tolist(),
+            'dates': labels,
+            'counts': counts,
+            'bucket': bucket,
         }
     
     @staticmethod
-    def runtime_distribution():
-        """Generate runtime distribution chart data using pandas"""
-        traces = ChatTrace.objects.all().values('runtime_seconds')
-        
-        if not traces:
-            return {
-                'labels': ['0-1s', '1-2s', '2-3s', '3-5s', '5-10s', '10s+'],
-                'data': [0, 0, 0, 0, 0, 0],
-            }
-        
-        # Convert to pandas DataFrame for better analysis
-        df = pd.DataFrame(list(traces))
-        
-        # Create bins for the histogram
-        max_runtime = df['runtime_seconds'].max() if len(df) > 0 else 10
-        
-        # Ensure bins increase monotonically
-        if max_runtime <= 10:
-            bins = [0, 1, 2, 3, 5, 10, 11]  # Default bins with fixed upper limit
-        else:
-            bins = [0, 1, 2, 3, 5, 10, max_runtime + 1]  # Adjust top bin for large values
-            
-        labels = ['0-1s', '1-2s', '2-3s', '3-5s', '5-10s', '10s+']
-        
-        # Use pandas cut to bin the data
-        df['runtime_bin'] = pd.cut(df['runtime_seconds'], bins=bins, labels=labels, right=False)
-        
-        # Get the counts for each bin
-        runtime_counts = df['runtime_bin'].value_counts().reindex(labels).fillna(0)
+    def runtime_distribution(histograms=None, start=None, end=None):
+        """
+        Generate runtime distribution chart data from the rollup histograms.
+        
+        Unless histograms are given they are read from the rollups of the
+        start/end window, all history by default.
+        """
+        labels = TraceRollup.RUNTIME_BIN_LABELS
+        if histograms is None:
+            rollups = RollupManager.buckets(RollupManager.window_granularity(start, end), start, end)
+            histograms = rollups.values_list('runtime_histogram', flat=True).iterator()
+        
+        # Sum the per-bucket histograms as they stream in
+        runtime_counts = np.zeros(len(labels), dtype=np.int64)
+        for histogram in histograms:
+            if histogram:
+                runtime_counts += np.asarray(histogram, dtype=np.int64)
         
         return {
             'labels': labels,
@@ -97,31 +178,28 @@ class ChartDataGenerator:
         }
     
     @staticmethod
-    def tags_distribution():
-        """Generate tags distribution chart data with pandas"""
-        # Get all traces
-        traces = ChatTrace.objects.all()
-        
-        if not traces:
+    def tags_distribution(bucket_tag_counts=None, start=None, end=None):
+        """
+        Generate tags distribution chart data from the rollup tag counts.
+        
+        Unless the counts are given they are read from the rollups of the
+        start/end window, all history by default.
+        """
+        if bucket_tag_counts is None:
+            rollups = RollupManager.buckets(RollupManager.window_granularity(start, end), start, end)
+            bucket_tag_counts = rollups.values_list('tag_counts', flat=True)
+        
+        tag_counts = pd.Series(dtype='int64')
+        for counts in bucket_tag_counts:
+            tag_counts = tag_counts.add(pd.Series(counts, dtype='int64'), fill_value=0)
+        
+        if tag_counts.empty or tag_counts.sum() == 0:
             return {
                 'labels': ['No Tags'],
                 'data': [0],
             }
         
-        # Create a list of all tags with their counts
-        all_tags = []
-        for trace in traces:
-            all_tags.extend(trace.tags)
-        
-        if not all_tags:
-            return {
-                'labels': ['No Tags'],
-                'data': [0],
-            }
-        
-        # Convert to pandas Series for counting
-        tags_series = pd.Series(all_tags)
-        tag_counts = tags_series.value_counts()
+        tag_counts = tag_counts.astype('int64').sort_values(ascending=False, kind='stable')
         
         return {
             'labels': tag_counts.index.tolist(),
@@ -130,21 +208,26 @@ class ChartDataGenerator:
         }
     
     @staticmethod
-    def step_runtime_by_type():
-        """Generate average runtime by step type chart data with pandas"""
-        steps = TraceStep.objects.values('step_type').annotate(
-            avg_runtime=Avg('runtime_seconds')
-        ).order_by('-avg_runtime')
+    def step_runtime_by_type(start=None, end=None):
+        """Generate average runtime by step type chart data from the step rollups of the start/end window"""
+        granularity = RollupManager.window_granularity(start, end)
+        steps = RollupManager.buckets(granularity, start, end, model=StepRollup).order_by().values('step_type').annotate(
+            step_count=Sum('step_count'),
+            runtime_sum=Sum('runtime_sum'),
+        )
         
-        if not steps:
+        df = load_frame(steps, ['step_type', 'step_count', 'runtime_sum'])
+        df = df[df['step_count'] > 0]
+        
+        if df.empty:
             return {
                 'labels': ['No Steps'],
                 'data': [0],
             }
         
-        # Convert to pandas for analysis and sorting
-        df = pd.DataFrame(list(steps))
-        df.sort_values('avg_runtime', ascending=False, inplace=True)
+        # Sort with pandas
+        df['avg_runtime'] = df['runtime_sum'] / df['step_count']
+        df = df.sort_values('avg_runtime', ascending=False)
         
         return {
             'labels': df['step_type'].tolist(),
@@ -152,49 +235,24 @@ class ChartDataGenerator:
         }
     
     @staticmethod
-    def hourly_activity_heatmap():
-        """Generate hourly activity heatmap data with pandas"""
-        # Get all traces with created_at time
-        traces = ChatTrace.objects.all().annotate(
-            hour=ExtractHour('created_at'),
-            day=TruncDay('created_at')
-        ).values('hour', 'day').annotate(count=Count('id'))
+    def hourly_activity_heatmap(start=None, end=None):
+        """
+        Generate hourly activity heatmap data from the hourly rollups.
         
-        if not traces:
-            # Return empty data
-            return {'data': []}
-            
-        # Convert to pandas DataFrame
-        df = pd.DataFrame(list(traces))
-        
-        # Create pivot table with days as rows and hours as columns
-        pivot_data = df.pivot_table(
-            index='day', 
-            columns='hour', 
-            values='count', 
-            aggfunc='sum',
-            fill_value=0
-        ).reset_index()
+        Returns the local days with activity, the hours of the day, and a
+        days x hours matrix of trace counts.
+        """
+        days, counts = RollupManager.activity_matrix(start, end)
         
-        # Format the data for the heatmap
-        days = [day.strftime('%Y-%m-%d') for day in pivot_data['day']]
+        # Skip days without traces
+        active = counts.any(axis=1)
+        days, counts = days[active], counts[active]
         
-        # Create dataset
-        dataset = []
-        for hour in range(24):
-            if hour in pivot_data.columns:
-                hour_data = []
-                for i, day in enumerate(days):
-                    hour_data.append({
-                        'x': day,
-                        'y': int(pivot_data.iloc[i][hour])
-                    })
-                dataset.append({
-                    'name': f'{hour:02d}:00',
-                    'data': hour_data
-                })
-        
-        return {'data': dataset, 'days': days}
+        return {
+            'days': np.datetime_as_string(days).tolist(),
+            'hours': list(range(24)),
+            'matrix': counts.tolist(),
+        }
     
     @staticmethod
     def contact_status_distribution():
@@ -203,25 +261,36 @@ class ChartDataGenerator:
             count=Count('id')
         ).order_by('status')
         
-        if not statuses:
+        df = load_frame(statuses, ['status', 'count'])
+        
+        if df.empty:
             return {
                 'labels': ['No Messages'],
                 'data': [0],
             }
         
-        df = pd.DataFrame(list(statuses))
-        
         return {
             'labels': df['status'].tolist(),
             'data': df['count'].tolist(),
         }
     
     @staticmethod
-    def trace_performance_metrics():
-        """Generate performance metrics for traces using pandas"""
-        traces = ChatTrace.objects.all().values('runtime_seconds', 'created_at')
-        
-        if not traces:
+    def trace_performance_metrics(start=None, end=None, bucket='week', max_points=None):
+        """
+        Generate performance metrics for traces from the rollups.
+        
+        Metrics cover the start/end window (all history by default), and the
+        runtime trend averages ``bucket`` periods downsampled to ``max_points``.
+        """
+        rollups = RollupManager.buckets(RollupManager.window_granularity(start, end), start, end)
+        totals = rollups.aggregate(
+            total_traces=Sum('trace_count'),
+            runtime_sum=Sum('runtime_sum'),
+            min_runtime=Min('runtime_min'),
+            max_runtime=Max('runtime_max'),
+        )
+        
+        if not totals['total_traces']:
             return {
                 'avg_runtime': 0,
                 'max_runtime': 0,
@@ -230,35 +299,55 @@ class ChartDataGenerator:
                 'trend_data': []
             }
         
-        # Convert to pandas DataFrame
-        df = pd.DataFrame(list(traces))
-        df['created_at'] = pd.to_datetime(df['created_at'])
-        
         # Calculate basic stats
         metrics = {
-            'avg_runtime': round(df['runtime_seconds'].mean(), 2),
-            'max_runtime': round(df['runtime_seconds'].max(), 2),
-            'min_runtime': round(df['runtime_seconds'].min(), 2),
-            'total_traces': len(df),
+            'avg_runtime': round(totals['runtime_sum'] / totals['total_traces'], 2),
+            'max_runtime': round(totals['max_runtime'], 2),
+            'min_runtime': round(totals['min_runtime'], 2),
+            'total_traces': totals['total_traces'],
         }
         
-        # Calculate trend data (weekly average runtime)
-        # Remove timezone info to avoid warnings
-        df['created_at'] = df['created_at'].dt.tz_localize(None)
-        df['week'] = df['created_at'].dt.to_period('W')
-        weekly_avg = df.groupby('week')['runtime_seconds'].mean().reset_index()
-        weekly_avg['week'] = weekly_avg['week'].astype(str)
+        # Calculate trend data (average runtime per bucket, weekly by default)
+        trend = _rollup_series(start, end, bucket)
+        trend = trend[trend['trace_count'] > 0]
+        avg_runtime = (trend['runtime_sum'] / trend['trace_count']).round(2)
+        labels, data = _downsample_series(trend.index.astype(str).tolist(), avg_runtime.tolist(), max_points)
         
         metrics['trend_data'] = {
-            'labels': weekly_avg['week'].tolist(),
-            'data': [round(x, 2) for x in weekly_avg['runtime_seconds'].tolist()]
+            'labels': labels,
+            'data': data,
+            'bucket': bucket,
         }
         
         return metrics
         
     @staticmethod
+    def trace_runtimes(start=None, end=None, max_points=DEFAULT_MAX_POINTS, method='minmax'):
+        """
+        Generate trace runtime scatter data downsampled to ``max_points`` points.
+        
+        Min/max downsampling keeps the fastest and slowest trace of every time
+        slice so outliers stay visible; LTTB keeps the shape of the series.
+        """
+        df = load_columns('traces', ['created_at', 'runtime_seconds', 'status'], start, end)
+        df = df.dropna(subset=['runtime_seconds']).sort_values('created_at', kind='stable')
+        
+        created_at = df['created_at'].to_numpy(dtype='datetime64[us]')
+        kept = downsample(created_at, df['runtime_seconds'].to_numpy(), max_points, method)
+        sample = df.iloc[kept]
+        
+        return {
+            'timestamps': [value.isoformat() for value in sample['created_at']],
+            'runtimes': sample['runtime_seconds'].round(3).tolist(),
+            'statuses': sample['status'].astype(str).tolist(),
+            'total': len(df),
+            'method': method,
+        }
+    
+    @staticmethod
+    @cached_chart(ChatTrace, TraceStep)
     def generate_matplotlib_chart(chart_type):
-        """Generate a Matplotlib chart and return as base64 encoded string"""
+        """Generate a Matplotlib chart and return as base64 encoded string in the current chart format"""
         try:
             # Set matplotlib style
             plt.style.use('ggplot')
@@ -266,15 +355,15 @@ class ChartDataGenerator:
             
             if chart_type == 'runtime_histogram':
                 # Get runtime data
-                traces = ChatTrace.objects.all().values_list('runtime_seconds', flat=True)
+                traces = load_columns('traces', ['runtime_seconds'])['runtime_seconds']
                 
-                if not traces:
+                if traces.empty:
                     plt.text(0.5, 0.5, 'No trace data available', 
                              horizontalalignment='center', verticalalignment='center',
                              fontsize=14)
                 else:
                     # Create DataFrame
-                    df = pd.DataFrame({'runtime': list(traces)})
+                    df = pd.DataFrame({'runtime': traces})
                     
                     # Create histogram with seaborn for better styling
                     ax = sns.histplot(df['runtime'], bins=10, kde=True, color='#5470c6')
@@ -322,14 +411,13 @@ class ChartDataGenerator:
                     avg_runtime=Avg('runtime_seconds'),
                     max_runtime=Max('runtime_seconds')
                 ).order_by('-avg_runtime')
+                df = load_frame(steps, ['step_type', 'avg_runtime', 'max_runtime'])
                 
-                if not steps:
+                if df.empty:
                     plt.text(0.5, 0.5, 'No step data available', 
                              horizontalalignment='center', verticalalignment='center',
                              fontsize=14)
                 else:
-                    # Convert to DataFrame
-                    df = pd.DataFrame(list(steps))
                     df = df.sort_values('avg_runtime')
                     
                     # Create horizontal bar chart with error bars
@@ -366,17 +454,15 @@ class ChartDataGenerator:
                 ).values('day').annotate(
                     count=Count('id')
                 ).order_by('day')
+                df = load_frame(traces, ['day', 'count'])
                 
-                if not traces:
+                if df.empty:
                     plt.text(0.5, 0.5, 'No trace data available', 
                              horizontalalignment='center', verticalalignment='center',
                              fontsize=14)
                 else:
-                    # Convert to DataFrame
-                    df = pd.DataFrame(list(traces))
-                    
-                    # Convert timezone-aware dates to naive dates for consistent comparison
-                    df['day'] = df['day'].dt.tz_localize(None)
+                    # Convert the local day starts to naive dates for consistent comparison
+                    df['day'] = local_naive(df['day'])
                     
                     # Ensure all dates in range - use naive datetimes
                     date_range = pd.date_range(start=start_date.date(), end=end_date.date())
@@ -397,17 +483,17 @@ class ChartDataGenerator:
                     plt.grid(True, alpha=0.3, axis='y')
                     plt.tight_layout()
                 
-                # Save the plot to a BytesIO object
-                buffer = BytesIO()
-                plt.savefig(buffer, format='png', dpi=100)
-                plt.close(fig)
+            # Save the plot to a BytesIO object
+            buffer = BytesIO()
+            plt.savefig(buffer, format=chart_format.get(), dpi=100)
+            plt.close(fig)
                 
-                # Encode the image to base64
-                buffer.seek(0)
-                image_png = buffer.getvalue()
-                buffer.close()
+            # Encode the image to base64
+            buffer.seek(0)
+            image_png = buffer.getvalue()
+            buffer.close()
                 
-                return base64.b64encode(image_png).decode('utf-8')
+            return base64.b64encode(image_png).decode('utf-8')
             
         except Exception as e:
             # Handle errors gracefully
@@ -424,7 +510,7 @@ class ChartDataGenerator:
                 plt.axis('off')
                 
                 buffer = BytesIO()
-                fig.savefig(buffer, format='png', dpi=100)
+                fig.savefig(buffer, format=chart_format.get(), dpi=100)
                 plt.close(fig)
                 
                 buffer.seek(0)
@@ -0,0 +1,249 @@
+"""
+Cache of rendered charts keyed by chart, parameters and data version
+"""
+import functools
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, time as dt_time
+from pathlib import Path
+from django.conf import settings
+from django.db.models import Count, Max
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Image formats charts can be rendered in, with their content types
+CHART_FORMATS = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+    'webp': 'image/webp',
+}
+
+# Format the chart functions save figures in, see use_format
+chart_format = ContextVar('chart_format', default='png')
+
+# Fields used as a model's last modification time, first match wins
+TIMESTAMP_FIELDS = ('created_at', 'start_time')
+
+
+@contextmanager
+def use_format(fmt):
+    """Render charts in another image format within the block"""
+    if fmt not in CHART_FORMATS:
+        raise ValueError(f"Unsupported chart format: {fmt}")
+    token = chart_format.set(fmt)
+    try:
+        yield
+    finally:
+        chart_format.reset(token)
+
+
+class DataVersion:
+    """
+    Data-version stamps of the models charts are drawn from.
+
+    A model's stamp is its max id and row count, so it changes whenever rows
+    are added or deleted. Stamps are memoized for a few seconds so a
+    dashboard's charts share a single aggregate query per model, and are
+    dropped immediately when this process writes to the model.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self._stamps = {}
+        self._lock = threading.Lock()
+
+    def stamp(self, model):
+        """Return the (max id, count, latest timestamp) stamp of a model"""
+        ttl = self.ttl if self.ttl is not None else settings.CHART_CACHE_VERSION_TTL
+        label = model._meta.label
+        now = time.monotonic()
+        with self._lock:
+            cached = self._stamps.get(label)
+        if cached and now - cached[0] < ttl:
+            return cached[1]
+
+        aggregates = {'max_id': Max('id'), 'count': Count('id')}
+        field_names = {field.name for field in model._meta.get_fields()}
+        timestamp_field = next((name for name in TIMESTAMP_FIELDS if name in field_names), None)
+        if timestamp_field:
+            aggregates['latest'] = Max(timestamp_field)
+        data = model.objects.order_by().aggregate(**aggregates)
+        stamp = (data['max_id'] or 0, data['count'], data.get('latest'))
+        with self._lock:
+            self._stamps[label] = (now, stamp)
+        return stamp
+
+    def version(self, models):
+        """Return the combined version of several models"""
+        # The local date is part of the version since charts cover windows ending today
+        return [timezone.localdate().isoformat()] + [
+            [model._meta.label, *self.stamp(model)[:2]] for model in models
+        ]
+
+    def last_modified(self, models):
+        """Return when the data behind a version last changed"""
+        # Windows ending today shift at midnight even without new rows
+        start_of_day = timezone.make_aware(datetime.combine(timezone.localdate(), dt_time.min))
+        latest = [self.stamp(model)[2] for model in models]
+        return max([start_of_day] + [value for value in latest if value is not None])
+
+    def invalidate(self, model=None):
+        """Forget the stamp of a model, or of every model"""
+        with self._lock:
+            if model is None:
+                self._stamps.clear()
+            else:
+                self._stamps.pop(model._meta.label, None)
+
+
+class ChartCache:
+    """
+    Two-tier cache of rendered charts.
+
+    Entries live in an in-process LRU and, when a directory is configured, in
+    files shared between processes. Keys are content addressed: they include
+    the data version, so new data simply misses and stale entries age out of
+    the LRU or are replaced on disk.
+    """
+
+    def __init__(self, max_entries=None, directory=None):
+        self.max_entries = max_entries if max_entries is not None else settings.CHART_CACHE_MAX_ENTRIES
+        directory = directory if directory is not None else settings.CHART_CACHE_DIR
+        self.directory = Path(directory) if directory else None
+        self.versions = DataVersion()
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _digest(value):
+        return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()[:32]
+
+    def key(self, chart, params, models):
+        """Return the (entry prefix, key) of a chart at the current data version and format"""
+        prefix = f'{chart}-{chart_format.get()}-{self._digest(params)}'
+        return prefix, f'{prefix}-{self._digest(self.versions.version(models))}'
+
+    def get(self, key):
+        """Return a cached chart from memory or disk, or None"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+        value = self._read_file(key)
+        if value is not None:
+            self._remember(key, value)
+            with self._lock:
+                self.hits += 1
+            return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, prefix, key, value):
+        """Store a rendered chart in both tiers"""
+        self._remember(key, value)
+        self._write_file(prefix, key, value)
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _read_file(self, key):
+        if self.directory is None:
+            return None
+        try:
+            return (self.directory / f'{key}.b64').read_text()
+        except OSError:
+            return None
+
+    def _write_file(self, prefix, key, value):
+        if self.directory is None:
+            return
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            # Write then rename so other processes never read a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                f.write(value)
+            os.replace(tmp_path, self.directory / f'{key}.b64')
+
+            # Older versions of the same chart can never be hit again
+            for path in self.directory.glob(f'{prefix}-*.b64'):
+                if path.stem != key:
+                    path.unlink(missing_ok=True)
+        except OSError as e:
+            logger.warning(f"Could not write chart cache file for {key}: {e}")
+
+    def clear(self):
+        """Drop every memory entry and data-version stamp"""
+        with self._lock:
+            self._entries.clear()
+        self.versions.invalidate()
+
+
+_chart_cache = None
+_chart_cache_lock = threading.Lock()
+
+
+def get_chart_cache():
+    """Return the process-wide chart cache"""
+    global _chart_cache
+    with _chart_cache_lock:
+        if _chart_cache is None:
+            _chart_cache = ChartCache()
+        return _chart_cache
+
+
+def invalidate(model=None):
+    """Drop the data-version stamp of a model after this process changed it"""
+    get_chart_cache().versions.invalidate(model)
+
+
+def cached_chart(*models):
+    """
+    Cache a base64 chart function on the models it reads.
+
+    The function name and arguments form the cache parameters. Use below
+    @staticmethod. The wrapper exposes ``cache_key(*args, **kwargs)`` and the
+    uncached function as ``__wrapped__`` so charts can be rendered elsewhere
+    and stored under the same key.
+    """
+    def decorator(func):
+        def cache_key(*args, **kwargs):
+            return get_chart_cache().key(func.__qualname__, {'args': list(args), 'kwargs': kwargs}, models)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            cache = get_chart_cache()
+            prefix, key = cache_key(*args, **kwargs)
+            value = cache.get(key)
+            if value is None:
+                value = func(*args, **kwargs)
+                if value:
+                    cache.set(prefix, key, value)
+            return value
+
+        def last_modified():
+            return get_chart_cache().versions.last_modified(models)
+
+        wrapper.cache_key = cache_key
+        wrapper.last_modified = last_modified
+        return wrapper
+    return decorator
@@ -0,0 +1,190 @@
+"""
+zstd-compressed JSON model fields sharing a dictionary trained on trace payloads
+"""
+import threading
+import time
+import zstandard
+from django import forms
+from django.conf import settings
+from django.db import models
+from django.db.models.query_utils import DeferredAttribute
+
+from .serialization import JSONDecoder, JSONEncoder, dumps, loads
+
+# Every zstd frame starts with these bytes; JSON never does, so payloads
+# stored as plain JSON (too small to gain from compression) read back as well
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# dict_id -> ZstdCompressionDict; dictionaries never change once trained
+_dictionaries = {}
+_dictionaries_lock = threading.Lock()
+
+# (monotonic time checked, dict_id) of the dictionary new payloads are compressed with
+_active = (float('-inf'), 0)
+
+# Compressors and decompressors are not safe to share between threads
+_local = threading.local()
+
+
+def get_dictionary(dict_id):
+    """Return the trained dictionary with the given zstd dict_id, loading it on first use"""
+    dictionary = _dictionaries.get(dict_id)
+    if dictionary is None:
+        from .models import CompressionDictionary
+        data = CompressionDictionary.objects.filter(dict_id=dict_id).values_list('data', flat=True).first()
+        if data is None:
+            raise LookupError(f"Compression dictionary {dict_id} does not exist")
+        with _dictionaries_lock:
+            dictionary = _dictionaries.setdefault(dict_id, zstandard.ZstdCompressionDict(bytes(data)))
+    return dictionary
+
+
+def active_dictionary():
+    """
+    dict_id of the newest trained dictionary, 0 when none has been trained.
+
+    The lookup is cached for TRACE_COMPRESSION_DICT_TTL seconds, so other
+    processes switch to a retrained dictionary within that time.
+    """
+    global _active
+    checked_at, dict_id = _active
+    if time.monotonic() - checked_at > settings.TRACE_COMPRESSION_DICT_TTL:
+        from .models import CompressionDictionary
+        dict_id = CompressionDictionary.objects.order_by('-created_at', '-id').values_list('dict_id', flat=True).first() or 0
+        _active = (time.monotonic(), dict_id)
+    return dict_id
+
+
+def reset_active_dictionary():
+    """Look up the active dictionary again on the next compression"""
+    global _active
+    _active = (float('-inf'), 0)
+
+
+def _codec(kind, dict_id):
+    """This thread's compressor or decompressor for dict_id"""
+    codecs = _local.__dict__.setdefault(kind, {})
+    codec = codecs.get(dict_id)
+    if codec is None:
+        dictionary = get_dictionary(dict_id) if dict_id else None
+        # Building a codec digests the dictionary, which is not thread safe
+        with _dictionaries_lock:
+            if kind == 'compressors':
+                codec = zstandard.ZstdCompressor(level=settings.TRACE_COMPRESSION_LEVEL, dict_data=dictionary)
+            else:
+                codec = zstandard.ZstdDecompressor(dict_data=dictionary)
+        codecs[dict_id] = codec
+    return codec
+
+
+def compress_json(data, dict_id=None):
+    """
+    Compress JSON bytes into a zstd frame with dictionary dict_id.
+
+    Without dict_id the active dictionary is used; 0 compresses without one.
+    The frame records its dict_id, so it stays readable after retraining.
+    Payloads that compression would not shrink are kept as plain JSON.
+    """
+    if dict_id is None:
+        dict_id = active_dictionary()
+    frame = _codec('compressors', dict_id).compress(data)
+    return frame if len(frame) < len(data) else data
+
+
+def compress(value, dict_id=None):
+    """Encode a JSON value as stored by CompressedJSONField"""
+    return compress_json(dumps(value), dict_id)
+
+
+def frame_dictionary(data):
+    """dict_id a stored payload was compressed with; 0 for no dictionary or plain JSON"""
+    data = bytes(data)
+    if not data.startswith(ZSTD_MAGIC):
+        return 0
+    return zstandard.get_frame_parameters(data).dict_id
+
+
+def payload_json(data):
+    """The JSON bytes of a stored payload"""
+    data = bytes(data)
+    if not data.startswith(ZSTD_MAGIC):
+        return data
+    return _codec('decompressors', frame_dictionary(data)).decompress(data)
+
+
+def decompress(data):
+    """Decode a payload stored by CompressedJSONField"""
+    return loads(payload_json(data))
+
+
+class CompressedJSONDescriptor(DeferredAttribute):
+    """
+    Decompresses a loaded payload the first time the attribute is read.
+
+    Rows load with the stored bytes in the instance ``__dict__``; reading the
+    attribute decodes and caches the value. Rows whose payloads are never
+    read, like those of list pages, never pay for decompression.
+    """
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        value = super().__get__(instance, cls)
+        if isinstance(value, (bytes, memoryview)):
+            value = instance.__dict__[self.field.attname] = decompress(value)
+        return value
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = value
+
+
+class CompressedJSONField(models.BinaryField):
+    """
+    A JSON value stored as a zstd frame in a binary column.
+
+    Values are compressed with the shared dictionary trained by
+    ``manage.py train_compression_dictionary`` and decompressed lazily on
+    attribute access. The column is opaque to the database, so unlike
+    JSONField it supports no key lookups in queries, and ``values()`` returns
+    the stored bytes (``decompress`` decodes them).
+    """
+    description = "JSON compressed with zstd"
+    descriptor_class = CompressedJSONDescriptor
+    empty_values = [None, '', [], (), {}]
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('editable', True)
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if kwargs.get('editable'):
+            del kwargs['editable']
+        return name, path, args, kwargs
+
+    def pre_save(self, model_instance, add):
+        # A payload that was loaded but never read is saved back as stored
+        return model_instance.__dict__.get(self.attname)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if value is None:
+            return None
+        if not isinstance(value, (bytes, memoryview)):
+            value = compress(value)
+        return connection.Database.Binary(value)
+
+    def to_python(self, value):
+        if isinstance(value, (bytes, memoryview)):
+            return decompress(value)
+        return value
+
+    def value_to_string(self, obj):
+        return self.value_from_object(obj)
+
+    def formfield(self, **kwargs):
+        return super().formfield(**{
+            'form_class': forms.JSONField,
+            'encoder': JSONEncoder,
+            'decoder': JSONDecoder,
+            **kwargs,
+        })
@@ -0,0 +1,102 @@
+"""
+Downsampling of time series and scatter data to a point budget
+"""
+import numpy as np
+
+METHODS = ('lttb', 'minmax')
+
+# Fewer points cannot keep both end points plus one bucket
+MIN_POINTS = 3
+
+
+def _as_float(x):
+    """Return x values as float64, with datetimes as integer timestamps"""
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        x = x.astype('datetime64[us]').astype(np.int64)
+    return x.astype(np.float64)
+
+
+def lttb(x, y, max_points):
+    """
+    Return the indices kept by Largest-Triangle-Three-Buckets.
+
+    The first and last points are always kept. The points in between are
+    split into max_points - 2 buckets of equal size, and each bucket keeps
+    the point forming the largest triangle with the previously kept point
+    and the average of the next bucket, which preserves the visual shape of
+    a line. x must be sorted.
+    """
+    n = len(x)
+    if n <= max_points:
+        return np.arange(n)
+
+    x = _as_float(x)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, n - 1, max_points - 1).astype(np.int64)
+
+    indices = np.empty(max_points, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+    kept = 0
+    for i in range(max_points - 2):
+        start, end = edges[i], edges[i + 1]
+        # The last bucket looks ahead to the final point
+        next_start, next_end = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        areas = np.abs(
+            (x[kept] - avg_x) * (y[start:end] - y[kept])
+            - (x[kept] - x[start:end]) * (avg_y - y[kept])
+        )
+        kept = start + int(np.argmax(areas))
+        indices[i + 1] = kept
+    return indices
+
+
+def minmax(x, y, max_points):
+    """
+    Return the indices of the lowest and highest point of each bucket.
+
+    The x range is split into max_points // 2 buckets of equal width, so
+    outliers survive downsampling and gaps in time stay visible. x must be
+    sorted.
+    """
+    n = len(x)
+    if n <= max_points:
+        return np.arange(n)
+
+    x = _as_float(x)
+    y = np.asarray(y, dtype=np.float64)
+    bucket_count = max(max_points // 2, 1)
+    edges = np.linspace(x[0], x[-1], bucket_count + 1)
+    buckets = np.clip(np.searchsorted(edges, x, side='right') - 1, 0, bucket_count - 1)
+
+    # Sorting by bucket then y puts each bucket's min first and max last
+    order = np.lexsort((y, buckets))
+    sorted_buckets = buckets[order]
+    boundaries = sorted_buckets[1:] != sorted_buckets[:-1]
+    firsts = order[np.concatenate(([True], boundaries))]
+    lasts = order[np.concatenate((boundaries, [True]))]
+    return np.union1d(firsts, lasts)
+
+
+def downsample(x, y, max_points, method='lttb'):
+    """
+    Return the sorted indices of at most max_points points to keep.
+
+    Points with a missing y value are dropped first. Use 'lttb' for line
+    series and 'minmax' for scatter data.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown downsampling method: {method}")
+
+    y = np.asarray(y, dtype=np.float64)
+    valid = np.flatnonzero(~np.isnan(y))
+    if len(valid) < len(y):
+        x, y = np.asarray(x)[valid], y[valid]
+
+    max_points = max(int(max_points), MIN_POINTS)
+    kept = lttb(x, y, max_points) if method == 'lttb' else minmax(x, y, max_points)
+    return valid[kept]
@@ -0,0 +1,296 @@
+"""
+Batch runs of ChatExample regression suites through the tracer pipeline
+"""
+import asyncio
+import logging
+import threading
+import time
+import uuid
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+
+from .ingestion import build_record, write_records
+from .langsmith_utils import AsyncTracerManager
+from .models import ChatExample, ChatTrace, TraceStep
+from .similarity import METRICS, score_pairs
+from .spans import PATH_SEGMENT_WIDTH
+
+logger = logging.getLogger(__name__)
+
+EXAMPLE_FIELDS = ('id', 'title', 'input_prompt', 'expected_response', 'tags')
+
+RUN_CACHE_KEY = 'tracegptapp:example_run:{}'
+
+# Held while a background run is in progress; a process runs one at a time
+_background_run = threading.Lock()
+
+
+def select_examples(tags=None, limit=None):
+    """
+    Return the examples of a suite as dicts, optionally only those carrying any of tags.
+
+    Tags are stored as a comma-separated string, so they are matched in Python
+    rather than with a substring filter.
+    """
+    examples = ChatExample.objects.order_by('id').values(*EXAMPLE_FIELDS)
+    if tags:
+        tags = set(tags)
+        examples = [example for example in examples if tags & set(example['tags'] or [])]
+    else:
+        examples = list(examples)
+    return examples[:limit] if limit else examples
+
+
+class ExampleRunner:
+    """
+    Runs examples through AsyncTracerManager with a fixed pool of workers.
+
+    ``concurrency`` worker coroutines pull examples from a shared iterator,
+    so at most that many pipelines are in flight. Finished traces are
+    buffered and written with ``write_records`` in batches of ``batch_size``
+    while the workers keep going.
+    """
+
+    def __init__(self, concurrency=None, batch_size=None, tracer=None):
+        self.concurrency = concurrency or settings.EXAMPLE_RUN_CONCURRENCY
+        self.batch_size = batch_size or settings.TRACE_BULK_CHUNK_SIZE
+        self.tracer = tracer or AsyncTracerManager()
+        self.run_label = str(uuid.uuid4())
+        self._pending = []
+        self._writes = []
+        self.persisted = 0
+
+    async def _run_example(self, example):
+        """Run one example and return its result"""
+        tracer = self.tracer
+        started = time.perf_counter()
+        metadata = {'source': 'run_examples', 'example_id': example['id'], 'run_label': self.run_label}
+        run_tree = tracer.start_trace(example['input_prompt'], metadata)
+        try:
+            results = await tracer.arun_pipeline(run_tree, example['input_prompt'], example['expected_response'])
+            trace_data = tracer.end_trace(run_tree, results['postprocess_response'])
+        except Exception as e:
+            logger.warning(f"Example {example['id']} failed: {e}")
+            # end_trace frees the spans of finished traces, failed ones are freed here
+            tracer.discard_trace(run_tree)
+            return {'example_id': example['id'], 'tags': list(example['tags'] or []), 'status': 'error',
+                    'latency': time.perf_counter() - started, 'similarity': None, 'error': str(e)}
+
+        latency = time.perf_counter() - started
+        evaluation = results['evaluate_response']
+        self._pending.append(build_record(
+            # The metadata is stored with the trace so a run's traces can be found again
+            dict(trace_data, metadata=metadata),
+            input_prompt=example['input_prompt'],
+            output_response=results['generate_response'],
+            status='success',
+            runtime_seconds=latency,
+            tags=list(example['tags'] or []),
+        ))
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+
+        return {
+            'example_id': example['id'],
+            'tags': list(example['tags'] or []),
+            'status': 'success',
+            'latency': latency,
+            'similarity': evaluation.get('similarity_to_expected'),
+            'scores': evaluation.get('similarity') or {},
+        }
+
+    def _flush(self):
+        """Start writing the buffered traces in a worker thread"""
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        self._writes.append(asyncio.ensure_future(sync_to_async(write_records)(batch, batch_size=self.batch_size)))
+
+    async def arun(self, examples):
+        """Run every example and return the run report"""
+        examples = list(examples)
+        pending = iter(examples)
+        results = []
+
+        async def worker():
+            # Workers share one iterator, so every example is taken exactly once
+            for example in pending:
+                results.append(await self._run_example(example))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(min(self.concurrency, len(examples)) or 1)))
+        self._flush()
+        for traces in await asyncio.gather(*self._writes):
+            self.persisted += len(traces)
+        elapsed = time.perf_counter() - started
+
+        return self.report(results, elapsed)
+
+    def run(self, examples):
+        """Run every example from synchronous code and return the run report"""
+        return asyncio.run(self.arun(examples))
+
+    def report(self, results, elapsed):
+        """Summarize throughput, latency and similarity of a run"""
+        succeeded = [result for result in results if result['status'] == 'success']
+        report = {
+            'run_label': self.run_label,
+            'examples': len(results),
+            'succeeded': len(succeeded),
+            'failed': len(results) - len(succeeded),
+            'persisted': self.persisted,
+            'concurrency': self.concurrency,
+            'elapsed_seconds': round(elapsed, 3),
+            'throughput_per_second': round(len(results) / elapsed, 2) if elapsed else 0,
+            'latency': _distribution([result['latency'] for result in succeeded]),
+            'similarity': _distribution([result['similarity'] for result in succeeded]),
+            'metrics': {
+                metric: _distribution([result['scores'].get(metric) for result in succeeded])
+                for metric in METRICS
+            },
+            'by_tag': {},
+        }
+
+        by_tag = {}
+        for result in succeeded:
+            for tag in result['tags'] or ['untagged']:
+                by_tag.setdefault(tag, []).append(result)
+        for tag, tag_results in sorted(by_tag.items()):
+            report['by_tag'][tag] = {
+                'examples': len(tag_results),
+                'latency': _distribution([result['latency'] for result in tag_results]),
+                'similarity': _distribution([result['similarity'] for result in tag_results]),
+            }
+
+        report['errors'] = [
+            {'example_id': result['example_id'], 'error': result['error']}
+            for result in results if result['status'] == 'error'
+        ]
+        return report
+
+
+def start_background_run(examples, concurrency=None):
+    """
+    Run examples in a background thread and return the run label.
+
+    The run's status, and its report once finished, are kept in the cache
+    for EXAMPLE_RUN_REPORT_TTL seconds (see ``get_run_status``). Raises
+    RuntimeError while another background run of this process is in progress.
+    """
+    if not _background_run.acquire(blocking=False):
+        raise RuntimeError('An example run is already in progress')
+
+    try:
+        runner = ExampleRunner(concurrency=concurrency)
+        key = RUN_CACHE_KEY.format(runner.run_label)
+        cache.set(key, {'run_label': runner.run_label, 'status': 'running', 'examples': len(examples)},
+                  settings.EXAMPLE_RUN_REPORT_TTL)
+    except BaseException:
+        _background_run.release()
+        raise
+
+    def run():
+        status = {'run_label': runner.run_label, 'examples': len(examples)}
+        try:
+            status.update(status='finished', report=runner.run(examples))
+        except Exception as e:
+            logger.exception(f"Example run {runner.run_label} failed")
+            status.update(status='failed', error=str(e))
+        finally:
+            cache.set(key, status, settings.EXAMPLE_RUN_REPORT_TTL)
+            close_old_connections()
+            _background_run.release()
+
+    threading.Thread(target=run, name=f'example-run-{runner.run_label[:8]}', daemon=True).start()
+    return runner.run_label
+
+
+def get_run_status(run_label):
+    """Status of a background run, with its report once finished; None when unknown or expired"""
+    return cache.get(RUN_CACHE_KEY.format(run_label))
+
+
+def _distribution(values):
+    """Mean, percentiles and extremes of the non-missing values"""
+    values = np.array([value for value in values if value is not None], dtype=np.float64)
+    if not len(values):
+        return {'count': 0}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        'count': int(len(values)),
+        'mean': round(float(values.mean()), 4),
+        'min': round(float(values.min()), 4),
+        'p50': round(float(p50), 4),
+        'p95': round(float(p95), 4),
+        'p99': round(float(p99), 4),
+        'max': round(float(values.max()), 4),
+    }
+
+
+def rescore_evaluation_steps(steps):
+    """
+    Recompute the similarity scores stored on evaluation TraceSteps.
+
+    The (response, expected) pairs of all steps are scored in one batch and
+    written back to ``output_data['evaluation']``. Steps without an
+    expected response are left alone. Returns the rescored steps, unsaved;
+    ``sync_trace_children`` brings their traces' ``trace_data`` in line.
+    """
+    pairs = []
+    for step in steps:
+        inputs = step.input_data or {}
+        if inputs.get('expected'):
+            pairs.append((step, inputs.get('response') or '', inputs['expected']))
+    if not pairs:
+        return []
+
+    scores = score_pairs([response for _, response, _ in pairs], [expected for _, _, expected in pairs])
+    rescored = []
+    for i, (step, _, _) in enumerate(pairs):
+        step_scores = {metric: float(scores[metric][i]) for metric in METRICS}
+        output_data = dict(step.output_data or {})
+        evaluation = dict(output_data.get('evaluation') or {})
+        evaluation['similarity_to_expected'] = step_scores['overlap']
+        evaluation['similarity'] = step_scores
+        output_data['evaluation'] = evaluation
+        step.output_data = output_data
+        rescored.append(step)
+    return rescored
+
+
+def _child_key(run_id, path):
+    """Match a trace_data child to its TraceStep by run id, or by path for steps stored without one"""
+    return ('id', run_id) if run_id else ('path', path)
+
+
+def sync_trace_children(steps):
+    """
+    Copy the ``output_data`` of steps into the matching children of their traces' ``trace_data``.
+
+    Children are matched the way ``build_rows`` created the steps from them.
+    Returns the traces whose ``trace_data`` changed, unsaved, to be written
+    in the same transaction as the steps.
+    """
+    outputs = {}
+    for step in steps:
+        outputs.setdefault(step.trace_id, {})[_child_key(step.run_id, step.path)] = step.output_data
+    if not outputs:
+        return []
+
+    updated = []
+    for trace in ChatTrace.objects.filter(id__in=outputs).only('id', 'trace_data').order_by('id'):
+        trace_outputs = outputs[trace.id]
+        children = list((trace.trace_data or {}).get('children') or [])
+        changed = False
+        for position, child in enumerate(children, 1):
+            key = _child_key(child.get('id'), child.get('path') or f"{position:0{PATH_SEGMENT_WIDTH}d}")
+            if key in trace_outputs and child.get('outputs') != trace_outputs[key]:
+                children[position - 1] = dict(child, outputs=trace_outputs[key])
+                changed = True
+        if changed:
+            trace.trace_data = dict(trace.trace_data, children=children)
+            updated.append(trace)
+    return updated
@@ -0,0 +1,293 @@
+"""
+Process-wide LangSmith client and a background exporter that ships finished
+spans to the LangSmith batch ingestion endpoint
+"""
+import atexit
+import logging
+import random
+import threading
+import time
+from collections import deque
+from datetime import timezone as dt_timezone
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from langsmith import Client
+
+from .serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+# Responses worth retrying; other errors mean the batch itself was rejected
+RETRYABLE_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+
+
+def build_session(pool_size):
+    """Return a requests session keeping up to pool_size connections per host alive"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+_session = None
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_http_session():
+    """Return the process-wide pooled HTTP session used for LangSmith"""
+    global _session
+    with _client_lock:
+        if _session is None:
+            _session = build_session(settings.LANGSMITH_HTTP_POOL_SIZE)
+        return _session
+
+
+def get_langsmith_client():
+    """Return the process-wide LangSmith client, sharing the pooled HTTP session"""
+    global _client
+    session = get_http_session()
+    with _client_lock:
+        if _client is None:
+            _client = Client(
+                api_url=settings.LANGSMITH_ENDPOINT,
+                api_key=settings.LANGSMITH_API_KEY or None,
+                session=session,
+                # Spans are shipped by SpanExporter rather than the client's own batcher
+                auto_batch_tracing=False,
+            )
+        return _client
+
+
+def _dotted_order_part(start_time, run_id):
+    """One segment of a LangSmith dotted order: UTC start time followed by the run id"""
+    start = parse_datetime(start_time) if isinstance(start_time, str) else start_time
+    start = start or timezone.now()
+    if timezone.is_naive(start):
+        start = timezone.make_aware(start, dt_timezone.utc)
+    start = start.astimezone(dt_timezone.utc)
+    return f"{start:%Y%m%dT%H%M%S%fZ}{run_id}"
+
+
+def trace_to_runs(trace_data, project_name):
+    """Convert the dict emitted by TracerManager.end_trace into LangSmith run payloads"""
+    root_id = trace_data['id']
+    root_order = _dotted_order_part(trace_data.get('start_time'), root_id)
+    runs = [{
+        'id': root_id,
+        'trace_id': root_id,
+        'dotted_order': root_order,
+        'name': trace_data.get('name'),
+        'run_type': trace_data.get('run_type'),
+        'inputs': trace_data.get('inputs') or {},
+        'outputs': trace_data.get('outputs') or {},
+        'start_time': trace_data.get('start_time'),
+        'end_time': trace_data.get('end_time'),
+        'session_name': project_name,
+        'extra': {'metadata': trace_data.get('metadata') or {}},
+    }]
+    # Children come in tree order, so every parent's dotted order is known before its children's
+    dotted_orders = {root_id: root_order}
+    for child in trace_data.get('children') or []:
+        parent_id = child.get('parent_id') or root_id
+        dotted_order = f"{dotted_orders[parent_id]}.{_dotted_order_part(child.get('start_time'), child['id'])}"
+        dotted_orders[child['id']] = dotted_order
+        runs.append({
+            'id': child['id'],
+            'trace_id': root_id,
+            'parent_run_id': parent_id,
+            'dotted_order': dotted_order,
+            'name': child.get('name'),
+            'run_type': child.get('run_type'),
+            'inputs': child.get('inputs') or {},
+            'outputs': child.get('outputs') or {},
+            'start_time': child.get('start_time'),
+            'end_time': child.get('end_time'),
+            'session_name': project_name,
+        })
+    return runs
+
+
+class SpanExporter:
+    """
+    Ships finished spans to ``<endpoint>/runs/batch`` from a background thread.
+
+    ``submit`` only appends to an in-memory buffer, so the request path never
+    waits on the network. The buffer is bounded and drops its oldest spans
+    when full. The worker sends a batch as soon as ``batch_size`` spans are
+    buffered, or whatever is buffered every ``flush_interval`` seconds, and
+    retries failed requests with exponential backoff and full jitter.
+    """
+
+    def __init__(self, endpoint, api_key=None, session=None, max_size=10000, batch_size=100,
+                 flush_interval=1.0, max_retries=5, backoff=0.5, max_backoff=30.0, timeout=10.0):
+        self.url = endpoint.rstrip('/') + '/runs/batch'
+        self.api_key = api_key
+        self.session = session or build_session(1)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self._buffer = deque(maxlen=max_size)
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._flush_requested = False
+        self._stopping = False
+        self._worker = None
+        self.exported = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def start(self):
+        """Start the worker thread"""
+        if self._worker is not None:
+            return
+        self._stopping = False
+        self._worker = threading.Thread(target=self._run, name='span-exporter', daemon=True)
+        self._worker.start()
+
+    def submit(self, spans):
+        """Buffer spans for export, dropping the oldest buffered spans when full"""
+        with self._condition:
+            overflow = len(self._buffer) + len(spans) - self._buffer.maxlen
+            if overflow > 0:
+                self.dropped += overflow
+            self._buffer.extend(spans)
+            if len(self._buffer) >= self.batch_size:
+                self._condition.notify()
+
+    def submit_trace(self, trace_data, project_name):
+        """Buffer the root run and child runs of a finished trace"""
+        self.submit(trace_to_runs(trace_data, project_name))
+
+    def pending(self):
+        """Number of spans buffered or being sent"""
+        with self._condition:
+            return len(self._buffer) + self._in_flight
+
+    def _next_batch(self):
+        """Wait for a full batch, the flush interval, a flush or shutdown, then take up to batch_size spans"""
+        with self._condition:
+            if len(self._buffer) < self.batch_size and not (self._stopping or self._flush_requested):
+                self._condition.wait(self.flush_interval)
+            batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+            if not self._buffer:
+                self._flush_requested = False
+            self._in_flight = len(batch)
+            return batch
+
+    def _retry_delay(self, attempt, response=None):
+        """Exponential backoff with full jitter, at least as long as a Retry-After header asks"""
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                delay = max(delay, min(float(retry_after), self.max_backoff))
+            except ValueError:
+                pass
+        return delay
+
+    def _send(self, batch):
+        """POST a batch, retrying connection errors and retryable statuses"""
+        body = dumps({'post': batch})
+        headers = {'Content-Type': 'application/json'}
+        if self.api_key:
+            headers['x-api-key'] = self.api_key
+
+        for attempt in range(self.max_retries + 1):
+            response = None
+            try:
+                response = self.session.post(self.url, data=body, headers=headers, timeout=self.timeout)
+                if response.status_code < 300:
+                    return True
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    logger.error(f"LangSmith rejected {len(batch)} spans: HTTP {response.status_code} {response.text[:200]}")
+                    return False
+                error = f"HTTP {response.status_code}"
+            except requests.RequestException as e:
+                error = str(e)
+
+            if attempt < self.max_retries:
+                delay = self._retry_delay(attempt, response)
+                logger.warning(f"Exporting {len(batch)} spans failed ({error}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+
+        logger.error(f"Giving up on {len(batch)} spans after {self.max_retries + 1} attempts")
+        return False
+
+    def _run(self):
+        """Worker loop"""
+        while True:
+            batch = self._next_batch()
+            if batch:
+                sent = self._send(batch)
+                with self._condition:
+                    if sent:
+                        self.exported += len(batch)
+                    else:
+                        self.failed += len(batch)
+                    self._in_flight = 0
+                    self._condition.notify_all()
+                continue
+            with self._condition:
+                if self._stopping and not self._buffer:
+                    break
+
+    def flush(self, timeout=10):
+        """Send every buffered span now and wait until they are sent or given up on"""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            self._flush_requested = True
+            self._condition.notify_all()
+            while (self._buffer or self._in_flight) and time.monotonic() < deadline:
+                self._condition.wait(min(0.05, max(deadline - time.monotonic(), 0)))
+            return not (self._buffer or self._in_flight)
+
+    def shutdown(self, timeout=10):
+        """Send the remaining spans, then stop the worker"""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        if self._worker is not None:
+            self._worker.join(timeout)
+            self._worker = None
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def export_enabled():
+    """Whether spans are exported; LANGSMITH_EXPORT=None exports whenever an API key is set"""
+    if settings.LANGSMITH_EXPORT is None:
+        return bool(settings.LANGSMITH_API_KEY)
+    return settings.LANGSMITH_EXPORT
+
+
+def get_span_exporter():
+    """Return the process-wide span exporter, starting it on first use, or None when export is disabled"""
+    global _exporter
+    if not export_enabled():
+        return None
+    with _exporter_lock:
+        if _exporter is None:
+            _exporter = SpanExporter(
+                settings.LANGSMITH_ENDPOINT,
+                api_key=settings.LANGSMITH_API_KEY or None,
+                session=get_http_session(),
+                max_size=settings.LANGSMITH_EXPORT_QUEUE_SIZE,
+                batch_size=settings.LANGSMITH_EXPORT_BATCH_SIZE,
+                flush_interval=settings.LANGSMITH_EXPORT_FLUSH_INTERVAL,
+                max_retries=settings.LANGSMITH_EXPORT_MAX_RETRIES,
+                backoff=settings.LANGSMITH_EXPORT_BACKOFF,
+                timeout=settings.LANGSMITH_EXPORT_TIMEOUT,
+            )
+            _exporter.start()
+            atexit.register(_exporter.shutdown)
+        return _exporter
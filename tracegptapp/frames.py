@@ -0,0 +1,152 @@
+"""
+Vectorized loading of querysets into typed pandas DataFrames
+"""
+import numpy as np
+import pandas as pd
+from django.db import models
+from django.utils import timezone
+
+DEFAULT_CHUNK_SIZE = 5000
+
+# Columns loaded as pandas categoricals regardless of their model field
+CATEGORICAL_FIELDS = {'status', 'step_type', 'granularity'}
+
+
+def _column_kind(queryset, name):
+    """Return 'float', 'int', 'datetime', 'category' or 'object' for a column"""
+    if name in CATEGORICAL_FIELDS:
+        return 'category'
+
+    annotation = queryset.query.annotations.get(name)
+    if annotation is not None:
+        field = getattr(annotation, 'output_field', None)
+    else:
+        fields = {field.attname: field for field in queryset.model._meta.concrete_fields}
+        field = fields.get(name)
+
+    if isinstance(field, models.ForeignKey):
+        field = field.target_field
+    if isinstance(field, (models.DateTimeField,)):
+        return 'datetime'
+    if isinstance(field, (models.FloatField, models.DecimalField)):
+        return 'float'
+    if isinstance(field, (models.IntegerField, models.AutoField)):
+        return 'int'
+    # Multi-select fields are CharFields with choices but hold lists
+    if type(field) is models.CharField and field.choices:
+        return 'category'
+    return 'object'
+
+
+class _ColumnBuffer:
+    """Preallocated NumPy storage for one column"""
+
+    def __init__(self, kind, size):
+        self.kind = kind
+        if kind == 'category':
+            self.codes = {}
+            self.values = np.empty(size, dtype=np.int32)
+        elif kind == 'float':
+            self.values = np.empty(size, dtype=np.float64)
+        elif kind == 'int':
+            # Integers are stored as floats so NULLs survive as NaN
+            self.values = np.empty(size, dtype=np.float64)
+        elif kind == 'datetime':
+            self.values = np.empty(size, dtype='datetime64[us]')
+        else:
+            self.values = np.empty(size, dtype=object)
+
+    def fill(self, start, column):
+        """Copy a chunk of values into the buffer starting at index start"""
+        end = start + len(column)
+        if self.kind == 'category':
+            codes = self.codes
+            self.values[start:end] = [
+                -1 if value is None else codes.setdefault(value, len(codes)) for value in column
+            ]
+        elif self.kind == 'datetime':
+            # Convert the chunk at once to naive UTC
+            self.values[start:end] = pd.to_datetime(list(column), utc=True).tz_localize(None).to_numpy('datetime64[us]')
+        elif self.kind in ('float', 'int'):
+            self.values[start:end] = np.array(column, dtype=np.float64)
+        else:
+            # fromiter keeps list values (e.g. tags) as single objects
+            self.values[start:end] = np.fromiter(column, dtype=object, count=len(column))
+
+    def series(self, size):
+        """Return the filled part of the buffer as a typed pandas column"""
+        values = self.values[:size]
+        if self.kind == 'category':
+            return pd.Categorical.from_codes(values, categories=list(self.codes))
+        if self.kind == 'datetime':
+            return pd.DatetimeIndex(values).tz_localize('UTC')
+        if self.kind == 'int' and not np.isnan(values).any():
+            return values.astype(np.int64)
+        return values
+
+
+def _chunks(queryset, fields, chunk_size):
+    """Stream values_list rows from the database cursor in lists of chunk_size"""
+    chunk = []
+    for row in queryset.values_list(*fields).iterator(chunk_size=chunk_size):
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _buffers(queryset, fields, size):
+    return [_ColumnBuffer(_column_kind(queryset, name), size) for name in fields]
+
+
+def _to_frame(fields, buffers, size):
+    return pd.DataFrame({name: buffer.series(size) for name, buffer in zip(fields, buffers)}, columns=list(fields))
+
+
+def load_frame(queryset, fields, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Load fields of a queryset into a DataFrame.
+
+    Rows are streamed from the database cursor in chunks and copied column
+    by column into NumPy arrays sized from a COUNT query, without building a
+    dict per row. Datetimes become UTC datetime64 columns, and status,
+    step_type and choice fields become categoricals.
+    """
+    fields = list(fields)
+    size = queryset.count()
+    buffers = _buffers(queryset, fields, size)
+
+    filled = 0
+    for chunk in _chunks(queryset, fields, chunk_size):
+        # Rows inserted after the COUNT are left out
+        chunk = chunk[:size - filled]
+        if not chunk:
+            break
+        for buffer, column in zip(buffers, zip(*chunk)):
+            buffer.fill(filled, column)
+        filled += len(chunk)
+
+    return _to_frame(fields, buffers, filled)
+
+
+def iter_frames(queryset, fields, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yield DataFrames of at most chunk_size rows.
+
+    Use for aggregations whose peak memory should stay bounded by the chunk
+    size rather than the size of the table.
+    """
+    fields = list(fields)
+    for chunk in _chunks(queryset, fields, chunk_size):
+        # Fresh buffers per chunk, so a frame the caller keeps is never overwritten
+        buffers = _buffers(queryset, fields, len(chunk))
+        for buffer, column in zip(buffers, zip(*chunk)):
+            buffer.fill(0, column)
+        yield _to_frame(fields, buffers, len(chunk))
+
+
+def local_naive(series):
+    """Convert a UTC datetime column to naive wall-clock times in the current timezone"""
+    return series.dt.tz_convert(timezone.get_current_timezone()).dt.tz_localize(None)
@@ -0,0 +1,481 @@
+"""
+Trace ingestion: converts finished trace payloads into ChatTrace/TraceStep rows
+and writes them in batches from a background worker pool
+"""
+import atexit
+import glob
+import gzip
+import io
+import logging
+import os
+import queue
+import threading
+import uuid
+import zlib
+import zstandard
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import chart_cache
+from .models import ChatTrace, TraceStep, TraceTag
+from .rollups import RollupManager
+from .serialization import dumps, loads
+from .spans import PATH_SEGMENT_WIDTH
+
+logger = logging.getLogger(__name__)
+
+# Top-level record keys that describe the ChatTrace row rather than the trace tree
+RECORD_FIELDS = ('input_prompt', 'output_response', 'status', 'tags', 'runtime_seconds', 'created_at')
+
+
+def _parse_time(value):
+    """Parse an ISO timestamp into an aware datetime"""
+    if value is None:
+        return None
+    parsed = parse_datetime(value) if isinstance(value, str) else value
+    if parsed is not None and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def build_record(trace_data, **fields):
+    """
+    Build an ingestion record from the dict emitted by TracerManager.end_trace.
+
+    Extra keyword arguments (see RECORD_FIELDS) override the values that would
+    otherwise be derived from the trace tree.
+    """
+    record = dict(trace_data)
+    record.update({key: value for key, value in fields.items() if value is not None})
+    return record
+
+
+def build_rows(record):
+    """Convert an ingestion record into unsaved ChatTrace and TraceStep instances"""
+    trace_data = {key: value for key, value in record.items() if key not in RECORD_FIELDS}
+
+    run_id = trace_data.get('id')
+    if not run_id:
+        raise ValueError("Trace record is missing 'id'")
+
+    start_time = _parse_time(trace_data.get('start_time'))
+    end_time = _parse_time(trace_data.get('end_time'))
+
+    input_prompt = record.get('input_prompt')
+    if input_prompt is None:
+        input_prompt = (trace_data.get('inputs') or {}).get('input', '')
+
+    output_response = record.get('output_response')
+    if output_response is None:
+        output = (trace_data.get('outputs') or {}).get('output', '')
+        output_response = output.get('text', '') if isinstance(output, dict) else output
+
+    runtime_seconds = record.get('runtime_seconds')
+    if runtime_seconds is None:
+        runtime_seconds = (end_time - start_time).total_seconds() if start_time and end_time else 0.0
+
+    chat_trace = ChatTrace(
+        run_id=str(run_id),
+        input_prompt=input_prompt or '',
+        output_response=output_response or '',
+        status=record.get('status', 'success'),
+        tags=record.get('tags') or [],
+        runtime_seconds=float(runtime_seconds),
+        trace_data=trace_data,
+        created_at=_parse_time(record.get('created_at')) or start_time or timezone.now(),
+    )
+
+    steps = []
+    for position, child in enumerate(trace_data.get('children') or [], 1):
+        step_start = _parse_time(child.get('start_time'))
+        step_end = _parse_time(child.get('end_time')) or step_start
+        if step_start is None:
+            raise ValueError(f"Step '{child.get('name')}' is missing 'start_time'")
+        steps.append(TraceStep(
+            step_name=child.get('name', ''),
+            step_type=child.get('run_type', ''),
+            input_data=child.get('inputs'),
+            output_data=child.get('outputs'),
+            start_time=step_start,
+            end_time=step_end,
+            runtime_seconds=(step_end - step_start).total_seconds(),
+            run_id=child.get('id') or '',
+            parent_run_id=child.get('parent_id') or '',
+            # Records from flat traces carry no path; their steps are top level in list order
+            path=child.get('path') or f"{position:0{PATH_SEGMENT_WIDTH}d}",
+            depth=child.get('depth') or 1,
+        ))
+
+    return chat_trace, steps
+
+
+def write_rows(rows, batch_size=None):
+    """Bulk insert (ChatTrace, [TraceStep]) pairs with their tag links and update the rollups"""
+    if not rows:
+        return []
+
+    with transaction.atomic():
+        traces = ChatTrace.objects.bulk_create([trace for trace, _ in rows], batch_size=batch_size)
+
+        steps = []
+        for trace, trace_steps in zip(traces, (trace_steps for _, trace_steps in rows)):
+            for step in trace_steps:
+                step.trace = trace
+                steps.append(step)
+        TraceStep.objects.bulk_create(steps, batch_size=batch_size)
+
+        TraceTag.objects.bulk_create([
+            TraceTag(trace=trace, tag=tag)
+            for trace in traces
+            for tag in sorted(set(trace.tags or []))
+        ], batch_size=batch_size)
+
+        RollupManager.record_traces(traces)
+        RollupManager.record_steps(steps)
+
+    # bulk_create sends no signals, so refresh the chart data versions here
+    chart_cache.invalidate(ChatTrace)
+    chart_cache.invalidate(TraceStep)
+    return traces
+
+
+def write_records(records, batch_size=None):
+    """Bulk insert ingestion records"""
+    return write_rows([build_rows(record) for record in records], batch_size=batch_size)
+
+
+def open_ndjson_stream(stream, content_encoding=None):
+    """Wrap a binary stream so it yields decompressed NDJSON lines incrementally"""
+    content_encoding = (content_encoding or 'identity').strip().lower()
+    if content_encoding in ('gzip', 'x-gzip'):
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+    if content_encoding == 'zstd':
+        reader = zstandard.ZstdDecompressor().stream_reader(stream, read_across_frames=True)
+        return io.BufferedReader(reader)
+    if content_encoding == 'identity':
+        return stream
+    raise ValueError(f"Unsupported content encoding: {content_encoding}")
+
+
+def _write_chunk(chunk, results):
+    """Write a chunk of (index, rows) pairs, falling back to one insert per record on conflicts"""
+    try:
+        write_rows([rows for _, rows in chunk])
+    except IntegrityError:
+        for index, rows in chunk:
+            try:
+                write_rows([rows])
+            except IntegrityError as e:
+                results[index].update(status='rejected', error=f"Integrity error: {str(e)}")
+
+
+def _flush_chunk(chunk, results):
+    """Reject run ids that already exist, then write the rest of the chunk"""
+    if not chunk:
+        return
+    run_ids = [rows[0].run_id for _, rows in chunk]
+    existing = set(ChatTrace.objects.filter(run_id__in=run_ids).values_list('run_id', flat=True))
+
+    pending = []
+    for index, rows in chunk:
+        if rows[0].run_id in existing:
+            results[index].update(status='rejected', error='Duplicate run id')
+        else:
+            pending.append((index, rows))
+    _write_chunk(pending, results)
+
+
+def ingest_ndjson(lines, chunk_size=500):
+    """
+    Ingest an iterable of NDJSON lines (one end_trace-shaped record per line).
+
+    Records are validated as they are read and written with bulk_create every
+    ``chunk_size`` accepted records. Returns a summary with one result per
+    non-empty line; a corrupt stream stops ingestion and is reported in 'error'.
+    """
+    results = []
+    chunk = []
+    seen_run_ids = set()
+    stream_error = None
+
+    try:
+        for line_number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+
+            result = {'line': line_number, 'status': 'accepted'}
+            results.append(result)
+            try:
+                record = loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError('Record must be a JSON object')
+                rows = build_rows(record)
+            except (ValueError, TypeError, AttributeError) as e:
+                result.update(status='rejected', error=str(e))
+                continue
+
+            result['run_id'] = rows[0].run_id
+            if rows[0].run_id in seen_run_ids:
+                result.update(status='rejected', error='Duplicate run id in request')
+                continue
+            seen_run_ids.add(rows[0].run_id)
+
+            chunk.append((len(results) - 1, rows))
+            if len(chunk) >= chunk_size:
+                _flush_chunk(chunk, results)
+                chunk = []
+    except (OSError, EOFError, zlib.error, zstandard.ZstdError) as e:
+        stream_error = f"Could not read request body: {str(e)}"
+
+    _flush_chunk(chunk, results)
+
+    summary = {
+        'accepted': sum(1 for result in results if result['status'] == 'accepted'),
+        'rejected': sum(1 for result in results if result['status'] == 'rejected'),
+        'results': results,
+    }
+    if stream_error:
+        summary['error'] = stream_error
+    return summary
+
+
+def _process_exists(pid):
+    """Whether a process with this pid is running; assumed running where that cannot be checked"""
+    if os.name != 'posix':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class TraceIngestQueue:
+    """
+    Bounded in-memory queue of trace records drained by background workers.
+
+    ``submit`` waits briefly for room (backpressure) and spills the record to
+    an NDJSON file on disk when the buffer stays full. Workers write batches
+    with ``bulk_create`` and write spilled records once the buffer is idle.
+
+    Each process spills to its own file next to ``spill_path``, named with its
+    pid, so processes sharing the path never append to a file another one is
+    reloading. A spill file is renamed before it is read and deleted only once
+    its records are written; files left by processes that exited are picked up
+    by the next reload.
+    """
+
+    def __init__(self, max_size=1000, batch_size=100, workers=2, flush_interval=0.5,
+                 put_timeout=0.05, spill_path=None):
+        self.batch_size = batch_size
+        self.worker_count = workers
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.spill_path = str(spill_path) if spill_path else None
+        self._queue = queue.Queue(maxsize=max_size)
+        self._spill_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._workers = []
+
+    def start(self):
+        """Start the worker threads"""
+        if self._workers:
+            return
+        self._stopping.clear()
+        for i in range(self.worker_count):
+            worker = threading.Thread(target=self._run, name=f'trace-ingest-{i}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, record):
+        """Queue a record for ingestion, spilling to disk under sustained pressure"""
+        try:
+            self._queue.put(record, timeout=self.put_timeout)
+        except queue.Full:
+            if not self.spill_path:
+                raise
+            self._spill([record])
+
+    def pending(self):
+        """Approximate number of records waiting in memory"""
+        return self._queue.qsize()
+
+    def spill_file(self, pid=None):
+        """The spill file of the process with this pid, this process by default"""
+        root, ext = os.path.splitext(self.spill_path)
+        return f"{root}.{os.getpid() if pid is None else pid}{ext}"
+
+    def _spill(self, records):
+        """Append records to this process's spill file"""
+        with self._spill_lock:
+            with open(self.spill_file(), 'a', encoding='utf-8') as spill_file:
+                for record in records:
+                    spill_file.write(dumps(record).decode() + '\n')
+
+    def _claim_spill_files(self):
+        """
+        Rename the spill files this process should reload to names no writer uses.
+
+        These are this process's spill file, files a failed reload of this
+        process left behind, the files of processes that are gone, and a
+        shared file at spill_path itself as written by earlier versions.
+        Returns the claimed paths.
+        """
+        root, _ = os.path.splitext(self.spill_path)
+        pid = os.getpid()
+        claimed = []
+        for path in sorted(glob.glob(f"{glob.escape(root)}.*")):
+            owner = path[len(root) + 1:].split('.')[0]
+            if path == self.spill_path:
+                owner = str(pid)
+            elif not owner.isdigit() or not (path.endswith('.reloading') or path == self.spill_file(owner)):
+                continue
+            if int(owner) != pid and _process_exists(int(owner)):
+                continue
+            if int(owner) == pid and path.endswith('.reloading'):
+                # Left behind by a reload of this process that failed
+                claimed.append(path)
+                continue
+            target = f"{root}.{pid}.{uuid.uuid4().hex}.reloading"
+            try:
+                # Appends to this process's own file are serialized by the spill lock
+                with self._spill_lock:
+                    os.replace(path, target)
+            except FileNotFoundError:
+                # Another process claimed it first
+                continue
+            claimed.append(target)
+        return claimed
+
+    def _reload_spill(self):
+        """Write spilled records to the database, deleting each spill file once it is written"""
+        if not self.spill_path:
+            return
+        with self._reload_lock:
+            for path in self._claim_spill_files():
+                with open(path, 'r', encoding='utf-8') as spill_file:
+                    batch = []
+                    for line in spill_file:
+                        if not line.strip():
+                            continue
+                        try:
+                            batch.append(loads(line))
+                        except ValueError as e:
+                            logger.error(f"Dropping unreadable spilled trace record: {str(e)}")
+                            continue
+                        if len(batch) >= self.batch_size:
+                            self._write_records(batch)
+                            batch = []
+                    self._write_records(batch)
+                os.remove(path)
+
+    def _next_batch(self):
+        """Collect up to batch_size records, waiting at most flush_interval for the first"""
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write_records(self, batch):
+        """Write a batch, retrying record by record so one bad record cannot block the rest"""
+        if not batch:
+            return
+        close_old_connections()
+        try:
+            write_records(batch)
+        except Exception:
+            for record in batch:
+                try:
+                    write_records([record])
+                except (ValueError, IntegrityError) as e:
+                    logger.error(f"Dropping invalid trace record: {str(e)}")
+                except Exception as e:
+                    # Keep the record on disk so it is retried later
+                    logger.error(f"Error ingesting trace {record.get('id')}: {str(e)}")
+                    if self.spill_path:
+                        self._spill([record])
+
+    def _write(self, batch):
+        """Write a batch taken from the in-memory buffer"""
+        try:
+            self._write_records(batch)
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+    def _run(self):
+        """Worker loop"""
+        while True:
+            batch = self._next_batch()
+            if batch:
+                self._write(batch)
+                continue
+            try:
+                self._reload_spill()
+            except Exception as e:
+                # Claimed files stay on disk and are retried on the next idle pass
+                logger.error(f"Error reloading spilled traces: {str(e)}")
+            if self._stopping.is_set() and self._queue.empty():
+                break
+        close_old_connections()
+
+    def drain(self, timeout=30):
+        """Stop the workers once they flush the buffer and spill, then write whatever is left on disk"""
+        self._stopping.set()
+        for worker in self._workers:
+            worker.join(timeout)
+        self._workers = []
+        self._reload_spill()
+
+
+_ingest_queue = None
+_ingest_queue_lock = threading.Lock()
+
+
+def get_ingest_queue():
+    """Return the process-wide ingestion queue, starting it on first use"""
+    global _ingest_queue
+    with _ingest_queue_lock:
+        if _ingest_queue is None:
+            _ingest_queue = TraceIngestQueue(
+                max_size=settings.TRACE_INGEST_QUEUE_SIZE,
+                batch_size=settings.TRACE_INGEST_BATCH_SIZE,
+                workers=settings.TRACE_INGEST_WORKERS,
+                flush_interval=settings.TRACE_INGEST_FLUSH_INTERVAL,
+                put_timeout=settings.TRACE_INGEST_PUT_TIMEOUT,
+                spill_path=settings.TRACE_INGEST_SPILL_PATH,
+            )
+            _ingest_queue.start()
+            atexit.register(_ingest_queue.drain)
+        return _ingest_queue
+
+
+def ingest(record):
+    """Record a finished trace, in the background when TRACE_INGEST_ASYNC is enabled"""
+    if settings.TRACE_INGEST_ASYNC:
+        get_ingest_queue().submit(record)
+        return None
+    return write_records([record])[0]
+
+
+async def aingest(record):
+    """Async counterpart of ingest for use from async views"""
+    if settings.TRACE_INGEST_ASYNC:
+        # submit may wait briefly for buffer room or spill to disk, so keep it off the event loop
+        await sync_to_async(get_ingest_queue().submit, thread_sensitive=False)(record)
+        return None
+    # The write runs in a transaction, which the async ORM cannot span
+    traces = await sync_to_async(write_records)([record])
+    return traces[0]
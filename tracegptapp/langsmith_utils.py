@@ -1,259 +1,382 @@
 """
 LangSmith utilities for tracing and evaluating chatbot responses
 """
-import uuid
+import asyncio
+import contextvars
+import threading
 import time
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from django.conf import settings
 from django.utils import timezone
-from langsmith import Client
-from langsmith.run_trees import RunTree
+
+from .exporter import get_langsmith_client, get_span_exporter
+from .serialization import to_jsonable
+from .similarity import score_pair
+from . import spans
+from .spans import Span, SpanStore
+
+class StageScheduler:
+    """
+    Runs pipeline stages as a DAG.
+    
+    Each stage is called with the results of its dependencies, in the order
+    they are listed, and starts as soon as those dependencies have finished,
+    so independent stages run concurrently. Dependencies must be added before
+    the stages that use them, which keeps the graph acyclic and makes the
+    declaration order a valid topological order.
+    """
+    
+    def __init__(self):
+        self.stages = {}
+        
+    def add(self, name, func, depends_on=()):
+        """Add a stage; func receives the results of depends_on as positional arguments"""
+        if name in self.stages:
+            raise ValueError(f"Stage '{name}' is already defined")
+        missing = [dependency for dependency in depends_on if dependency not in self.stages]
+        if missing:
+            raise ValueError(f"Stage '{name}' depends on undefined stages: {', '.join(missing)}")
+        self.stages[name] = (func, tuple(depends_on))
+        return self
+        
+    @property
+    def stage_names(self):
+        """Stage names in declaration order"""
+        return list(self.stages)
+        
+    def run(self):
+        """Run the stages in worker threads and return a dict of results by stage name"""
+        futures = {}
+        
+        def run_stage(func, depends_on):
+            return func(*[futures[dependency].result() for dependency in depends_on])
+        
+        with ThreadPoolExecutor(max_workers=len(self.stages) or 1, thread_name_prefix='tracer-stage') as executor:
+            for name, (func, depends_on) in self.stages.items():
+                # Each stage runs in a copy of the caller's context so it sees the current span
+                futures[name] = executor.submit(contextvars.copy_context().run, run_stage, func, depends_on)
+            return {name: future.result() for name, future in futures.items()}
+        
+    async def arun(self):
+        """Run coroutine stages as asyncio tasks and return a dict of results by stage name"""
+        tasks = {}
+        
+        async def run_stage(func, depends_on):
+            dependency_results = [await tasks[dependency] for dependency in depends_on]
+            return await func(*dependency_results)
+        
+        for name, (func, depends_on) in self.stages.items():
+            tasks[name] = asyncio.ensure_future(run_stage(func, depends_on))
+        
+        try:
+            results = await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            raise
+        return dict(zip(tasks, results))
 
 class TracerManager:
     """
     Utility class to manage LangSmith tracing for chatbot interactions
     """
     
+    # Simulated latency of each mock pipeline stage, in seconds
+    STAGE_LATENCIES = {
+        "preprocess_input": 0.2,
+        "generate_response": 0.5,
+        "postprocess_response": 0.2,
+        "evaluate_response": 0.3,
+    }
+    
     def __init__(self):
-        # Initialize LangSmith client
-        self.client = Client(
-            api_key=settings.LANGSMITH_API_KEY if settings.LANGSMITH_API_KEY else None
-        )
+        # Share the process-wide LangSmith client and its connection pool
+        self.client = get_langsmith_client()
         # Set project name
         self.project_name = settings.LANGSMITH_PROJECT
-        # Store our child runs separately since RunTree is immutable
-        self.children_map = {}
+        # Span stores of the traces in progress, by root span id; end_trace frees them
+        self.traces = {}
+        # Guards the span stores when stages run in parallel threads
+        self._children_lock = threading.Lock()
         
-    def _prepare_json_data(self, data):
-        """Convert data to JSON serializable format"""
-        if data is None:
-            return None
-            
-        if isinstance(data, dict):
-            return {k: self._prepare_json_data(v) for k, v in data.items()}
-            
-        if isinstance(data, list):
-            return [self._prepare_json_data(item) for item in data]
-            
-        if isinstance(data, (uuid.UUID, datetime)):
-            return str(data)
-            
-        # Handle timezone-aware datetime objects
-        if hasattr(data, 'isoformat'):
-            return data.isoformat()
-            
-        # Return primitive types as-is
-        return data
-    
     def start_trace(self, input_prompt, metadata=None):
-        """Start a new trace for a chatbot interaction"""
-        run_id = str(uuid.uuid4())
-        
-        # Create the root run tree
-        run_tree = RunTree(
-            name="chatbot_interaction",
-            run_type="chain",
-            inputs={"input": input_prompt},
-            run_id=run_id,
-            serialized={
-                "name": "TraceGPT Chatbot Interaction",
-                "metadata": metadata or {},
-            },
-            project_name=self.project_name
-        )
-        
-        # Initialize the children list for this run_id
-        self.children_map[run_id] = []
-        
-        return run_tree
+        """
+        Start a new trace for a chatbot interaction.
+        
+        Returns the root Span, which the pipeline stages take as ``run_tree``.
+        It becomes the current span, so ``tracer.span()`` blocks and
+        ``@traced`` functions called while the trace runs nest under it.
+        """
+        root = Span("chatbot_interaction", "chain", inputs={"input": input_prompt})
+        store = self.traces[root.id] = SpanStore(root, metadata)
+        # Spans opened from here on, and from tasks started here, nest under the root
+        spans.bind(store)
+        return root
     
-    def add_step(self, run_tree, step_name, step_type, inputs=None, outputs=None, start_time=None, end_time=None):
-        """Add a step to the trace"""
-        if start_time is None:
-            start_time = timezone.now()
-            
-        if end_time is None:
-            end_time = timezone.now()
-        
-        # Create a new child RunTree directly
-        child_run_id = str(uuid.uuid4())
-        
-        # Ensure inputs and outputs are properly serializable
-        safe_inputs = self._prepare_json_data(inputs or {})
-        safe_outputs = self._prepare_json_data(outputs or {})
-        
-        child_run = RunTree(
-            name=step_name,
-            run_type=step_type,
-            inputs=safe_inputs,
-            outputs=safe_outputs,
-            start_time=start_time,
-            end_time=end_time,
-            run_id=child_run_id,
-            parent_run_id=run_tree.id,
-            serialized={
-                "name": step_name,
-                "type": step_type,
-            },
-            project_name=self.project_name
-        )
-        
-        # Store the child run in our map
-        if run_tree.id in self.children_map:
-            self.children_map[run_tree.id].append(child_run)
-        else:
-            self.children_map[run_tree.id] = [child_run]
-        
-        return child_run
-        
-    def process_input(self, run_tree, input_text):
-        """Mock preprocessing step"""
-        start_time = timezone.now()
-        time.sleep(0.2)  # Simulate processing time
-        
-        # Simulate preprocessing
-        processed_input = {
+    def add_step(self, run_tree, step_name, step_type, inputs=None, outputs=None, start_time=None, end_time=None,
+                 start_ns=None, end_ns=None):
+        """
+        Add a finished step under run_tree, which may be the root or any span of the trace.
+        
+        Timings are perf_counter_ns readings; start_time and end_time
+        datetimes are accepted as well. Inputs and outputs are stored as given
+        and only made JSON safe when the trace ends.
+        """
+        store = self.traces[run_tree.trace_id]
+        now_ns = time.perf_counter_ns()
+        if start_ns is None:
+            start_ns = store.to_ns(start_time) if start_time is not None else now_ns
+        if end_ns is None:
+            end_ns = store.to_ns(end_time) if end_time is not None else now_ns
+        
+        child = Span(step_name, step_type, inputs or {}, outputs or {}, start_ns, end_ns, parent=run_tree)
+        with self._children_lock:
+            store.children.append(child)
+        
+        return child
+        
+    def _preprocess(self, input_text):
+        """Simulate preprocessing"""
+        return {
             "text": input_text,
             "tokens": len(input_text.split()),
             "processed_at": timezone.now().isoformat()
         }
         
-        end_time = timezone.now()
-        
-        child = self.add_step(
-            run_tree=run_tree,
-            step_name="preprocess_input",
-            step_type="preprocessing",
-            inputs={"raw_input": input_text},
-            outputs={"processed_input": processed_input},
-            start_time=start_time,
-            end_time=end_time
-        )
-        
-        return processed_input
-        
-    def generate_response(self, run_tree, processed_input):
-        """Mock response generation step"""
-        start_time = timezone.now()
-        time.sleep(0.5)  # Simulate thinking time
-        
+    def _mock_response(self, processed_input):
+        """Very simple mock response generator"""
         input_text = processed_input["text"]
         
-        # Very simple mock response generator
         if "hello" in input_text.lower():
-            response = "Hello! How can I assist you today?"
+            return "Hello! How can I assist you today?"
         elif "help" in input_text.lower():
-            response = "I'm here to help. What do you need assistance with?"
+            return "I'm here to help. What do you need assistance with?"
         elif "weather" in input_text.lower():
-            response = "I'm sorry, I don't have access to real-time weather information."
+            return "I'm sorry, I don't have access to real-time weather information."
         elif "name" in input_text.lower():
-            response = "My name is TraceGPT, a demonstration chatbot for tracing interactions."
+            return "My name is TraceGPT, a demonstration chatbot for tracing interactions."
         else:
-            response = "I understand your message, but I'm just a simple mock chatbot for demonstration purposes."
+            return "I understand your message, but I'm just a simple mock chatbot for demonstration purposes."
         
-        end_time = timezone.now()
-        
-        child = self.add_step(
-            run_tree=run_tree,
-            step_name="generate_response",
-            step_type="generation",
-            inputs={"processed_input": processed_input},
-            outputs={"raw_response": response},
-            start_time=start_time,
-            end_time=end_time
-        )
-        
-        return response
-        
-    def postprocess_response(self, run_tree, response_text):
-        """Mock postprocessing step"""
-        start_time = timezone.now()
-        time.sleep(0.2)  # Simulate processing time
-        
-        # Simulate postprocessing
-        processed_response = {
+    def _postprocess(self, response_text):
+        """Simulate postprocessing"""
+        return {
             "text": response_text,
             "tokens": len(response_text.split()),
             "processed_at": timezone.now().isoformat()
         }
         
-        end_time = timezone.now()
+    def _evaluate(self, response, expected=None):
+        """Very simple evaluation (in a real system, this would be more sophisticated)"""
+        evaluation = {
+            "correctness": 0.8,
+            "relevance": 0.75,
+            "helpfulness": 0.7,
+            "overall_score": 0.75
+        }
+        
+        if expected:
+            # Compare with expected response; overlap is the original similarity score
+            scores = score_pair(response, expected)
+            evaluation["similarity_to_expected"] = scores["overlap"]
+            evaluation["similarity"] = scores
+        
+        return evaluation
+        
+    def process_input(self, run_tree, input_text):
+        """Mock preprocessing step"""
+        with self.span("preprocess_input", "preprocessing", inputs={"raw_input": input_text}, parent=run_tree) as step:
+            time.sleep(self.STAGE_LATENCIES["preprocess_input"])  # Simulate processing time
+            
+            processed_input = self._preprocess(input_text)
+            
+            step.outputs = {"processed_input": processed_input}
+        
+        return processed_input
+        
+    def generate_response(self, run_tree, processed_input):
+        """Mock response generation step"""
+        with self.span("generate_response", "generation", parent=run_tree,
+                       inputs={"processed_input": processed_input}) as step:
+            time.sleep(self.STAGE_LATENCIES["generate_response"])  # Simulate thinking time
+            
+            response = self._mock_response(processed_input)
+            
+            step.outputs = {"raw_response": response}
+        
+        return response
         
-        child = self.add_step(
-            run_tree=run_tree,
-            step_name="postprocess_response",
-            step_type="postprocessing",
-            inputs={"raw_response": response_text},
-            outputs={"final_response": processed_response},
-            start_time=start_time,
-            end_time=end_time
-        )
+    def postprocess_response(self, run_tree, response_text):
+        """Mock postprocessing step"""
+        with self.span("postprocess_response", "postprocessing", parent=run_tree,
+                       inputs={"raw_response": response_text}) as step:
+            time.sleep(self.STAGE_LATENCIES["postprocess_response"])  # Simulate processing time
+            
+            processed_response = self._postprocess(response_text)
+            
+            step.outputs = {"final_response": processed_response}
         
         return processed_response
         
     def end_trace(self, run_tree, final_output):
-        """End the trace and save results"""
-        # Create a dictionary for our final trace data
-        trace_data = {
-            "id": str(run_tree.id),
-            "name": run_tree.name,
-            "run_type": run_tree.run_type,
-            "start_time": run_tree.start_time.isoformat() if run_tree.start_time else None,
-            "end_time": timezone.now().isoformat(),
-            "inputs": self._prepare_json_data(run_tree.inputs),
-            "outputs": {"output": self._prepare_json_data(final_output)},
-            "children": []
-        }
-        
-        # Add children from our map
-        child_runs = self.children_map.get(run_tree.id, [])
-        for child in child_runs:
-            child_data = {
-                "id": str(child.id),
-                "name": child.name,
-                "run_type": child.run_type,
-                "start_time": child.start_time.isoformat() if child.start_time else None,
-                "end_time": child.end_time.isoformat() if child.end_time else None,
-                "inputs": self._prepare_json_data(child.inputs),
-                "outputs": self._prepare_json_data(child.outputs),
-            }
-            trace_data["children"].append(child_data)
+        """End the trace, free its spans and return the trace data"""
+        store = self.traces.pop(run_tree.id)
+        spans.unbind(store)
+        run_tree.end_ns = time.perf_counter_ns()
+        run_tree.outputs = {"output": final_output}
+        # One orjson round trip makes the whole trace JSON safe
+        trace_data = to_jsonable(store.to_dict())
+        
+        # Only buffers the spans; the exporter thread sends them
+        exporter = get_span_exporter()
+        if exporter is not None:
+            exporter.submit_trace(trace_data, self.project_name)
         
         return trace_data
         
-    def evaluate_response(self, run_tree, response, expected=None):
-        """Mock evaluation of the response"""
-        start_time = timezone.now()
-        time.sleep(0.3)  # Simulate evaluation time
+    def discard_trace(self, run_tree):
+        """Free the spans of a trace that will not be ended"""
+        store = self.traces.pop(run_tree.id, None)
+        if store is not None:
+            spans.unbind(store)
         
-        # Very simple evaluation (in a real system, this would be more sophisticated)
-        evaluation = {
-            "correctness": 0.8,
-            "relevance": 0.75,
-            "helpfulness": 0.7,
-            "overall_score": 0.75
-        }
+    def span(self, name, run_type="chain", inputs=None, parent=None):
+        """
+        Context manager recording a block as a span of the current trace.
         
-        if expected:
-            # Compare with expected response
-            common_words = set(response.lower().split()) & set(expected.lower().split())
-            similarity = len(common_words) / max(len(set(response.lower().split())), len(set(expected.lower().split())))
-            evaluation["similarity_to_expected"] = similarity
-        
-        end_time = timezone.now()
-        
-        child = self.add_step(
-            run_tree=run_tree,
-            step_name="evaluate_response",
-            step_type="evaluation",
-            inputs={"response": response, "expected": expected},
-            outputs={"evaluation": evaluation},
-            start_time=start_time,
-            end_time=end_time
-        )
+        The span nests under ``parent`` when given, otherwise under the
+        current span; blocks and ``@traced`` calls inside it nest under it in
+        turn, to any depth. Set ``outputs`` on the yielded span to record
+        them. See ``spans.span``.
+        """
+        store = self.traces[parent.trace_id] if parent is not None else None
+        return spans.span(name, run_type, inputs, parent=parent, store=store)
+        
+    def evaluate_response(self, run_tree, response, expected=None):
+        """Mock evaluation of the response"""
+        with self.span("evaluate_response", "evaluation", parent=run_tree,
+                       inputs={"response": response, "expected": expected}) as step:
+            time.sleep(self.STAGE_LATENCIES["evaluate_response"])  # Simulate evaluation time
+            
+            evaluation = self._evaluate(response, expected)
+            
+            step.outputs = {"evaluation": evaluation}
         
         return evaluation
         
+    def order_children(self, run_tree, step_names):
+        """
+        Sort a run's stage spans into step_names order, independent of completion order.
+
+        Only the run's direct children named after a stage move, among the
+        slots they already hold; every other span keeps its place in the
+        order spans were opened, so the path tree follows execution order.
+        """
+        positions = {name: i for i, name in enumerate(step_names)}
+        with self._children_lock:
+            children = self.get_children(run_tree.id)
+            slots = [i for i, child in enumerate(children)
+                     if child.parent is run_tree and child.name in positions]
+            stages = sorted((children[i] for i in slots), key=lambda child: positions[child.name])
+            for i, child in zip(slots, stages):
+                children[i] = child
+        
+    def build_pipeline(self, run_tree, input_text, expected=None):
+        """
+        Build the chat pipeline DAG.
+        
+        Postprocessing and evaluation only need the raw response, so they run
+        concurrently once generation finishes.
+        """
+        scheduler = StageScheduler()
+        scheduler.add("preprocess_input", lambda: self.process_input(run_tree, input_text))
+        scheduler.add("generate_response", lambda processed_input: self.generate_response(run_tree, processed_input),
+                      depends_on=["preprocess_input"])
+        scheduler.add("postprocess_response", lambda response: self.postprocess_response(run_tree, response),
+                      depends_on=["generate_response"])
+        scheduler.add("evaluate_response", lambda response: self.evaluate_response(run_tree, response, expected),
+                      depends_on=["generate_response"])
+        return scheduler
+        
+    def run_pipeline(self, run_tree, input_text, expected=None):
+        """Run the chat pipeline in threads and return the results by stage name"""
+        scheduler = self.build_pipeline(run_tree, input_text, expected)
+        results = scheduler.run()
+        self.order_children(run_tree, scheduler.stage_names)
+        return results
+        
     def get_children(self, run_id):
         """Get children for a run"""
-        return self.children_map.get(run_id, []) 
\ No newline at end of file
+        store = self.traces.get(run_id)
+        return store.children if store else []
+
+
+class AsyncTracerManager(TracerManager):
+    """
+    TracerManager whose pipeline stages are coroutines.
+    
+    Stages await instead of sleeping, so a single ASGI worker can interleave
+    many chats. An optional ``model`` coroutine function replaces the mock
+    response generator: ``await model(processed_input)`` must return the
+    response text.
+    """
+    
+    def __init__(self, model=None):
+        super().__init__()
+        self.model = model
+        
+    async def process_input(self, run_tree, input_text):
+        """Mock preprocessing step"""
+        with self.span("preprocess_input", "preprocessing", inputs={"raw_input": input_text}, parent=run_tree) as step:
+            await asyncio.sleep(self.STAGE_LATENCIES["preprocess_input"])  # Simulate processing time
+            
+            processed_input = self._preprocess(input_text)
+            
+            step.outputs = {"processed_input": processed_input}
+        
+        return processed_input
+        
+    async def generate_response(self, run_tree, processed_input):
+        """Response generation step, using the model coroutine when one is configured"""
+        with self.span("generate_response", "generation", parent=run_tree,
+                       inputs={"processed_input": processed_input}) as step:
+            if self.model is not None:
+                response = await self.model(processed_input)
+            else:
+                await asyncio.sleep(self.STAGE_LATENCIES["generate_response"])  # Simulate thinking time
+                response = self._mock_response(processed_input)
+            
+            step.outputs = {"raw_response": response}
+        
+        return response
+        
+    async def postprocess_response(self, run_tree, response_text):
+        """Mock postprocessing step"""
+        with self.span("postprocess_response", "postprocessing", parent=run_tree,
+                       inputs={"raw_response": response_text}) as step:
+            await asyncio.sleep(self.STAGE_LATENCIES["postprocess_response"])  # Simulate processing time
+            
+            processed_response = self._postprocess(response_text)
+            
+            step.outputs = {"final_response": processed_response}
+        
+        return processed_response
+        
+    async def evaluate_response(self, run_tree, response, expected=None):
+        """Mock evaluation of the response"""
+        with self.span("evaluate_response", "evaluation", parent=run_tree,
+                       inputs={"response": response, "expected": expected}) as step:
+            await asyncio.sleep(self.STAGE_LATENCIES["evaluate_response"])  # Simulate evaluation time
+            
+            evaluation = self._evaluate(response, expected)
+            
+            step.outputs = {"evaluation": evaluation}
+        
+        return evaluation
+        
+    async def arun_pipeline(self, run_tree, input_text, expected=None):
+        """Run the chat pipeline as asyncio tasks and return the results by stage name"""
+        scheduler = self.build_pipeline(run_tree, input_text, expected)
+        results = await scheduler.arun()
+        self.order_children(run_tree, scheduler.stage_names)
+        return results
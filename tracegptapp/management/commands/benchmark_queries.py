@@ -0,0 +1,174 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Avg, Count, Max
+from django.utils import timezone
+from tracegptapp.models import ChatTrace, TraceStep
+import random
+import statistics
+import time
+import uuid
+from datetime import timedelta
+
+class Command(BaseCommand):
+    help = 'Benchmarks the trace query workload with and without the trace indexes'
+
+    STEP_TYPES = ['preprocessing', 'generation', 'postprocessing', 'evaluation']
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--traces',
+            type=int,
+            default=0,
+            help='Number of synthetic traces to generate before benchmarking (e.g. 1000000)',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Number of timed runs per query',
+        )
+        parser.add_argument(
+            '--keep',
+            action='store_true',
+            help='Keep the synthetic traces instead of rolling them back',
+        )
+        parser.add_argument(
+            '--plans',
+            action='store_true',
+            help='Print the full query plans',
+        )
+
+    def handle(self, *args, **options):
+        # SQLite only allows dropping indexes inside a transaction with
+        # foreign key checks switched off beforehand
+        constraints_disabled = connection.disable_constraint_checking()
+        try:
+            self.benchmark(options)
+        finally:
+            if constraints_disabled:
+                connection.enable_constraint_checking()
+
+    def benchmark(self, options):
+        """Run the workload with and without indexes"""
+        # Everything runs in one transaction so the generated data and the
+        # dropped indexes are rolled back afterwards
+        with transaction.atomic():
+            if options['traces']:
+                self.generate_traces(options['traces'])
+
+            if not ChatTrace.objects.exists():
+                self.stdout.write(self.style.ERROR('No traces to benchmark, use --traces to generate some'))
+                return
+
+            self.stdout.write(f'Benchmarking {ChatTrace.objects.count():,} traces '
+                              f'and {TraceStep.objects.count():,} steps on {connection.vendor}')
+
+            indexed = self.run_workload(options['repeat'])
+            self.drop_indexes()
+            unindexed = self.run_workload(options['repeat'])
+
+            self.report(unindexed, indexed, options['plans'])
+
+            if not options['keep']:
+                transaction.set_rollback(True)
+
+    def workload(self):
+        """The queries issued by the views and analytics code"""
+        now = timezone.now()
+        trace_id = ChatTrace.objects.order_by('?').values_list('id', flat=True).first()
+        return [
+            ('Latest traces (logs page)',
+             ChatTrace.objects.order_by('-created_at')[:10]),
+            ('Traces in the last 7 days',
+             ChatTrace.objects.filter(created_at__gte=now - timedelta(days=7)).values('id')),
+            ('Errors in the last 30 days',
+             ChatTrace.objects.filter(status='error', created_at__gte=now - timedelta(days=30)).values('id')),
+            ('Steps of a trace (trace detail)',
+             TraceStep.objects.filter(trace_id=trace_id).order_by('start_time')),
+            ('Average generation runtime',
+             TraceStep.objects.filter(step_type='generation').values('step_type').annotate(avg=Avg('runtime_seconds'))),
+            ('Runtime by step type',
+             TraceStep.objects.values('step_type').annotate(
+                 avg=Avg('runtime_seconds'), max=Max('runtime_seconds'), count=Count('id'))),
+        ]
+
+    def run_workload(self, repeat):
+        """Time every workload query and capture its plan"""
+        results = {}
+        for name, queryset in self.workload():
+            plan = queryset.explain()
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                list(queryset.all())
+                timings.append((time.perf_counter() - start) * 1000)
+            results[name] = {'ms': statistics.median(timings), 'plan': plan}
+        return results
+
+    def drop_indexes(self):
+        """Drop the trace indexes declared in Meta.indexes"""
+        with connection.schema_editor() as schema_editor:
+            for model in (ChatTrace, TraceStep):
+                for index in model._meta.indexes:
+                    schema_editor.remove_index(model, index)
+
+    def report(self, unindexed, indexed, show_plans):
+        """Print the before/after timings and plans"""
+        self.stdout.write('')
+        self.stdout.write(f'{"Query":<34} {"No indexes":>12} {"Indexed":>12} {"Speedup":>9}')
+        for name, before in unindexed.items():
+            after = indexed[name]
+            speedup = before['ms'] / after['ms'] if after['ms'] else float('inf')
+            self.stdout.write(f'{name:<34} {before["ms"]:>10.2f}ms {after["ms"]:>10.2f}ms {speedup:>8.1f}x')
+
+        for name, before in unindexed.items():
+            before_plan, after_plan = before['plan'], indexed[name]['plan']
+            if not show_plans:
+                before_plan = ' | '.join(line.strip() for line in before_plan.splitlines())
+                after_plan = ' | '.join(line.strip() for line in after_plan.splitlines())
+            self.stdout.write('')
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(f'  before: {before_plan}')
+            self.stdout.write(f'  after:  {after_plan}')
+
+    def generate_traces(self, count, batch_size=10000):
+        """Bulk insert synthetic traces spread over the last year, with four steps each"""
+        self.stdout.write(f'Generating {count:,} synthetic traces...')
+        now = timezone.now()
+        created = 0
+
+        while created < count:
+            size = min(batch_size, count - created)
+            traces = ChatTrace.objects.bulk_create([
+                ChatTrace(
+                    run_id=str(uuid.uuid4()),
+                    input_prompt='benchmark prompt',
+                    output_response='benchmark response',
+                    status='error' if random.random() < 0.05 else 'success',
+                    runtime_seconds=random.uniform(0.5, 3.0),
+                    trace_data={},
+                    created_at=now - timedelta(seconds=random.randint(0, 365 * 24 * 3600)),
+                )
+                for _ in range(size)
+            ])
+
+            steps = []
+            for trace in traces:
+                step_start = trace.created_at
+                for step_type in self.STEP_TYPES:
+                    runtime = random.uniform(0.1, 1.0)
+                    steps.append(TraceStep(
+                        trace=trace,
+                        step_name=step_type,
+                        step_type=step_type,
+                        input_data={},
+                        output_data={},
+                        start_time=step_start,
+                        end_time=step_start + timedelta(seconds=runtime),
+                        runtime_seconds=runtime,
+                    ))
+                    step_start += timedelta(seconds=runtime)
+            TraceStep.objects.bulk_create(steps, batch_size=batch_size)
+
+            created += size
+            self.stdout.write(f'  {created:,} / {count:,}')
@@ -0,0 +1,115 @@
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse as StdlibJsonResponse
+from django.utils import timezone
+from tracegptapp import serialization
+from tracegptapp.management.commands.benchmark_spans import LegacyTracer
+from decimal import Decimal
+from datetime import timedelta
+import json
+import numpy as np
+import time
+import uuid
+
+class Command(BaseCommand):
+    help = 'Benchmarks stdlib json against the orjson serialization layer on large nested trace payloads'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--children',
+            type=int,
+            default=200,
+            help='Number of steps in the synthetic trace',
+        )
+        parser.add_argument(
+            '--depth',
+            type=int,
+            default=3,
+            help='Nesting depth of each step\'s inputs and outputs',
+        )
+        parser.add_argument(
+            '--width',
+            type=int,
+            default=4,
+            help='Keys per nested object',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Number of timed runs per operation; the fastest is reported',
+        )
+
+    def handle(self, *args, **options):
+        payload = self.build_trace(options['children'], options['depth'], options['width'])
+        native = serialization.to_jsonable(payload)
+        encoded = json.dumps(native, cls=DjangoJSONEncoder)
+        size = len(encoded.encode())
+        self.stdout.write(f"Trace of {options['children']:,} steps, {size / 1e6:.2f} MB as JSON")
+
+        legacy = LegacyTracer()
+        operations = [
+            ('Make payload JSON safe', lambda: legacy._prepare_json_data(payload),
+             lambda: serialization.to_jsonable(payload)),
+            ('Encode (JSONField)', lambda: json.dumps(native, cls=DjangoJSONEncoder),
+             lambda: serialization.JSONEncoder().encode(native)),
+            ('Decode (JSONField)', lambda: json.loads(encoded),
+             lambda: serialization.JSONDecoder().decode(encoded)),
+            ('JsonResponse', lambda: StdlibJsonResponse(native),
+             lambda: serialization.JsonResponse(native)),
+        ]
+
+        self.stdout.write(f"\n{'':<26}{'stdlib ms':>12}{'orjson ms':>12}{'speedup':>10}{'orjson MB/s':>14}")
+        for label, before, after in operations:
+            before_seconds = self.time(before, options['repeat'])
+            after_seconds = self.time(after, options['repeat'])
+            self.stdout.write(f"{label:<26}{before_seconds * 1000:>12.2f}{after_seconds * 1000:>12.2f}"
+                              f"{before_seconds / after_seconds:>9.1f}x{size / after_seconds / 1e6:>14.0f}")
+
+    def time(self, operation, repeat):
+        """Fastest of repeat runs, in seconds"""
+        best = float('inf')
+        for _ in range(repeat):
+            started = time.perf_counter()
+            operation()
+            best = min(best, time.perf_counter() - started)
+        return best
+
+    def build_trace(self, children, depth, width):
+        """A trace dict whose steps carry nested inputs and outputs with UUIDs, datetimes, numpy and Decimals"""
+        now = timezone.now()
+        rng = np.random.default_rng(0)
+
+        def nested(level):
+            if level == 0:
+                return {
+                    'id': uuid.uuid4(),
+                    'at': now - timedelta(seconds=int(rng.integers(0, 3600))),
+                    'score': np.float64(rng.random()),
+                    'count': np.int64(rng.integers(0, 1000)),
+                    'cost': Decimal('0.0012'),
+                    'text': 'lorem ipsum dolor sit amet ' * 4,
+                    'tokens': list(range(16)),
+                }
+            return {f'key_{i}': nested(level - 1) if i % 2 == 0 else [nested(level - 1)] for i in range(width)}
+
+        return {
+            'id': uuid.uuid4(),
+            'name': 'chatbot_interaction',
+            'start_time': now,
+            'end_time': now,
+            'inputs': {'input': 'benchmark'},
+            'outputs': {'output': nested(1)},
+            'children': [
+                {
+                    'id': uuid.uuid4(),
+                    'name': f'step_{i}',
+                    'run_type': 'tool',
+                    'start_time': now,
+                    'end_time': now,
+                    'inputs': nested(depth),
+                    'outputs': nested(depth),
+                }
+                for i in range(children)
+            ],
+        }
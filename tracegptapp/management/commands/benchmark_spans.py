@@ -0,0 +1,198 @@
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from django.utils import timezone
+from langsmith.run_trees import RunTree
+from tracegptapp.langsmith_utils import TracerManager
+from tracegptapp.spans import span
+import gc
+import time
+import tracemalloc
+import uuid
+from datetime import datetime
+
+class Command(BaseCommand):
+    help = 'Benchmarks recording trace steps as RunTrees against the compact span store'
+
+    STEP_TYPES = ['preprocessing', 'generation', 'postprocessing', 'evaluation']
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--traces',
+            type=int,
+            default=5000,
+            help='Number of traces to record per run (four steps each)',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=3,
+            help='Number of timed runs; the fastest is reported',
+        )
+
+    def handle(self, *args, **options):
+        traces = options['traces']
+        self.stdout.write(f'Recording {traces:,} traces of {len(self.STEP_TYPES)} steps')
+
+        # Spans are only recorded here, never sent
+        with override_settings(LANGSMITH_EXPORT=False):
+            results = [
+                ('RunTree per step', self.measure(LegacyTracer(), traces, options['repeat'])),
+                ('Span store', self.measure(TracerManager(), traces, options['repeat'])),
+            ]
+
+        self.stdout.write(f"\n{'':<20}{'spans/s':>12}{'traces/s':>12}{'bytes/span':>12}")
+        for label, result in results:
+            self.stdout.write(f"{label:<20}{result['spans_per_second']:>12,.0f}"
+                              f"{result['traces_per_second']:>12,.0f}{result['bytes_per_span']:>12,.0f}")
+
+        (_, before), (_, after) = results
+        self.stdout.write(self.style.SUCCESS(
+            f"\nSpans: {after['spans_per_second'] / before['spans_per_second']:.1f}x faster to record, "
+            f"{before['bytes_per_span'] / after['bytes_per_span']:.1f}x smaller while a trace is open"
+        ))
+
+        traced_us, untraced_us = self.measure_blocks(traces * len(self.STEP_TYPES))
+        self.stdout.write(f"span() blocks: {traced_us:.2f} µs inside a trace, {untraced_us:.2f} µs outside one")
+
+    def step_payloads(self, index):
+        """Inputs and outputs shaped like the chat pipeline's"""
+        text = f'hello, can you help me with request number {index}?'
+        processed = {'text': text, 'tokens': len(text.split()), 'processed_at': timezone.now().isoformat()}
+        response = 'Hello! How can I assist you today?'
+        return [
+            ({'raw_input': text}, {'processed_input': processed}),
+            ({'processed_input': processed}, {'raw_response': response}),
+            ({'raw_response': response}, {'final_response': {'text': response, 'tokens': 7}}),
+            ({'response': response, 'expected': None}, {'evaluation': {'response_length': len(response)}}),
+        ]
+
+    def record(self, tracer, index):
+        """Start a trace and add the four pipeline steps"""
+        run_tree = tracer.start_trace(f'prompt {index}', {'source': 'benchmark'})
+        for step_type, (inputs, outputs) in zip(self.STEP_TYPES, self.step_payloads(index)):
+            tracer.add_step(run_tree, f'{step_type}_step', step_type, inputs=inputs, outputs=outputs)
+        return run_tree
+
+    def measure(self, tracer, traces, repeat):
+        """Time recording and ending traces, and measure the memory held by open traces"""
+        spans = traces * len(self.STEP_TYPES)
+        record_seconds = lifecycle_seconds = float('inf')
+        for _ in range(repeat):
+            gc.collect()
+            started = time.perf_counter()
+            run_trees = [self.record(tracer, i) for i in range(traces)]
+            recorded = time.perf_counter()
+            for run_tree in run_trees:
+                tracer.end_trace(run_tree, {'text': 'done'})
+            finished = time.perf_counter()
+            record_seconds = min(record_seconds, recorded - started)
+            lifecycle_seconds = min(lifecycle_seconds, finished - started)
+            del run_trees
+
+        # Memory held by open traces, including the payloads each step keeps
+        gc.collect()
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        run_trees = [self.record(tracer, i) for i in range(traces)]
+        held = tracemalloc.get_traced_memory()[0] - baseline
+        tracemalloc.stop()
+        for run_tree in run_trees:
+            tracer.end_trace(run_tree, {'text': 'done'})
+
+        return {
+            'spans_per_second': spans / record_seconds,
+            'traces_per_second': traces / lifecycle_seconds,
+            'bytes_per_span': held / spans,
+        }
+
+    def measure_blocks(self, count):
+        """Microseconds per empty span() block with and without an active trace"""
+        tracer = TracerManager()
+        run_tree = tracer.start_trace('blocks')
+        started = time.perf_counter()
+        for _ in range(count):
+            with span('block'):
+                pass
+        traced = time.perf_counter() - started
+        tracer.discard_trace(run_tree)
+
+        started = time.perf_counter()
+        for _ in range(count):
+            with span('block'):
+                pass
+        untraced = time.perf_counter() - started
+        return traced / count * 1e6, untraced / count * 1e6
+
+
+class LegacyTracer(TracerManager):
+    """The tracer as it was before the span store: a RunTree per step in a children map"""
+
+    def __init__(self):
+        super().__init__()
+        self.children_map = {}
+
+    def _prepare_json_data(self, data):
+        """The recursive walk that made payloads JSON safe"""
+        if data is None:
+            return None
+        if isinstance(data, dict):
+            return {k: self._prepare_json_data(v) for k, v in data.items()}
+        if isinstance(data, list):
+            return [self._prepare_json_data(item) for item in data]
+        if isinstance(data, (uuid.UUID, datetime)):
+            return str(data)
+        if hasattr(data, 'isoformat'):
+            return data.isoformat()
+        return data
+
+    def start_trace(self, input_prompt, metadata=None):
+        run_tree = RunTree(
+            name="chatbot_interaction",
+            run_type="chain",
+            inputs={"input": input_prompt},
+            serialized={"name": "TraceGPT Chatbot Interaction", "metadata": metadata or {}},
+            project_name=self.project_name,
+        )
+        self.children_map[run_tree.id] = []
+        return run_tree
+
+    def add_step(self, run_tree, step_name, step_type, inputs=None, outputs=None, start_time=None, end_time=None):
+        child_run = RunTree(
+            name=step_name,
+            run_type=step_type,
+            inputs=self._prepare_json_data(inputs or {}),
+            outputs=self._prepare_json_data(outputs or {}),
+            start_time=start_time or timezone.now(),
+            end_time=end_time or timezone.now(),
+            id=str(uuid.uuid4()),
+            parent_run_id=run_tree.id,
+            serialized={"name": step_name, "type": step_type},
+            project_name=self.project_name,
+        )
+        with self._children_lock:
+            self.children_map[run_tree.id].append(child_run)
+        return child_run
+
+    def end_trace(self, run_tree, final_output):
+        trace_data = {
+            "id": str(run_tree.id),
+            "name": run_tree.name,
+            "run_type": run_tree.run_type,
+            "start_time": run_tree.start_time.isoformat() if run_tree.start_time else None,
+            "end_time": timezone.now().isoformat(),
+            "inputs": self._prepare_json_data(run_tree.inputs),
+            "outputs": {"output": self._prepare_json_data(final_output)},
+            "children": [
+                {
+                    "id": str(child.id),
+                    "name": child.name,
+                    "run_type": child.run_type,
+                    "start_time": child.start_time.isoformat() if child.start_time else None,
+                    "end_time": child.end_time.isoformat() if child.end_time else None,
+                    "inputs": self._prepare_json_data(child.inputs),
+                    "outputs": self._prepare_json_data(child.outputs),
+                }
+                for child in self.children_map.pop(run_tree.id, [])
+            ],
+        }
+        return trace_data
@@ -0,0 +1,45 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from tracegptapp.snapshots import SNAPSHOT_TABLES, get_snapshot_store
+
+class Command(BaseCommand):
+    help = 'Exports new traces and steps to the day-partitioned Arrow snapshot'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Discard the snapshot and export every row again',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=10000,
+            help='Number of rows fetched from the database per round trip',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=0,
+            help='Keep running and export every INTERVAL seconds',
+        )
+
+    def handle(self, *args, **options):
+        store = get_snapshot_store()
+        if store is None:
+            raise CommandError('TRACE_SNAPSHOT_DIR is not set')
+
+        full = options['full']
+        while True:
+            for table_name in SNAPSHOT_TABLES:
+                start = time.perf_counter()
+                exported = store.export(table_name, full=full, chunk_size=options['chunk_size'])
+                elapsed = time.perf_counter() - start
+                self.stdout.write(f'Exported {exported:,} {table_name} in {elapsed:.2f}s')
+            full = False
+
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(f'Snapshot is up to date in {store.directory}'))
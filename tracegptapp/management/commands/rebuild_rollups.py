@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from tracegptapp.rollups import RollupManager
+
+class Command(BaseCommand):
+    help = 'Rebuilds the hourly/daily trace rollup tables from existing traces'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='Number of traces fetched from the database per round trip',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding trace rollups...')
+        rollup_count = RollupManager.rebuild(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rollup_count} rollup buckets'))
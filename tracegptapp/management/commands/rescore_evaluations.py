@@ -0,0 +1,51 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from tracegptapp.evaluation import rescore_evaluation_steps, sync_trace_children
+from tracegptapp.models import ChatTrace, TraceStep
+
+class Command(BaseCommand):
+    help = 'Recomputes the similarity scores of stored evaluation steps and their traces in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=5000,
+            help='Number of evaluation steps scored and updated per batch',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Score the steps without saving the new scores',
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError('--chunk-size must be a positive integer')
+
+        steps = TraceStep.objects.filter(step_type='evaluation').only('id', 'trace_id', 'run_id', 'path', 'input_data', 'output_data').order_by('id')
+        started = time.perf_counter()
+        scanned = rescored = 0
+        last_id = 0
+        while True:
+            # Walk the steps by id so each batch is an indexed range query
+            chunk = list(steps.filter(id__gt=last_id)[:chunk_size])
+            if not chunk:
+                break
+            last_id = chunk[-1].id
+            scanned += len(chunk)
+
+            updated = rescore_evaluation_steps(chunk)
+            if updated and not options['dry_run']:
+                # The steps and the copies of their outputs in trace_data change together
+                with transaction.atomic():
+                    TraceStep.objects.bulk_update(updated, ['output_data'], batch_size=1000)
+                    ChatTrace.objects.bulk_update(sync_trace_children(updated), ['trace_data'], batch_size=1000)
+            rescored += len(updated)
+            self.stdout.write(f'Rescored {rescored:,} of {scanned:,} evaluation steps')
+
+        elapsed = time.perf_counter() - started
+        action = 'Scored' if options['dry_run'] else 'Rescored'
+        self.stdout.write(self.style.SUCCESS(f'{action} {rescored:,} evaluation steps in {elapsed:.2f}s'))
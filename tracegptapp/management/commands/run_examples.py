@@ -0,0 +1,81 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from tracegptapp.evaluation import ExampleRunner, select_examples
+
+class Command(BaseCommand):
+    help = 'Runs the ChatExample suite through the tracer pipeline and reports throughput, latency and similarity'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tag',
+            action='append',
+            dest='tags',
+            default=[],
+            help='Only run examples carrying this tag (repeatable)',
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=None,
+            help='Run at most this many examples',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=None,
+            help='Number of examples in flight at once (default: EXAMPLE_RUN_CONCURRENCY)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=None,
+            help='Number of traces written per bulk insert (default: TRACE_BULK_CHUNK_SIZE)',
+        )
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='Print the full report as JSON',
+        )
+
+    def handle(self, *args, **options):
+        for option in ('limit', 'concurrency', 'batch_size'):
+            if options[option] is not None and options[option] < 1:
+                raise CommandError(f"--{option.replace('_', '-')} must be a positive integer")
+
+        examples = select_examples(options['tags'], options['limit'])
+        if not examples:
+            raise CommandError('No examples to run')
+
+        runner = ExampleRunner(concurrency=options['concurrency'], batch_size=options['batch_size'])
+        self.stdout.write(f'Running {len(examples):,} examples with {runner.concurrency} workers...')
+        report = runner.run(examples)
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        latency = report['latency']
+        similarity = report['similarity']
+        self.stdout.write(
+            f"{report['succeeded']:,} succeeded, {report['failed']:,} failed, "
+            f"{report['persisted']:,} traces saved in {report['elapsed_seconds']:.2f}s "
+            f"({report['throughput_per_second']:.1f} examples/s)"
+        )
+        if latency['count']:
+            self.stdout.write(
+                f"Latency: mean {latency['mean']:.3f}s, p50 {latency['p50']:.3f}s, "
+                f"p95 {latency['p95']:.3f}s, p99 {latency['p99']:.3f}s"
+            )
+        if similarity['count']:
+            self.stdout.write(
+                f"Similarity: mean {similarity['mean']:.3f}, p50 {similarity['p50']:.3f}, min {similarity['min']:.3f}"
+            )
+        for tag, stats in report['by_tag'].items():
+            line = f"  {tag}: {stats['examples']:,} examples, mean latency {stats['latency']['mean']:.3f}s"
+            if stats['similarity']['count']:
+                line += f", mean similarity {stats['similarity']['mean']:.3f}"
+            self.stdout.write(line)
+        for error in report['errors'][:10]:
+            self.stdout.write(self.style.WARNING(f"Example {error['example_id']}: {error['error']}"))
+
+        self.stdout.write(self.style.SUCCESS(f"Run {report['run_label']} finished"))
@@ -0,0 +1,152 @@
+import time
+import zstandard
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models, transaction
+from tracegptapp import compression
+from tracegptapp.models import ChatTrace, CompressionDictionary, TraceStep
+
+class Command(BaseCommand):
+    help = 'Trains the shared zstd dictionary for trace and step payloads, optionally recompressing stored payloads with it'
+
+    PAYLOAD_FIELDS = [
+        (ChatTrace, ['trace_data']),
+        (TraceStep, ['input_data', 'output_data']),
+    ]
+
+    # One sample in this many is held out of training to measure the dictionary
+    HOLDOUT_EVERY = 5
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--samples',
+            type=int,
+            default=30000,
+            help='Number of payloads to train on, split evenly between the payload fields and taken from the newest rows',
+        )
+        parser.add_argument(
+            '--dict-size',
+            type=int,
+            default=64 * 1024,
+            help='Size of the trained dictionary in bytes',
+        )
+        parser.add_argument(
+            '--recompress',
+            action='store_true',
+            help='Recompress every stored payload with the new dictionary',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='Number of rows recompressed per batch',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Train and measure the dictionary without saving it',
+        )
+
+    def handle(self, *args, **options):
+        if options['samples'] < 1 or options['dict_size'] < 1 or options['chunk_size'] < 1:
+            raise CommandError('--samples, --dict-size and --chunk-size must be positive integers')
+        if options['dry_run'] and options['recompress']:
+            raise CommandError('--recompress needs a saved dictionary and cannot be combined with --dry-run')
+
+        samples = self.collect_samples(options['samples'])
+        training = [sample for i, sample in enumerate(samples) if i % self.HOLDOUT_EVERY]
+        holdout = samples[::self.HOLDOUT_EVERY]
+        if not holdout:
+            raise CommandError('No payloads to train on')
+
+        started = time.perf_counter()
+        try:
+            dictionary = zstandard.train_dictionary(options['dict_size'], training, level=settings.TRACE_COMPRESSION_LEVEL)
+        except zstandard.ZstdError as e:
+            raise CommandError(f'Training failed, try more --samples or a smaller --dict-size: {e}')
+        self.stdout.write(f'Trained dictionary {dictionary.dict_id()} ({len(dictionary):,} bytes) '
+                          f'on {len(training):,} payloads in {time.perf_counter() - started:.2f}s')
+        self.report_holdout(dictionary, holdout)
+
+        if options['dry_run']:
+            return
+
+        CompressionDictionary.objects.create(
+            dict_id=dictionary.dict_id(),
+            data=dictionary.as_bytes(),
+            sample_count=len(training),
+        )
+        compression.reset_active_dictionary()
+        self.stdout.write(self.style.SUCCESS(f'Saved dictionary {dictionary.dict_id()}; new payloads are compressed with it'))
+
+        if options['recompress']:
+            self.recompress(dictionary.dict_id(), options['chunk_size'])
+
+    def collect_samples(self, count):
+        """JSON bytes of the newest non-empty payloads of each field"""
+        per_field = max(count // sum(len(fields) for _, fields in self.PAYLOAD_FIELDS), 1)
+        samples = []
+        for model, fields in self.PAYLOAD_FIELDS:
+            for field in fields:
+                stored = (model.objects.exclude(**{f'{field}__isnull': True})
+                          .order_by('-id').values_list(field, flat=True)[:per_field])
+                samples.extend(data for data in map(compression.payload_json, stored) if len(data) > 2)
+        return samples
+
+    def report_holdout(self, dictionary, holdout):
+        """Compare plain zstd against the dictionary on payloads it was not trained on"""
+        level = settings.TRACE_COMPRESSION_LEVEL
+        plain = zstandard.ZstdCompressor(level=level)
+        trained = zstandard.ZstdCompressor(level=level, dict_data=dictionary)
+        raw_size = sum(len(data) for data in holdout)
+        plain_size = sum(min(len(plain.compress(data)), len(data)) for data in holdout)
+        trained_size = sum(min(len(trained.compress(data)), len(data)) for data in holdout)
+        self.stdout.write(
+            f'{len(holdout):,} held-out payloads: {raw_size / 1e6:.2f} MB as JSON, '
+            f'{plain_size / 1e6:.2f} MB with zstd ({raw_size / plain_size:.1f}x), '
+            f'{trained_size / 1e6:.2f} MB with the dictionary ({raw_size / trained_size:.1f}x)'
+        )
+
+    def recompress(self, dict_id, chunk_size):
+        """Rewrite every payload not yet compressed with dict_id"""
+        started = time.perf_counter()
+        rewritten = json_bytes = before = after = 0
+        for model, fields in self.PAYLOAD_FIELDS:
+            last_id = 0
+            while True:
+                # Walk by id so each batch is an indexed range query; values_list returns the stored bytes
+                rows = list(model.objects.filter(id__gt=last_id).order_by('id').values_list('id', *fields)[:chunk_size])
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+
+                # Rows to update per field; bulk_update writes only the listed field
+                updated = {field: [] for field in fields}
+                for pk, *values in rows:
+                    row = model(id=pk)
+                    for field, stored in zip(fields, values):
+                        if stored is None or compression.frame_dictionary(stored) == dict_id:
+                            continue
+                        data = compression.payload_json(stored)
+                        recompressed = compression.compress_json(data, dict_id)
+                        # An expression, so bulk_update writes the frame as is instead of reading it back as JSON
+                        setattr(row, field, models.Value(recompressed, output_field=models.BinaryField()))
+                        updated[field].append(row)
+                        json_bytes += len(data)
+                        before += len(stored)
+                        after += len(recompressed)
+                with transaction.atomic():
+                    for field, objects in updated.items():
+                        if objects:
+                            model.objects.bulk_update(objects, [field], batch_size=500)
+                            rewritten += len(objects)
+                self.stdout.write(f'Recompressed {rewritten:,} payloads')
+
+        elapsed = time.perf_counter() - started
+        if not rewritten:
+            self.stdout.write(self.style.SUCCESS('Every payload already uses this dictionary'))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'Recompressed {rewritten:,} payloads in {elapsed:.2f}s: {json_bytes / 1e6:.2f} MB as JSON, '
+            f'{before / 1e6:.2f} MB stored before, {after / 1e6:.2f} MB now ({json_bytes / after:.1f}x)'
+        ))
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracegptapp', '0002_contactmessage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TraceRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=10)),
+                ('bucket_start', models.DateTimeField()),
+                ('trace_count', models.PositiveIntegerField(default=0)),
+                ('runtime_sum', models.FloatField(default=0.0)),
+                ('runtime_min', models.FloatField(blank=True, null=True)),
+                ('runtime_max', models.FloatField(blank=True, null=True)),
+                ('status_counts', models.JSONField(default=dict)),
+                ('tag_counts', models.JSONField(default=dict)),
+                ('runtime_histogram', models.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['granularity', 'bucket_start'],
+                'unique_together': {('granularity', 'bucket_start')},
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracegptapp', '0003_tracerollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tracerollup',
+            name='runtime_sketch',
+            field=models.JSONField(default=dict),
+        ),
+        migrations.CreateModel(
+            name='StepRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=10)),
+                ('bucket_start', models.DateTimeField()),
+                ('step_type', models.CharField(max_length=50)),
+                ('step_count', models.PositiveIntegerField(default=0)),
+                ('runtime_sum', models.FloatField(default=0.0)),
+                ('runtime_min', models.FloatField(blank=True, null=True)),
+                ('runtime_max', models.FloatField(blank=True, null=True)),
+                ('runtime_sketch', models.JSONField(default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['granularity', 'bucket_start', 'step_type'],
+                'unique_together': {('granularity', 'bucket_start', 'step_type')},
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracegptapp', '0004_steprollup_runtime_sketch'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chattrace',
+            index=models.Index(fields=['created_at'], name='chattrace_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chattrace',
+            index=models.Index(fields=['status', 'created_at'], name='chattrace_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tracestep',
+            index=models.Index(fields=['trace', 'start_time'], name='tracestep_trace_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tracestep',
+            index=models.Index(fields=['step_type', 'runtime_seconds'], name='tracestep_type_runtime_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_trace_tags(apps, schema_editor):
+    """Copy the comma-joined ChatTrace.tags values into TraceTag rows"""
+    ChatTrace = apps.get_model('tracegptapp', 'ChatTrace')
+    TraceTag = apps.get_model('tracegptapp', 'TraceTag')
+
+    batch = []
+    for trace_id, tags in ChatTrace.objects.exclude(tags='').values_list('id', 'tags').iterator(chunk_size=2000):
+        for tag in set(tags):
+            batch.append(TraceTag(trace_id=trace_id, tag=tag))
+        if len(batch) >= 2000:
+            TraceTag.objects.bulk_create(batch)
+            batch = []
+    TraceTag.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracegptapp', '0005_trace_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TraceTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tag', models.CharField(choices=[('correct', 'Correct'), ('misleading', 'Misleading'), ('incomplete', 'Incomplete'), ('slow', 'Slow')], max_length=20)),
+                ('trace', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tag_links', to='tracegptapp.chattrace')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['tag', 'trace'], name='tracetag_tag_trace_idx')],
+                'unique_together': {('trace', 'tag')},
+            },
+        ),
+        migrations.RunPython(populate_trace_tags, migrations.RunPython.noop),
+    ]
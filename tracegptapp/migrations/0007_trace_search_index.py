@@ -0,0 +1,83 @@
+from django.db import migrations
+
+FTS_TABLE = 'tracegptapp_chattrace_fts'
+
+SQLITE_FORWARD = [
+    f"""
+    CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+        input_prompt, output_response,
+        content='tracegptapp_chattrace', content_rowid='id',
+        tokenize='porter unicode61'
+    )
+    """,
+    f"""
+    CREATE TRIGGER tracegptapp_chattrace_fts_insert AFTER INSERT ON tracegptapp_chattrace BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, input_prompt, output_response)
+        VALUES (new.id, new.input_prompt, new.output_response);
+    END
+    """,
+    f"""
+    CREATE TRIGGER tracegptapp_chattrace_fts_delete AFTER DELETE ON tracegptapp_chattrace BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, input_prompt, output_response)
+        VALUES ('delete', old.id, old.input_prompt, old.output_response);
+    END
+    """,
+    f"""
+    CREATE TRIGGER tracegptapp_chattrace_fts_update
+    AFTER UPDATE OF input_prompt, output_response ON tracegptapp_chattrace BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, input_prompt, output_response)
+        VALUES ('delete', old.id, old.input_prompt, old.output_response);
+        INSERT INTO {FTS_TABLE}(rowid, input_prompt, output_response)
+        VALUES (new.id, new.input_prompt, new.output_response);
+    END
+    """,
+    # Index the traces that already exist
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+
+SQLITE_REVERSE = [
+    'DROP TRIGGER IF EXISTS tracegptapp_chattrace_fts_update',
+    'DROP TRIGGER IF EXISTS tracegptapp_chattrace_fts_delete',
+    'DROP TRIGGER IF EXISTS tracegptapp_chattrace_fts_insert',
+    f'DROP TABLE IF EXISTS {FTS_TABLE}',
+]
+
+POSTGRESQL_FORWARD = [
+    """
+    ALTER TABLE tracegptapp_chattrace ADD COLUMN search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(input_prompt, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(output_response, '')), 'B')
+    ) STORED
+    """,
+    'CREATE INDEX chattrace_search_vector_idx ON tracegptapp_chattrace USING GIN (search_vector)',
+]
+
+POSTGRESQL_REVERSE = [
+    'DROP INDEX IF EXISTS chattrace_search_vector_idx',
+    'ALTER TABLE tracegptapp_chattrace DROP COLUMN IF EXISTS search_vector',
+]
+
+
+def run_statements(schema_editor, statements):
+    for statement in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+def create_search_index(apps, schema_editor):
+    run_statements(schema_editor, {'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRESQL_FORWARD})
+
+
+def drop_search_index(apps, schema_editor):
+    run_statements(schema_editor, {'sqlite': SQLITE_REVERSE, 'postgresql': POSTGRESQL_REVERSE})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracegptapp', '0006_tracetag'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
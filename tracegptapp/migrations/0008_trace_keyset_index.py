@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracegptapp', '0007_trace_search_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='chattrace',
+            name='chattrace_created_idx',
+        ),
+        migrations.AddIndex(
+            model_name='chattrace',
+            index=models.Index(fields=['created_at', 'id'], name='chattrace_created_id_idx'),
+        ),
+    ]
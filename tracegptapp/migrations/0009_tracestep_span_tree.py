@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-17 14:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracegptapp', '0008_trace_keyset_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tracestep',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='tracestep',
+            name='parent_run_id',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='tracestep',
+            name='path',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='tracestep',
+            name='run_id',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name='tracestep',
+            index=models.Index(fields=['trace', 'path'], name='tracestep_trace_path_idx'),
+        ),
+    ]
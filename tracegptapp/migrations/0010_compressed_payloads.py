@@ -0,0 +1,172 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:10
+
+from django.db import migrations, models
+import django.utils.timezone
+import tracegptapp.compression
+
+# Rows converted per round trip
+CHUNK_SIZE = 2000
+
+PAYLOAD_FIELDS = [
+    ('ChatTrace', ['trace_data']),
+    ('TraceStep', ['input_data', 'output_data']),
+]
+
+
+def _chunks(model, fields):
+    """Yield (id, *fields) rows in id order, CHUNK_SIZE at a time"""
+    last_id = 0
+    while True:
+        rows = list(model.objects.filter(id__gt=last_id).order_by('id').values_list('id', *fields)[:CHUNK_SIZE])
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def compress_payloads(apps, schema_editor):
+    """Copy each JSON payload into its binary column, compressed without a dictionary"""
+    quote_name = schema_editor.quote_name
+    for model_name, fields in PAYLOAD_FIELDS:
+        model = apps.get_model('tracegptapp', model_name)
+        assignments = ', '.join(f"{quote_name(field + '_zstd')} = %s" for field in fields)
+        sql = f"UPDATE {quote_name(model._meta.db_table)} SET {assignments} WHERE id = %s"
+        with schema_editor.connection.cursor() as cursor:
+            for rows in _chunks(model, fields):
+                cursor.executemany(sql, [
+                    [None if value is None else tracegptapp.compression.compress(value, dict_id=0) for value in values] + [pk]
+                    for pk, *values in rows
+                ])
+
+
+def decompress_payloads(apps, schema_editor):
+    """Copy each compressed payload back into its JSON column"""
+    for model_name, fields in PAYLOAD_FIELDS:
+        model = apps.get_model('tracegptapp', model_name)
+        compressed_fields = [field + '_zstd' for field in fields]
+        for rows in _chunks(model, compressed_fields):
+            objects = []
+            for pk, *values in rows:
+                objects.append(model(id=pk, **{
+                    field: None if value is None else tracegptapp.compression.decompress(value)
+                    for field, value in zip(fields, values)
+                }))
+            model.objects.bulk_update(objects, fields)
+
+
+# SQLite applies the column changes by rebuilding tracegptapp_chattrace,
+# which drops the full-text search triggers created by 0007
+FTS_TABLE = 'tracegptapp_chattrace_fts'
+
+SQLITE_SEARCH_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS tracegptapp_chattrace_fts_insert AFTER INSERT ON tracegptapp_chattrace BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, input_prompt, output_response)
+        VALUES (new.id, new.input_prompt, new.output_response);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS tracegptapp_chattrace_fts_delete AFTER DELETE ON tracegptapp_chattrace BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, input_prompt, output_response)
+        VALUES ('delete', old.id, old.input_prompt, old.output_response);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS tracegptapp_chattrace_fts_update
+    AFTER UPDATE OF input_prompt, output_response ON tracegptapp_chattrace BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, input_prompt, output_response)
+        VALUES ('delete', old.id, old.input_prompt, old.output_response);
+        INSERT INTO {FTS_TABLE}(rowid, input_prompt, output_response)
+        VALUES (new.id, new.input_prompt, new.output_response);
+    END
+    """,
+    # Index anything written while the triggers were missing
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+
+SQLITE_DROP_SEARCH_TRIGGERS = [
+    'DROP TRIGGER IF EXISTS tracegptapp_chattrace_fts_update',
+    'DROP TRIGGER IF EXISTS tracegptapp_chattrace_fts_delete',
+    'DROP TRIGGER IF EXISTS tracegptapp_chattrace_fts_insert',
+]
+
+
+def restore_search_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in SQLITE_SEARCH_TRIGGERS:
+            schema_editor.execute(statement)
+
+
+def drop_search_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in SQLITE_DROP_SEARCH_TRIGGERS:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracegptapp', '0009_tracestep_span_tree'),
+    ]
+
+    operations = [
+        # Unapplying rebuilds the table again; this runs last then and restores the triggers
+        migrations.RunPython(migrations.RunPython.noop, restore_search_triggers),
+        migrations.CreateModel(
+            name='CompressionDictionary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dict_id', models.PositiveBigIntegerField(unique=True)),
+                ('data', models.BinaryField()),
+                ('sample_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='chattrace',
+            name='trace_data_zstd',
+            field=tracegptapp.compression.CompressedJSONField(default=dict),
+        ),
+        migrations.AddField(
+            model_name='tracestep',
+            name='input_data_zstd',
+            field=tracegptapp.compression.CompressedJSONField(blank=True, default=dict, null=True),
+        ),
+        migrations.AddField(
+            model_name='tracestep',
+            name='output_data_zstd',
+            field=tracegptapp.compression.CompressedJSONField(blank=True, default=dict, null=True),
+        ),
+        migrations.RunPython(compress_payloads, decompress_payloads),
+        migrations.RemoveField(
+            model_name='chattrace',
+            name='trace_data',
+        ),
+        migrations.RemoveField(
+            model_name='tracestep',
+            name='input_data',
+        ),
+        migrations.RemoveField(
+            model_name='tracestep',
+            name='output_data',
+        ),
+        migrations.RenameField(
+            model_name='chattrace',
+            old_name='trace_data_zstd',
+            new_name='trace_data',
+        ),
+        migrations.RenameField(
+            model_name='tracestep',
+            old_name='input_data_zstd',
+            new_name='input_data',
+        ),
+        migrations.RenameField(
+            model_name='tracestep',
+            old_name='output_data_zstd',
+            new_name='output_data',
+        ),
+        migrations.RunPython(restore_search_triggers, drop_search_triggers),
+    ]
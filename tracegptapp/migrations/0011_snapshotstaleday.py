@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:11
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracegptapp', '0010_compressed_payloads'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SnapshotStaleDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table_name', models.CharField(choices=[('traces', 'Traces'), ('steps', 'Steps')], max_length=20)),
+                ('day', models.DateField()),
+                ('marked_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ['table_name', 'day'],
+                'unique_together': {('table_name', 'day')},
+            },
+        ),
+    ]
@@ -2,6 +2,9 @@ from django.db import models
 from django.utils import timezone
 from multiselectfield import MultiSelectField
 
+from .compression import CompressedJSONField
+from .serialization import JSONField
+
 class ChatExample(models.Model):
     """Predefined chatbot examples with expected responses and tags"""
     
@@ -21,6 +24,24 @@ class ChatExample(models.Model):
     def __str__(self):
         return self.title
         
+class TraceQuerySet(models.QuerySet):
+    """QuerySet helpers backed by the normalized TraceTag table"""
+    
+    def with_tag(self, tag):
+        """Traces carrying a tag, resolved through the indexed TraceTag table"""
+        return self.filter(tag_links__tag=tag)
+    
+    def tag_counts(self):
+        """Number of traces per tag as an indexed GROUP BY, most frequent first"""
+        tags = TraceTag.objects.all()
+        if self.query.has_filters():
+            tags = tags.filter(trace__in=self.values('id'))
+        return tags.values('tag').annotate(count=models.Count('id')).order_by('-count', 'tag')
+    
+    def available_tags(self):
+        """Distinct tags in use"""
+        return TraceTag.objects.order_by('tag').values_list('tag', flat=True).distinct()
+
 class ChatTrace(models.Model):
     """Records of chatbot interactions and their traces"""
     
@@ -42,14 +63,38 @@ class ChatTrace(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='success')
     tags = MultiSelectField(choices=TAG_CHOICES, max_length=50, blank=True)
     runtime_seconds = models.FloatField(default=0.0)
-    trace_data = models.JSONField(default=dict)
+    trace_data = CompressedJSONField(default=dict)
     created_at = models.DateTimeField(default=timezone.now)
     
+    objects = TraceQuerySet.as_manager()
+    
     def __str__(self):
         return f"Trace {self.run_id[:8]} - {self.created_at.strftime('%Y-%m-%d %H:%M')}"
     
+    def step_tree(self):
+        """
+        Fetch every step of the trace in one query, in depth-first tree order.
+        
+        Each step gets a ``children`` list of its direct children; the steps
+        are returned as a flat list whose ``depth`` gives the nesting.
+        Steps recorded before spans could nest have no path and come back
+        in start order at depth 1.
+        """
+        steps = list(self.steps.order_by('path', 'start_time', 'id'))
+        by_run_id = {step.run_id: step for step in steps if step.run_id}
+        for step in steps:
+            step.children = []
+            parent = by_run_id.get(step.parent_run_id)
+            if parent is not None:
+                parent.children.append(step)
+        return steps
+    
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='chattrace_created_id_idx'),
+            models.Index(fields=['status', 'created_at'], name='chattrace_status_created_idx'),
+        ]
 
 class TraceStep(models.Model):
     """Individual steps within a chat trace"""
@@ -57,17 +102,128 @@ class TraceStep(models.Model):
     trace = models.ForeignKey(ChatTrace, on_delete=models.CASCADE, related_name='steps')
     step_name = models.CharField(max_length=100)
     step_type = models.CharField(max_length=50)
-    input_data = models.JSONField(default=dict, null=True, blank=True)
-    output_data = models.JSONField(default=dict, null=True, blank=True)
+    input_data = CompressedJSONField(default=dict, null=True, blank=True)
+    output_data = CompressedJSONField(default=dict, null=True, blank=True)
     start_time = models.DateTimeField()
     end_time = models.DateTimeField()
     runtime_seconds = models.FloatField(default=0.0)
+    # Position in the trace's span tree: path is the dotted, zero-padded
+    # position of each ancestor among its siblings (e.g. "000002.000001"),
+    # so ordering a trace's steps by path lists every step after its parent
+    run_id = models.CharField(max_length=100, blank=True, default='')
+    parent_run_id = models.CharField(max_length=100, blank=True, default='')
+    path = models.CharField(max_length=255, blank=True, default='')
+    depth = models.PositiveSmallIntegerField(default=1)
     
     def __str__(self):
         return f"{self.step_name} ({self.runtime_seconds:.2f}s)"
     
     class Meta:
         ordering = ['start_time']
+        indexes = [
+            models.Index(fields=['trace', 'start_time'], name='tracestep_trace_start_idx'),
+            models.Index(fields=['trace', 'path'], name='tracestep_trace_path_idx'),
+            models.Index(fields=['step_type', 'runtime_seconds'], name='tracestep_type_runtime_idx'),
+        ]
+
+class TraceTag(models.Model):
+    """Normalized tag assignment for a ChatTrace, kept in sync with ChatTrace.tags"""
+    
+    trace = models.ForeignKey(ChatTrace, on_delete=models.CASCADE, related_name='tag_links')
+    tag = models.CharField(max_length=20, choices=ChatTrace.TAG_CHOICES)
+    
+    def __str__(self):
+        return f"{self.tag} ({self.trace_id})"
+    
+    class Meta:
+        unique_together = ('trace', 'tag')
+        indexes = [
+            models.Index(fields=['tag', 'trace'], name='tracetag_tag_trace_idx'),
+        ]
+
+class TraceRollup(models.Model):
+    """Pre-aggregated trace statistics for an hourly or daily time bucket"""
+    
+    GRANULARITY_CHOICES = (
+        ('hour', 'Hour'),
+        ('day', 'Day'),
+    )
+    
+    # Lower bounds of the runtime histogram bins, the last bin is open ended
+    RUNTIME_BINS = [0, 1, 2, 3, 5, 10]
+    RUNTIME_BIN_LABELS = ['0-1s', '1-2s', '2-3s', '3-5s', '5-10s', '10s+']
+    
+    granularity = models.CharField(max_length=10, choices=GRANULARITY_CHOICES)
+    bucket_start = models.DateTimeField()
+    trace_count = models.PositiveIntegerField(default=0)
+    runtime_sum = models.FloatField(default=0.0)
+    runtime_min = models.FloatField(null=True, blank=True)
+    runtime_max = models.FloatField(null=True, blank=True)
+    status_counts = JSONField(default=dict)
+    tag_counts = JSONField(default=dict)
+    runtime_histogram = JSONField(default=list)
+    runtime_sketch = JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.granularity} rollup {self.bucket_start.strftime('%Y-%m-%d %H:%M')} ({self.trace_count} traces)"
+    
+    class Meta:
+        ordering = ['granularity', 'bucket_start']
+        unique_together = ('granularity', 'bucket_start')
+
+class StepRollup(models.Model):
+    """Pre-aggregated step runtime statistics per step type and time bucket"""
+    
+    granularity = models.CharField(max_length=10, choices=TraceRollup.GRANULARITY_CHOICES)
+    bucket_start = models.DateTimeField()
+    step_type = models.CharField(max_length=50)
+    step_count = models.PositiveIntegerField(default=0)
+    runtime_sum = models.FloatField(default=0.0)
+    runtime_min = models.FloatField(null=True, blank=True)
+    runtime_max = models.FloatField(null=True, blank=True)
+    runtime_sketch = JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.step_type} {self.granularity} rollup {self.bucket_start.strftime('%Y-%m-%d %H:%M')}"
+    
+    class Meta:
+        ordering = ['granularity', 'bucket_start', 'step_type']
+        unique_together = ('granularity', 'bucket_start', 'step_type')
+
+class CompressionDictionary(models.Model):
+    """A zstd dictionary trained on trace payloads; compressed payloads name theirs by dict_id"""
+    
+    dict_id = models.PositiveBigIntegerField(unique=True)
+    data = models.BinaryField()
+    sample_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        return f"Dictionary {self.dict_id} ({len(self.data):,} bytes)"
+    
+    class Meta:
+        ordering = ['-created_at']
+
+class SnapshotStaleDay(models.Model):
+    """A day of the Arrow snapshot whose rows were edited or deleted since it was exported"""
+    
+    TABLE_CHOICES = (
+        ('traces', 'Traces'),
+        ('steps', 'Steps'),
+    )
+    
+    table_name = models.CharField(max_length=20, choices=TABLE_CHOICES)
+    day = models.DateField()
+    marked_at = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        return f"Stale {self.table_name} snapshot day {self.day.isoformat()}"
+    
+    class Meta:
+        ordering = ['table_name', 'day']
+        unique_together = ('table_name', 'day')
 
 class ContactMessage(models.Model):
     """Contact form submissions"""
@@ -0,0 +1,128 @@
+"""
+Keyset (cursor) pagination for trace listings
+"""
+import base64
+import json
+from django.db import connection
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+# Filtered counts stop at this many rows and are reported as a lower bound
+APPROXIMATE_COUNT_LIMIT = 10000
+
+
+def encode_cursor(created_at, pk, direction):
+    """Encode a (created_at, id) position and direction as an opaque cursor"""
+    payload = json.dumps({'c': created_at.isoformat(), 'i': pk, 'd': direction}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decode a cursor into (created_at, id, direction), raising ValueError if it is invalid"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        created_at = parse_datetime(payload['c'])
+        pk = int(payload['i'])
+        direction = payload['d']
+    except (ValueError, TypeError, KeyError):
+        raise ValueError("Invalid cursor")
+    if created_at is None or direction not in ('next', 'prev'):
+        raise ValueError("Invalid cursor")
+    return created_at, pk, direction
+
+
+def approximate_count(queryset, limit=APPROXIMATE_COUNT_LIMIT):
+    """
+    Estimate the number of rows in a queryset without a full COUNT(*).
+
+    PostgreSQL uses the planner's row estimate. Other backends count at most
+    ``limit`` rows. Returns a dict with ``count`` and whether it is ``exact``.
+    """
+    if connection.vendor == 'postgresql':
+        plan = json.loads(queryset.order_by().explain(format='json'))
+        return {'count': int(plan[0]['Plan']['Plan Rows']), 'exact': False}
+
+    count = queryset.order_by().values('pk')[:limit + 1].count()
+    if count > limit:
+        return {'count': limit, 'exact': False}
+    return {'count': count, 'exact': True}
+
+
+class KeysetPage:
+    """A page of results with cursors to the neighbouring pages"""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """
+    Paginates a queryset newest first on (created_at, id).
+
+    Each page is a range scan that starts from the position stored in the
+    cursor, so page N costs the same as page 1 and no COUNT(*) is needed.
+    """
+
+    def __init__(self, queryset, per_page=10):
+        self.queryset = queryset
+        self.per_page = per_page
+
+    def page(self, cursor=None):
+        """Return the page after/before a cursor, or the first page when cursor is empty"""
+        if not cursor:
+            return self._page(self.queryset, 'next', has_previous=False)
+
+        created_at, pk, direction = decode_cursor(cursor)
+        if direction == 'next':
+            queryset = self.queryset.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+            )
+        else:
+            queryset = self.queryset.filter(
+                Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk)
+            )
+        return self._page(queryset, direction, has_previous=True)
+
+    def _page(self, queryset, direction, has_previous):
+        """Fetch one row more than a page to tell whether another page follows"""
+        if direction == 'next':
+            queryset = queryset.order_by('-created_at', '-id')
+        else:
+            queryset = queryset.order_by('created_at', 'id')
+
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if direction == 'prev':
+            rows.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next = has_more
+
+        if not rows:
+            return KeysetPage(rows)
+
+        first, last = rows[0], rows[-1]
+        return KeysetPage(
+            rows,
+            next_cursor=encode_cursor(last.created_at, last.id, 'next') if has_next else None,
+            previous_cursor=encode_cursor(first.created_at, first.id, 'prev') if has_previous else None,
+        )
@@ -0,0 +1,173 @@
+"""
+Persistent process pool for rendering matplotlib charts outside request threads
+"""
+import atexit
+import importlib
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def resolve_chart(path):
+    """Resolve a 'module:Class.function' path to a chart function"""
+    module_name, _, qualname = path.partition(':')
+    target = importlib.import_module(module_name)
+    for attribute in qualname.split('.'):
+        target = getattr(target, attribute)
+    return target
+
+
+def _init_worker(settings_module):
+    """Set up Django and warm up matplotlib/seaborn once per worker process"""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    import django
+    django.setup()
+
+    # Importing the chart modules loads matplotlib (Agg), pandas and seaborn
+    importlib.import_module('tracegptapp.analytics')
+    importlib.import_module('tracegptapp.visualizations')
+
+    # Drawing a figure once builds the font cache and text layout machinery
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots()
+    ax.set_title('warmup')
+    fig.canvas.draw()
+    plt.close(fig)
+
+
+def _ping():
+    return os.getpid()
+
+
+def _render_chart(path, args, fmt='png'):
+    """Render a chart in a worker, bypassing the worker's own chart cache"""
+    from .chart_cache import use_format
+
+    func = resolve_chart(path)
+    with use_format(fmt):
+        return getattr(func, '__wrapped__', func)(*args)
+
+
+class ChartRenderer:
+    """
+    Renders charts in a pool of spawned worker processes.
+
+    Matplotlib's pyplot state is process global and not thread-safe, so each
+    chart is drawn in a worker process and never in a request thread. Workers
+    are long-lived and pre-warmed so a chart request pays only for drawing,
+    and cached charts are served without reaching the pool at all.
+    """
+
+    def __init__(self, max_workers=None, timeout=None):
+        self.max_workers = max_workers if max_workers is not None else settings.CHART_RENDER_WORKERS
+        self.timeout = timeout if timeout is not None else settings.CHART_RENDER_TIMEOUT
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        """Start the pool on first use and spawn every worker up front"""
+        with self._lock:
+            # A pool started before a fork (gunicorn --preload) belongs to the parent
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(os.environ.get('DJANGO_SETTINGS_MODULE', 'tracegpt.settings'),),
+                )
+                self._pid = os.getpid()
+                for _ in range(self.max_workers):
+                    self._executor.submit(_ping)
+            return self._executor
+
+    def warm(self):
+        """Start the worker processes ahead of the first chart request"""
+        if self.max_workers:
+            self._get_executor()
+
+    def shutdown(self):
+        """Stop the worker processes"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None and self._pid == os.getpid():
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def render(self, path, args=(), fmt='png'):
+        """
+        Return the chart ``path`` drawn with ``args`` as a base64 image.
+
+        Cache hits are returned directly and misses are drawn by a worker.
+        Returns None when the pool fails or the chart is not ready within the
+        timeout; a chart that finishes late is still cached, so a retry is
+        served from the cache. With no workers configured the chart is drawn
+        in the calling process.
+        """
+        from .chart_cache import get_chart_cache, use_format
+
+        cache = get_chart_cache()
+        with use_format(fmt):
+            prefix, key = resolve_chart(path).cache_key(*args)
+        value = cache.get(key)
+        if value is not None:
+            return value
+
+        if not self.max_workers:
+            value = _render_chart(path, args, fmt)
+            if value:
+                cache.set(prefix, key, value)
+            return value
+
+        try:
+            future = self._get_executor().submit(_render_chart, path, args, fmt)
+        except (BrokenProcessPool, RuntimeError) as e:
+            logger.warning(f"Chart render pool unavailable: {e}")
+            self.shutdown()
+            return None
+
+        def store(future):
+            if not future.cancelled() and future.exception() is None and future.result():
+                cache.set(prefix, key, future.result())
+        future.add_done_callback(store)
+
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            logger.warning(f"Chart {path} was not rendered within {self.timeout}s")
+        except BrokenProcessPool as e:
+            logger.warning(f"Chart render pool broke while rendering {path}: {e}")
+            self.shutdown()
+        except Exception as e:
+            logger.warning(f"Rendering {path} failed: {e}")
+        return None
+
+
+_renderer = None
+_renderer_lock = threading.Lock()
+
+
+def get_renderer():
+    """Return the process-wide chart renderer"""
+    global _renderer
+    with _renderer_lock:
+        if _renderer is None:
+            _renderer = ChartRenderer()
+            atexit.register(_renderer.shutdown)
+        return _renderer
+
+
+def render_chart(path, args=(), fmt='png'):
+    """Render a chart in the worker pool, returning None if it could not be rendered in time"""
+    return get_renderer().render(path, args, fmt)
+
+
+def warm_on_start():
+    """Spawn the render workers when CHART_RENDER_WARM_ON_START is set; called by the WSGI and ASGI entry points"""
+    if settings.CHART_RENDER_WARM_ON_START:
+        get_renderer().warm()
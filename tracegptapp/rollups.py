@@ -0,0 +1,332 @@
+"""
+Incrementally maintained hourly/daily rollups of ChatTrace and TraceStep statistics
+"""
+from bisect import bisect_right
+from collections import Counter
+from datetime import timedelta
+import threading
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ChatTrace, TraceStep, TraceRollup, StepRollup
+from .sketches import QuantileSketch
+from .frames import load_frame, local_naive
+
+GRANULARITIES = ('hour', 'day')
+
+
+def bucket_start(value, granularity):
+    """Return the start of the local-time bucket containing a datetime"""
+    local_value = timezone.localtime(value)
+    if granularity == 'hour':
+        return local_value.replace(minute=0, second=0, microsecond=0)
+    return local_value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def bucket_end(start, granularity):
+    """Return the start of the bucket after the one starting at start"""
+    if granularity == 'hour':
+        return start + timedelta(hours=1)
+    # Local days last 23 to 25 hours around DST changes
+    return bucket_start(start + timedelta(hours=25), 'day')
+
+
+def runtime_bin(runtime_seconds):
+    """Return the histogram bin index for a runtime"""
+    index = bisect_right(TraceRollup.RUNTIME_BINS, runtime_seconds or 0) - 1
+    return max(index, 0)
+
+
+class RuntimeBucket:
+    """In-memory partial aggregate of runtimes for a single rollup bucket"""
+
+    # Name of the count column on the rollup model
+    count_field = 'trace_count'
+
+    def __init__(self):
+        self.count = 0
+        self.runtime_sum = 0.0
+        self.runtime_min = None
+        self.runtime_max = None
+        self.sketch = QuantileSketch()
+
+    def add(self, runtime_seconds):
+        """Add a single runtime to the bucket"""
+        runtime_seconds = runtime_seconds or 0.0
+        self.count += 1
+        self.runtime_sum += runtime_seconds
+        if self.runtime_min is None or runtime_seconds < self.runtime_min:
+            self.runtime_min = runtime_seconds
+        if self.runtime_max is None or runtime_seconds > self.runtime_max:
+            self.runtime_max = runtime_seconds
+        self.sketch.add(runtime_seconds)
+
+    def merge_into(self, rollup):
+        """Merge this partial aggregate into a rollup model instance"""
+        setattr(rollup, self.count_field, getattr(rollup, self.count_field) + self.count)
+        rollup.runtime_sum += self.runtime_sum
+        if rollup.runtime_min is None or self.runtime_min < rollup.runtime_min:
+            rollup.runtime_min = self.runtime_min
+        if rollup.runtime_max is None or self.runtime_max > rollup.runtime_max:
+            rollup.runtime_max = self.runtime_max
+        rollup.runtime_sketch = QuantileSketch.from_dict(rollup.runtime_sketch).merge(self.sketch).to_dict()
+        return rollup
+
+
+class RollupBucket(RuntimeBucket):
+    """Partial aggregate for a TraceRollup bucket"""
+
+    def __init__(self):
+        super().__init__()
+        self.status_counts = Counter()
+        self.tag_counts = Counter()
+        self.runtime_histogram = [0] * len(TraceRollup.RUNTIME_BINS)
+
+    def add_trace(self, runtime_seconds, status, tags):
+        """Add a single trace to the bucket"""
+        self.add(runtime_seconds)
+        self.status_counts[status] += 1
+        self.tag_counts.update(tags or [])
+        self.runtime_histogram[runtime_bin(runtime_seconds)] += 1
+
+    def merge_into(self, rollup):
+        """Merge this partial aggregate into a TraceRollup instance"""
+        super().merge_into(rollup)
+
+        status_counts = Counter(rollup.status_counts)
+        status_counts.update(self.status_counts)
+        rollup.status_counts = dict(status_counts)
+
+        tag_counts = Counter(rollup.tag_counts)
+        tag_counts.update(self.tag_counts)
+        rollup.tag_counts = dict(tag_counts)
+
+        histogram = list(rollup.runtime_histogram) or [0] * len(self.runtime_histogram)
+        rollup.runtime_histogram = [a + b for a, b in zip(histogram, self.runtime_histogram)]
+        return rollup
+
+
+class StepRollupBucket(RuntimeBucket):
+    """Partial aggregate for a StepRollup bucket"""
+
+    count_field = 'step_count'
+
+
+# Per-thread (trace_times, step_keys) waiting for RollupManager.mark_dirty's rebuild
+_dirty = threading.local()
+
+
+def _rebuild_dirty():
+    pending = getattr(_dirty, 'pending', None)
+    if pending is None:
+        return
+    _dirty.pending = None
+    RollupManager.rebuild_buckets(*pending)
+
+
+class RollupManager:
+    """Maintains and queries the TraceRollup and StepRollup tables"""
+
+    @staticmethod
+    def aggregate(traces):
+        """Group traces into partial aggregates keyed by (granularity, bucket_start)"""
+        buckets = {}
+        for trace in traces:
+            for granularity in GRANULARITIES:
+                key = (granularity, bucket_start(trace.created_at, granularity))
+                if key not in buckets:
+                    buckets[key] = RollupBucket()
+                buckets[key].add_trace(trace.runtime_seconds, trace.status, trace.tags)
+        return buckets
+
+    @staticmethod
+    def aggregate_steps(steps):
+        """Group steps into partial aggregates keyed by (granularity, bucket_start, step_type)"""
+        buckets = {}
+        for step in steps:
+            for granularity in GRANULARITIES:
+                key = (granularity, bucket_start(step.start_time, granularity), step.step_type)
+                if key not in buckets:
+                    buckets[key] = StepRollupBucket()
+                buckets[key].add(step.runtime_seconds)
+        return buckets
+
+    @staticmethod
+    def _merge(model, buckets, key_fields):
+        """Merge partial aggregates into their stored rollup rows"""
+        if not buckets:
+            return
+
+        with transaction.atomic():
+            for key, bucket in sorted(buckets.items()):
+                rollup, _ = model.objects.select_for_update().get_or_create(
+                    **dict(zip(key_fields, key))
+                )
+                bucket.merge_into(rollup)
+                rollup.save()
+
+    @staticmethod
+    def record_traces(traces):
+        """Fold newly written traces into their hourly and daily rollups"""
+        RollupManager._merge(
+            TraceRollup,
+            RollupManager.aggregate(traces),
+            ('granularity', 'bucket_start'),
+        )
+
+    @staticmethod
+    def record_steps(steps):
+        """Fold newly written steps into their hourly and daily step rollups"""
+        RollupManager._merge(
+            StepRollup,
+            RollupManager.aggregate_steps(steps),
+            ('granularity', 'bucket_start', 'step_type'),
+        )
+
+    @staticmethod
+    def rebuild(chunk_size=2000):
+        """Recompute every trace and step rollup from scratch"""
+        traces = ChatTrace.objects.order_by().only(
+            'runtime_seconds', 'status', 'tags', 'created_at'
+        ).iterator(chunk_size=chunk_size)
+        trace_rollups = [
+            bucket.merge_into(TraceRollup(granularity=granularity, bucket_start=start))
+            for (granularity, start), bucket in sorted(RollupManager.aggregate(traces).items())
+        ]
+
+        steps = TraceStep.objects.order_by().only(
+            'step_type', 'runtime_seconds', 'start_time'
+        ).iterator(chunk_size=chunk_size)
+        step_rollups = [
+            bucket.merge_into(StepRollup(granularity=granularity, bucket_start=start, step_type=step_type))
+            for (granularity, start, step_type), bucket in sorted(RollupManager.aggregate_steps(steps).items())
+        ]
+
+        with transaction.atomic():
+            TraceRollup.objects.all().delete()
+            StepRollup.objects.all().delete()
+            TraceRollup.objects.bulk_create(trace_rollups, batch_size=chunk_size)
+            StepRollup.objects.bulk_create(step_rollups, batch_size=chunk_size)
+
+        return len(trace_rollups) + len(step_rollups)
+
+    @staticmethod
+    def rebuild_buckets(trace_times=(), step_keys=()):
+        """
+        Recompute the rollups containing some traces and steps from the rows in them.
+
+        trace_times are trace creation times; step_keys are (start_time,
+        step_type) pairs. Used when rows are deleted or edited, which the
+        runtime sketches cannot subtract.
+        """
+        for granularity, start in sorted({(g, bucket_start(t, g)) for t in trace_times for g in GRANULARITIES}):
+            bucket = RollupBucket()
+            traces = ChatTrace.objects.filter(
+                created_at__gte=start, created_at__lt=bucket_end(start, granularity)
+            ).order_by().only('runtime_seconds', 'status', 'tags', 'created_at')
+            for trace in traces.iterator():
+                bucket.add_trace(trace.runtime_seconds, trace.status, trace.tags)
+            RollupManager._replace(TraceRollup, bucket, granularity=granularity, bucket_start=start)
+
+        step_buckets = {(g, bucket_start(t, g), step_type) for t, step_type in step_keys for g in GRANULARITIES}
+        for granularity, start, step_type in sorted(step_buckets):
+            bucket = StepRollupBucket()
+            runtimes = TraceStep.objects.filter(
+                step_type=step_type, start_time__gte=start, start_time__lt=bucket_end(start, granularity)
+            ).order_by().values_list('runtime_seconds', flat=True)
+            for runtime_seconds in runtimes.iterator():
+                bucket.add(runtime_seconds)
+            RollupManager._replace(StepRollup, bucket, granularity=granularity, bucket_start=start, step_type=step_type)
+
+    @staticmethod
+    def _replace(model, bucket, **key):
+        """Store bucket as the rollup row for key, deleting the row when the bucket is empty"""
+        with transaction.atomic():
+            model.objects.filter(**key).delete()
+            if bucket.count:
+                bucket.merge_into(model(**key)).save()
+
+    @staticmethod
+    def mark_dirty(trace_times=(), step_keys=()):
+        """
+        Rebuild the rollups of some traces and steps once the current transaction commits.
+
+        Buckets marked dirty by many rows, like the steps of a deleted trace,
+        are rebuilt once. Outside a transaction the rebuild runs right away.
+        """
+        pending = getattr(_dirty, 'pending', None)
+        if pending is None:
+            pending = _dirty.pending = (set(), set())
+        pending[0].update(trace_times)
+        pending[1].update(step_keys)
+        # Every mark registers the flush, so a rolled-back transaction cannot
+        # strand marks; flushes after the first find nothing left to do
+        transaction.on_commit(_rebuild_dirty)
+
+    @staticmethod
+    def buckets(granularity='day', start=None, end=None, model=TraceRollup):
+        """Return the rollups of a granularity, optionally limited to a time window"""
+        rollups = model.objects.filter(granularity=granularity)
+        if start is not None:
+            rollups = rollups.filter(bucket_start__gte=bucket_start(start, granularity))
+        if end is not None:
+            rollups = rollups.filter(bucket_start__lte=end)
+        return rollups
+
+    @staticmethod
+    def window_granularity(start=None, end=None):
+        """Use hourly buckets for explicit windows and daily buckets for all history"""
+        return 'hour' if start is not None or end is not None else 'day'
+
+    @staticmethod
+    def activity_matrix(start=None, end=None):
+        """
+        Return (days, counts) of trace activity per local day and hour.
+        
+        days is a datetime64[D] array of consecutive local dates and counts a
+        len(days) x 24 integer matrix. Cells are summed from the hourly
+        rollups in one bincount, so the repeated hour of a DST change is
+        folded into its local hour.
+        """
+        rollups = load_frame(RollupManager.buckets('hour', start, end).order_by(), ['bucket_start', 'trace_count'])
+        if rollups.empty:
+            return np.array([], dtype='datetime64[D]'), np.zeros((0, 24), dtype=np.int64)
+        
+        # Local wall-clock hours since the epoch, split into day and hour of day
+        hours = local_naive(rollups['bucket_start']).to_numpy().astype('datetime64[h]').astype(np.int64)
+        days, hour_of_day = np.divmod(hours, 24)
+        first_day = days.min()
+        day_count = int(days.max() - first_day) + 1
+        
+        counts = np.bincount(
+            (days - first_day) * 24 + hour_of_day,
+            weights=rollups['trace_count'].to_numpy(),
+            minlength=day_count * 24,
+        ).astype(np.int64).reshape(day_count, 24)
+        return np.arange(first_day, first_day + day_count).astype('datetime64[D]'), counts
+
+    @staticmethod
+    def runtime_percentiles(start=None, end=None):
+        """Merge the runtime sketches of a window into trace and per-step percentiles"""
+        granularity = RollupManager.window_granularity(start, end)
+
+        trace_sketches = RollupManager.buckets(granularity, start, end).values_list('runtime_sketch', flat=True)
+        trace_sketch = QuantileSketch.merged(trace_sketches)
+
+        step_sketches = {}
+        step_rollups = RollupManager.buckets(granularity, start, end, model=StepRollup).values_list(
+            'step_type', 'runtime_sketch'
+        )
+        for step_type, data in step_rollups:
+            if data:
+                sketch = step_sketches.setdefault(step_type, QuantileSketch())
+                sketch.merge(QuantileSketch.from_dict(data))
+
+        return {
+            'traces': dict(trace_sketch.percentiles(), count=trace_sketch.count),
+            'steps': {
+                step_type: dict(sketch.percentiles(), count=sketch.count)
+                for step_type, sketch in sorted(step_sketches.items())
+            },
+        }
@@ -0,0 +1,104 @@
+"""
+Full-text search over trace prompts and responses
+"""
+import re
+from django.db import connection
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+# SQLite FTS5 external content table kept in sync by triggers (migration 0007)
+FTS_TABLE = 'tracegptapp_chattrace_fts'
+# Stored tsvector column with a GIN index on PostgreSQL (migration 0007)
+SEARCH_VECTOR_COLUMN = 'search_vector'
+SEARCH_CONFIG = 'english'
+
+# Snippet markers are control characters so the text can be HTML escaped
+# before they are turned into <mark> tags
+MARK_START = '\x02'
+MARK_END = '\x03'
+SNIPPET_TOKENS = 16
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def fts_query(query):
+    """
+    Turn free text into an FTS5 MATCH expression.
+
+    Every word is quoted so operators and punctuation in the input cannot
+    cause syntax errors, and the last word is a prefix match so results
+    update while the user is still typing.
+    """
+    tokens = TOKEN_RE.findall(query or '')
+    if not tokens:
+        return None
+    terms = [f'"{token}"' for token in tokens]
+    terms[-1] += ' *'
+    return ' '.join(terms)
+
+
+def search_traces(queryset, query, order_by_rank=True):
+    """
+    Filter a ChatTrace queryset to traces matching a search query.
+
+    Matching traces are annotated with ``search_rank`` (higher is more
+    relevant) and ``search_snippet`` (text around the matched terms with
+    marker characters, see ``highlight``) and ordered by relevance unless
+    ``order_by_rank`` is False. Backends without a search index fall back to
+    substring matching.
+    """
+    if connection.vendor == 'sqlite':
+        match = fts_query(query)
+        if match is None:
+            return queryset.none()
+        results = queryset.extra(
+            tables=[FTS_TABLE],
+            where=[
+                f'{FTS_TABLE}.rowid = tracegptapp_chattrace.id',
+                f'{FTS_TABLE} MATCH %s',
+            ],
+            params=[match],
+            select={
+                # bm25() is lower for better matches
+                'search_rank': f'-bm25({FTS_TABLE})',
+                'search_snippet': f"snippet({FTS_TABLE}, -1, %s, %s, '…', {SNIPPET_TOKENS})",
+            },
+            select_params=[MARK_START, MARK_END],
+        )
+        return results.order_by('-search_rank', '-created_at') if order_by_rank else results
+
+    if connection.vendor == 'postgresql':
+        if not TOKEN_RE.search(query or ''):
+            return queryset.none()
+        tsquery = f"websearch_to_tsquery('{SEARCH_CONFIG}', %s)"
+        results = queryset.extra(
+            where=[f'tracegptapp_chattrace.{SEARCH_VECTOR_COLUMN} @@ {tsquery}'],
+            params=[query],
+            select={
+                'search_rank': f'ts_rank_cd(tracegptapp_chattrace.{SEARCH_VECTOR_COLUMN}, {tsquery})',
+                'search_snippet': (
+                    f"ts_headline('{SEARCH_CONFIG}', "
+                    f"tracegptapp_chattrace.input_prompt || ' ' || tracegptapp_chattrace.output_response, "
+                    f"{tsquery}, %s)"
+                ),
+            },
+            select_params=[
+                query,
+                query,
+                f'StartSel={MARK_START}, StopSel={MARK_END}, MaxWords={SNIPPET_TOKENS}, MinWords=5',
+            ],
+        )
+        return results.order_by('-search_rank', '-created_at') if order_by_rank else results
+
+    return (
+        queryset.filter(input_prompt__icontains=query)
+        | queryset.filter(output_response__icontains=query)
+    )
+
+
+def highlight(snippet):
+    """Render a search snippet as HTML with the matched terms in <mark> tags"""
+    if not snippet:
+        return ''
+    html = escape(snippet).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>')
+    return mark_safe(html)
@@ -0,0 +1,119 @@
+"""
+orjson-based JSON encoding shared by the tracer, the model JSON fields and the JSON views
+"""
+import datetime
+import decimal
+import json
+import numpy as np
+import orjson
+from django import http
+from django.db import models
+from django.utils.duration import duration_iso_string
+from django.utils.functional import Promise
+
+# numpy arrays and scalars are encoded natively; dict keys may be ints like with the stdlib
+OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+loads = orjson.loads
+
+
+def default(value):
+    """
+    Encode the values orjson does not handle itself.
+
+    UUIDs, datetimes, dates, times and numpy arrays of native dtypes are
+    encoded by orjson; Decimals, timedeltas and lazy strings follow
+    DjangoJSONEncoder.
+    """
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, datetime.timedelta):
+        return duration_iso_string(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    if isinstance(value, Promise):
+        return str(value)
+    # pandas Timestamps and other datetime-likes
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _default_or_str(value):
+    try:
+        return default(value)
+    except TypeError:
+        return str(value)
+
+
+def dumps(value, indent=False):
+    """Encode value as JSON bytes"""
+    option = OPTIONS | orjson.OPT_INDENT_2 if indent else OPTIONS
+    return orjson.dumps(value, default=default, option=option)
+
+
+def to_jsonable(value):
+    """
+    Return value as plain JSON types (dicts, lists, strings, numbers, None).
+
+    One encode/decode round trip in orjson replaces walking the value in
+    Python. Values nothing knows how to encode become their str() rather
+    than failing, since traced inputs and outputs can be anything.
+    """
+    return orjson.loads(orjson.dumps(value, default=_default_or_str, option=OPTIONS))
+
+
+class JSONEncoder(json.JSONEncoder):
+    """A json.JSONEncoder that encodes with orjson, for APIs that take an encoder class"""
+
+    def encode(self, o):
+        return dumps(o).decode()
+
+
+class JSONDecoder(json.JSONDecoder):
+    """A json.JSONDecoder that decodes with orjson, for APIs that take a decoder class"""
+
+    def decode(self, s, *args, **kwargs):
+        return orjson.loads(s)
+
+
+class JSONField(models.JSONField):
+    """
+    JSONField encoding and decoding with orjson.
+
+    The stored JSON is the same, so it deconstructs like a plain JSONField
+    and switching a field to it needs no migration.
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('encoder', JSONEncoder)
+        kwargs.setdefault('decoder', JSONDecoder)
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if kwargs.get('encoder') is JSONEncoder:
+            del kwargs['encoder']
+        if kwargs.get('decoder') is JSONDecoder:
+            del kwargs['decoder']
+        return name, 'django.db.models.JSONField', args, kwargs
+
+
+class JsonResponse(http.JsonResponse):
+    """
+    django.http.JsonResponse encoding with orjson.
+
+    Accepts ``json_dumps_params={'indent': ...}`` for pretty output; other
+    stdlib json options have no orjson equivalent and are ignored.
+    """
+
+    def __init__(self, data, safe=True, json_dumps_params=None, **kwargs):
+        if safe and not isinstance(data, dict):
+            raise TypeError("In order to allow non-dict objects to be serialized set the safe parameter to False.")
+        kwargs.setdefault('content_type', 'application/json')
+        indent = bool((json_dumps_params or {}).get('indent'))
+        http.HttpResponse.__init__(self, content=dumps(data, indent=indent), **kwargs)
@@ -0,0 +1,88 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import chart_cache
+from .models import ChatExample, ChatTrace, ContactMessage, TraceStep, TraceTag
+from .rollups import RollupManager
+from .snapshots import mark_stale
+
+
+@receiver(pre_save, sender=ChatTrace)
+def remember_trace_bucket(sender, instance, raw=False, **kwargs):
+    """Note when an edited trace was created, in case the edit moves it to another bucket"""
+    if not raw and not instance._state.adding:
+        instance._rollup_previous = ChatTrace.objects.filter(pk=instance.pk).values_list('created_at', flat=True).first()
+
+
+@receiver(post_save, sender=ChatTrace)
+def update_trace_rollups(sender, instance, created, raw=False, **kwargs):
+    """Keep the hourly/daily rollups and the snapshot in step with created and edited traces"""
+    if raw:
+        return
+    if created:
+        RollupManager.record_traces([instance])
+        return
+    # Edits can change the status, tags or runtime a bucket counted
+    previous = getattr(instance, '_rollup_previous', None)
+    trace_times = [instance.created_at] + ([previous] if previous else [])
+    RollupManager.mark_dirty(trace_times=trace_times)
+    mark_stale('traces', trace_times)
+
+
+@receiver(post_delete, sender=ChatTrace)
+def remove_trace_from_rollups(sender, instance, **kwargs):
+    """Rebuild the rollups and snapshot day that counted a deleted trace"""
+    RollupManager.mark_dirty(trace_times=[instance.created_at])
+    mark_stale('traces', [instance.created_at])
+
+
+@receiver(post_save, sender=ChatTrace)
+def sync_trace_tags(sender, instance, created, raw=False, **kwargs):
+    """Mirror ChatTrace.tags into the normalized TraceTag table"""
+    if raw:
+        return
+    
+    tags = set(instance.tags or [])
+    existing = set() if created else set(instance.tag_links.values_list('tag', flat=True))
+    
+    if existing - tags:
+        instance.tag_links.filter(tag__in=existing - tags).delete()
+    if tags - existing:
+        TraceTag.objects.bulk_create([TraceTag(trace=instance, tag=tag) for tag in sorted(tags - existing)])
+
+
+@receiver(pre_save, sender=TraceStep)
+def remember_step_bucket(sender, instance, raw=False, **kwargs):
+    """Note the start time and type of an edited step, in case the edit moves it to another bucket"""
+    if not raw and not instance._state.adding:
+        instance._rollup_previous = TraceStep.objects.filter(pk=instance.pk).values_list('start_time', 'step_type').first()
+
+
+@receiver(post_save, sender=TraceStep)
+def update_step_rollups(sender, instance, created, raw=False, **kwargs):
+    """Keep the per step type rollups and the snapshot in step with created and edited steps"""
+    if raw:
+        return
+    if created:
+        RollupManager.record_steps([instance])
+        return
+    previous = getattr(instance, '_rollup_previous', None)
+    step_keys = [(instance.start_time, instance.step_type)] + ([previous] if previous else [])
+    RollupManager.mark_dirty(step_keys=step_keys)
+    mark_stale('steps', [start_time for start_time, _ in step_keys])
+
+
+@receiver(post_delete, sender=TraceStep)
+def remove_step_from_rollups(sender, instance, **kwargs):
+    """Rebuild the step rollups and snapshot day that counted a deleted step"""
+    RollupManager.mark_dirty(step_keys=[(instance.start_time, instance.step_type)])
+    mark_stale('steps', [instance.start_time])
+
+
+@receiver([post_save, post_delete], sender=ChatTrace)
+@receiver([post_save, post_delete], sender=TraceStep)
+@receiver([post_save, post_delete], sender=ChatExample)
+@receiver([post_save, post_delete], sender=ContactMessage)
+def invalidate_chart_versions(sender, **kwargs):
+    """Make cached charts pick up rows written by this process right away"""
+    chart_cache.invalidate(sender)
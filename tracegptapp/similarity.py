@@ -0,0 +1,113 @@
+"""
+Batch similarity scoring of responses against expected responses
+"""
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+METRICS = ('overlap', 'jaccard', 'cosine', 'bm25')
+
+# BM25 term frequency saturation and document length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text):
+    """Lowercase whitespace tokens, as compared by the original overlap score"""
+    return (text or '').lower().split()
+
+
+def term_matrix(texts):
+    """
+    Return a CSR matrix of term counts with one row per text.
+
+    All texts are tokenized once into a flat list; the vocabulary and the
+    column of every token come from a single hash-based factorize call, and
+    duplicate tokens in a row are summed into counts by the sparse
+    constructor.
+    """
+    token_lists = [tokenize(text) for text in texts]
+    lengths = np.fromiter((len(tokens) for tokens in token_lists), dtype=np.int64, count=len(token_lists))
+    tokens = [token for tokens in token_lists for token in tokens]
+    columns, vocabulary = pd.factorize(pd.Series(tokens, dtype=object))
+
+    indptr = np.concatenate(([0], np.cumsum(lengths)))
+    matrix = sparse.csr_matrix(
+        (np.ones(len(columns), dtype=np.float64), columns, indptr),
+        shape=(len(texts), len(vocabulary)),
+    )
+    matrix.sum_duplicates()
+    return matrix
+
+
+def _row_sums(matrix):
+    return np.asarray(matrix.sum(axis=1)).ravel()
+
+
+def _divide(numerator, denominator):
+    """Element-wise division that yields 0 where the denominator is 0"""
+    return np.divide(numerator, denominator, out=np.zeros_like(numerator, dtype=np.float64), where=denominator > 0)
+
+
+def score_pairs(responses, expected, k1=BM25_K1, b=BM25_B):
+    """
+    Score many (response, expected) pairs at once.
+
+    Returns a dict of metric name -> float array with one score per pair:
+
+    - overlap: shared distinct words over the larger word set, the original
+      ``similarity_to_expected`` score
+    - jaccard: shared distinct words over all distinct words
+    - cosine: cosine of the term count vectors
+    - bm25: BM25 term saturation score of the response for the expected
+      words as the query, with the expected response as the reference
+      length, divided by the score of the expected response itself, so
+      identical texts score 1; responses that outscore it are capped at 1.
+      There is no idf term, so a pair scores the same alone or in a batch
+    """
+    if len(responses) != len(expected):
+        raise ValueError("responses and expected must have the same length")
+    count = len(responses)
+    if not count:
+        return {metric: np.zeros(0) for metric in METRICS}
+
+    # One vocabulary for both sides so the columns line up
+    counts = term_matrix(list(responses) + list(expected))
+    response_counts, expected_counts = counts[:count], counts[count:]
+    response_words = (response_counts > 0).astype(np.float64)
+    expected_words = (expected_counts > 0).astype(np.float64)
+
+    shared = _row_sums(response_words.multiply(expected_words))
+    response_size = _row_sums(response_words)
+    expected_size = _row_sums(expected_words)
+
+    dot = _row_sums(response_counts.multiply(expected_counts))
+    norms = np.sqrt(_row_sums(response_counts.multiply(response_counts)) * _row_sums(expected_counts.multiply(expected_counts)))
+
+    # BM25 over the response terms that also appear in the expected response.
+    # Every term weighs the same and the expected response is the reference
+    # length, so a pair scores the same whatever else is in the batch
+    response_lengths = _row_sums(response_counts)
+    expected_lengths = _row_sums(expected_counts)
+    saturation = k1 * (1 - b + b * _divide(response_lengths, expected_lengths))
+
+    def bm25_scores(documents, document_saturation):
+        matches = documents.multiply(expected_words).tocoo()
+        term_scores = matches.data * (k1 + 1) / (matches.data + document_saturation[matches.row])
+        return np.bincount(matches.row, weights=term_scores, minlength=count)
+
+    bm25 = bm25_scores(response_counts, saturation)
+    # The expected response scored as a document of the reference length
+    bm25_bound = bm25_scores(expected_counts, np.full(count, k1))
+
+    return {
+        'overlap': _divide(shared, np.maximum(response_size, expected_size)),
+        'jaccard': _divide(shared, response_size + expected_size - shared),
+        'cosine': _divide(dot, norms),
+        'bm25': np.minimum(_divide(bm25, bm25_bound), 1.0),
+    }
+
+
+def score_pair(response, expected):
+    """Score a single pair, returning a dict of metric name -> float"""
+    return {metric: float(values[0]) for metric, values in score_pairs([response], [expected]).items()}
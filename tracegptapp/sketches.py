@@ -0,0 +1,139 @@
+"""
+Mergeable quantile sketches for runtime percentiles
+"""
+import math
+
+DEFAULT_RELATIVE_ACCURACY = 0.01
+DEFAULT_MAX_BINS = 2048
+# Values at or below this are counted in the zero bin
+MIN_INDEXABLE_VALUE = 1e-9
+
+
+class QuantileSketch:
+    """
+    DDSketch-style quantile sketch.
+
+    Values are counted in logarithmically sized bins so every quantile estimate
+    is within ``relative_accuracy`` of the true value. Sketches with the same
+    accuracy merge by adding bin counts, which lets per-bucket sketches be
+    combined over any time window.
+    """
+
+    def __init__(self, relative_accuracy=DEFAULT_RELATIVE_ACCURACY, max_bins=DEFAULT_MAX_BINS):
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.bins = {}
+        self.zero_count = 0
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def _key(self, value):
+        """Return the bin index for a positive value"""
+        return math.ceil(math.log(value) / self.log_gamma)
+
+    def _value(self, key):
+        """Return the representative value for a bin index"""
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def _collapse(self):
+        """Fold the lowest bins together once the bin limit is exceeded"""
+        if len(self.bins) <= self.max_bins:
+            return
+        keys = sorted(self.bins)
+        overflow = keys[:len(keys) - self.max_bins + 1]
+        target = overflow[-1]
+        self.bins[target] = sum(self.bins.pop(key) for key in overflow[:-1]) + self.bins[target]
+
+    def add(self, value, count=1):
+        """Add a value to the sketch"""
+        if value is None:
+            return
+        if value <= MIN_INDEXABLE_VALUE:
+            self.zero_count += count
+        else:
+            key = self._key(value)
+            self.bins[key] = self.bins.get(key, 0) + count
+            self._collapse()
+        self.count += count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        """Merge another sketch into this one"""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches with different relative accuracy")
+        if not other.count:
+            return self
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + count
+        self._collapse()
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        return self
+
+    def quantile(self, q):
+        """Return the estimated value at quantile q (0 <= q <= 1)"""
+        if not self.count:
+            return None
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return max(self.min, 0)
+
+        seen = self.zero_count
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                # Bin estimates can overshoot the observed range at the edges
+                return min(max(self._value(key), self.min), self.max)
+        return self.max
+
+    def percentiles(self, quantiles=(0.5, 0.95, 0.99), precision=3):
+        """Return a dict of rounded percentile estimates such as {'p50': ...}"""
+        result = {}
+        for q in quantiles:
+            value = self.quantile(q)
+            result[f'p{q * 100:g}'] = round(value, precision) if value is not None else None
+        return result
+
+    def to_dict(self):
+        """Serialize the sketch to a JSON compatible dict"""
+        return {
+            'accuracy': self.relative_accuracy,
+            'count': self.count,
+            'zero_count': self.zero_count,
+            'min': self.min,
+            'max': self.max,
+            'bins': {str(key): count for key, count in self.bins.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Deserialize a sketch produced by to_dict"""
+        sketch = cls(relative_accuracy=(data or {}).get('accuracy', DEFAULT_RELATIVE_ACCURACY))
+        if not data:
+            return sketch
+        sketch.bins = {int(key): count for key, count in data.get('bins', {}).items()}
+        sketch.zero_count = data.get('zero_count', 0)
+        sketch.count = data.get('count', 0)
+        sketch.min = data.get('min')
+        sketch.max = data.get('max')
+        return sketch
+
+    @classmethod
+    def merged(cls, serialized_sketches):
+        """Merge an iterable of serialized sketches into a single sketch"""
+        sketch = cls()
+        for data in serialized_sketches:
+            if data:
+                sketch.merge(cls.from_dict(data))
+        return sketch
@@ -0,0 +1,336 @@
+"""
+Columnar, day-partitioned Arrow snapshots of ChatTrace and TraceStep
+"""
+import json
+import os
+import tempfile
+from datetime import date, datetime, time
+from itertools import islice
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.compute as pc
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from . import frames
+from .models import ChatTrace, SnapshotStaleDay, TraceStep
+from .rollups import bucket_end
+
+TIMESTAMP = pa.timestamp('us', tz='UTC')
+CATEGORY = pa.dictionary(pa.int32(), pa.string())
+
+# Snapshot tables: model, the time field rows are partitioned by, and the
+# exported columns. Large text and JSON payloads are left in the database.
+SNAPSHOT_TABLES = {
+    'traces': {
+        'model': ChatTrace,
+        'time_field': 'created_at',
+        'schema': pa.schema([
+            ('id', pa.int64()),
+            ('run_id', pa.string()),
+            ('status', CATEGORY),
+            ('runtime_seconds', pa.float64()),
+            ('tags', pa.list_(pa.string())),
+            ('created_at', TIMESTAMP),
+        ]),
+    },
+    'steps': {
+        'model': TraceStep,
+        'time_field': 'start_time',
+        'schema': pa.schema([
+            ('id', pa.int64()),
+            ('trace_id', pa.int64()),
+            ('step_type', CATEGORY),
+            ('step_name', pa.string()),
+            ('runtime_seconds', pa.float64()),
+            ('start_time', TIMESTAMP),
+            ('end_time', TIMESTAMP),
+        ]),
+    },
+}
+
+# Days with more part files than this are merged into one after an export
+MAX_PARTS_PER_DAY = 16
+
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def _day_range(day):
+    """The aware [start, end) of a local day"""
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, bucket_end(start, 'day')
+
+
+def _days_filter(table_name, days):
+    """Q matching the rows of a table whose time field falls on one of the local days"""
+    time_field = SNAPSHOT_TABLES[table_name]['time_field']
+    matches = Q(pk__in=[])
+    for day in days:
+        start, end = _day_range(day)
+        matches |= Q(**{f'{time_field}__gte': start, f'{time_field}__lt': end})
+    return matches
+
+
+def mark_stale(table_name, times):
+    """
+    Record the local days of edited or deleted rows as stale.
+
+    Reads take stale days from the database instead of the snapshot, and
+    the next export rewrites them. Marks are written in the caller's
+    transaction, so a rolled-back edit leaves none behind.
+    """
+    if not settings.TRACE_SNAPSHOT_DIR:
+        return
+    days = sorted({timezone.localdate(value) for value in times if value is not None})
+    # Re-marking a day moves marked_at forward, so an export running meanwhile keeps the mark
+    SnapshotStaleDay.objects.bulk_create(
+        [SnapshotStaleDay(table_name=table_name, day=day, marked_at=timezone.now()) for day in days],
+        update_conflicts=True,
+        unique_fields=['table_name', 'day'],
+        update_fields=['marked_at'],
+    )
+
+
+def rows_to_table(table_name, rows):
+    """Build an Arrow table from values_list rows in schema column order"""
+    schema = SNAPSHOT_TABLES[table_name]['schema']
+    columns = list(zip(*rows)) if rows else [[] for _ in schema]
+    arrays = []
+    for field, values in zip(schema, columns):
+        values = [list(value) if isinstance(value, list) else value for value in values]
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(values, type=pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(values, type=field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+class SnapshotStore:
+    """
+    Day-partitioned Arrow IPC files under ``<directory>/<table>/day=YYYY-MM-DD/``.
+
+    Exports are incremental: each run appends rows with ids above the last
+    exported id as new part files, so existing files are never rewritten
+    except when a day's parts are compacted, or when rows of the day were
+    edited or deleted (see ``mark_stale``) and the day is rewritten. Arrow
+    IPC files are read memory-mapped, so selecting a few columns only
+    touches those columns. Rows are assigned to days in local time,
+    matching the rollups.
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+
+    @property
+    def state_path(self):
+        return self.directory / '_state.json'
+
+    def load_state(self):
+        """Return {table: last exported id}"""
+        try:
+            return json.loads(self.state_path.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self, state):
+        self._atomic_write(self.state_path, lambda f: f.write(json.dumps(state).encode()))
+
+    @staticmethod
+    def _atomic_write(path, write):
+        """Write a file via a temporary file so readers never see a partial file"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+    def day_dir(self, table_name, day):
+        return self.directory / table_name / f'day={day.isoformat()}'
+
+    def _write_part(self, path, table):
+        def write(f):
+            with pa.ipc.new_file(f, table.schema) as writer:
+                writer.write_table(table)
+        self._atomic_write(path, write)
+
+    def _parts(self, table_name, start_day=None, end_day=None, skip_days=()):
+        """Part files of a table, optionally limited to a range of days"""
+        table_dir = self.directory / table_name
+        if not table_dir.exists():
+            return []
+        parts = []
+        for day_dir in sorted(table_dir.glob('day=*')):
+            day = date.fromisoformat(day_dir.name[len('day='):])
+            if (start_day and day < start_day) or (end_day and day > end_day) or day in skip_days:
+                continue
+            parts.extend(sorted(day_dir.glob('part-*.arrow')))
+        return parts
+
+    @staticmethod
+    def stale_days(table_name, start_day=None, end_day=None):
+        """{day: marked_at} of the days with rows edited or deleted since they were exported"""
+        marks = SnapshotStaleDay.objects.filter(table_name=table_name)
+        if start_day is not None:
+            marks = marks.filter(day__gte=start_day)
+        if end_day is not None:
+            marks = marks.filter(day__lte=end_day)
+        return dict(marks.values_list('day', 'marked_at'))
+
+    def _rewrite_day(self, table_name, day, last_id):
+        """Replace the parts of a day with its exported rows as they are in the database now"""
+        config = SNAPSHOT_TABLES[table_name]
+        rows = list(config['model'].objects.filter(_days_filter(table_name, [day]), id__lte=last_id)
+                    .order_by('id').values_list(*config['schema'].names))
+        parts = sorted(self.day_dir(table_name, day).glob('part-*.arrow'))
+        if rows:
+            path = parts.pop(0) if parts else self.day_dir(table_name, day) / f'part-{rows[0][0]:012d}.arrow'
+            self._write_part(path, rows_to_table(table_name, rows))
+        for path in parts:
+            path.unlink()
+
+    def export(self, table_name, full=False, chunk_size=10000):
+        """
+        Rewrite stale days and append rows added since the last export.
+
+        With full, the snapshot is discarded and every row exported again.
+        """
+        config = SNAPSHOT_TABLES[table_name]
+        state = self.load_state()
+        stale = self.stale_days(table_name)
+        if full:
+            for path in self._parts(table_name):
+                path.unlink()
+            state.pop(table_name, None)
+        last_id = state.get(table_name, 0)
+
+        if not full:
+            for day in stale:
+                self._rewrite_day(table_name, day, last_id)
+        # Days marked again while they were rewritten keep their mark
+        for day, marked_at in stale.items():
+            SnapshotStaleDay.objects.filter(table_name=table_name, day=day, marked_at__lte=marked_at).delete()
+
+        fields = config['schema'].names
+        rows = config['model'].objects.filter(id__gt=last_id).order_by('id').values_list(*fields)
+        time_index = fields.index(config['time_field'])
+
+        exported = 0
+        touched_days = set()
+        for chunk in _batched(rows.iterator(chunk_size=chunk_size), chunk_size):
+            by_day = {}
+            for row in chunk:
+                by_day.setdefault(timezone.localdate(row[time_index]), []).append(row)
+
+            # Parts are named after the chunk's first id, so rerunning an
+            # interrupted export overwrites them instead of duplicating rows
+            first_id = chunk[0][0]
+            for day, day_rows in by_day.items():
+                self._write_part(self.day_dir(table_name, day) / f'part-{first_id:012d}.arrow',
+                                 rows_to_table(table_name, day_rows))
+                touched_days.add(day)
+
+            state[table_name] = chunk[-1][0]
+            self._save_state(state)
+            exported += len(chunk)
+
+        for day in touched_days:
+            if len(list(self.day_dir(table_name, day).glob('part-*.arrow'))) > MAX_PARTS_PER_DAY:
+                self.compact(table_name, day)
+        return exported
+
+    def compact(self, table_name, day):
+        """Merge the part files of a day into one"""
+        parts = sorted(self.day_dir(table_name, day).glob('part-*.arrow'))
+        if len(parts) < 2:
+            return
+        table = pa.concat_tables(self._read_part(path) for path in parts).unify_dictionaries().combine_chunks()
+        self._write_part(parts[0], table)
+        for path in parts[1:]:
+            path.unlink()
+
+    @staticmethod
+    def _read_part(path, columns=None):
+        """Read a part file memory-mapped, with only the requested columns"""
+        source = pa.memory_map(str(path), 'r')
+        table = pa.ipc.open_file(source).read_all()
+        return table.select(columns) if columns else table
+
+    def read(self, table_name, columns=None, start=None, end=None, include_tail=True):
+        """
+        Read a table as an Arrow table.
+
+        Only partitions of days overlapping start/end are opened. With
+        include_tail, rows written to the database since the last export are
+        fetched and appended, and days with edited or deleted rows are read
+        from the database instead of their parts, so results are never stale.
+        """
+        config = SNAPSHOT_TABLES[table_name]
+        columns = list(columns or config['schema'].names)
+        time_field = config['time_field']
+        read_columns = columns if time_field in columns or (start is None and end is None) else columns + [time_field]
+
+        start_day = timezone.localdate(start) if start is not None else None
+        end_day = timezone.localdate(end) if end is not None else None
+        stale = self.stale_days(table_name, start_day, end_day) if include_tail else {}
+        tables = [self._read_part(path, read_columns) for path in self._parts(table_name, start_day, end_day, stale)]
+
+        if include_tail:
+            fields = config['schema'].names
+            last_id = self.load_state().get(table_name, 0)
+            tail = config['model'].objects.filter(Q(id__gt=last_id) | _days_filter(table_name, stale)).order_by('id')
+            if start is not None:
+                tail = tail.filter(**{f'{time_field}__gte': start})
+            if end is not None:
+                tail = tail.filter(**{f'{time_field}__lte': end})
+            tail_rows = list(tail.values_list(*fields))
+            if tail_rows:
+                tables.append(rows_to_table(table_name, tail_rows).select(read_columns))
+
+        if not tables:
+            return config['schema'].empty_table().select(columns)
+
+        # Dictionary columns are unified so parts with different dictionaries concatenate
+        table = pa.concat_tables(tables, promote_options='permissive').unify_dictionaries()
+        if start is not None:
+            table = table.filter(pc.greater_equal(table[time_field], pa.scalar(start, TIMESTAMP)))
+        if end is not None:
+            table = table.filter(pc.less_equal(table[time_field], pa.scalar(end, TIMESTAMP)))
+        return table.select(columns)
+
+
+def get_snapshot_store():
+    """Return the configured snapshot store, or None when snapshots are disabled"""
+    if not settings.TRACE_SNAPSHOT_DIR:
+        return None
+    return SnapshotStore(settings.TRACE_SNAPSHOT_DIR)
+
+
+def load_columns(table_name, columns, start=None, end=None):
+    """
+    Load columns of traces or steps as a DataFrame.
+
+    When TRACE_SNAPSHOT_READS is enabled and a snapshot has been exported,
+    the columns are read memory-mapped from the snapshot (plus any rows
+    added since). Otherwise they are queried from the database.
+    """
+    store = get_snapshot_store() if settings.TRACE_SNAPSHOT_READS else None
+    if store is not None and table_name in store.load_state():
+        return store.read(table_name, columns, start, end).to_pandas()
+
+    config = SNAPSHOT_TABLES[table_name]
+    rows = config['model'].objects.order_by()
+    if start is not None:
+        rows = rows.filter(**{f"{config['time_field']}__gte": start})
+    if end is not None:
+        rows = rows.filter(**{f"{config['time_field']}__lte": end})
+    return frames.load_frame(rows, columns)
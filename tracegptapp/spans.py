@@ -0,0 +1,274 @@
+"""
+Compact span records for the tracer, converted to dicts or RunTrees only when a trace ends
+"""
+import functools
+import inspect
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import timedelta
+from django.utils import timezone
+from langsmith.run_trees import RunTree
+
+# Digits per level of a step's materialized path, e.g. "000002.000001"
+PATH_SEGMENT_WIDTH = 6
+
+# (SpanStore, Span) new spans are nested under; asyncio tasks inherit it and
+# StageScheduler copies it into its worker threads
+_current = ContextVar('tracegpt_current_span', default=None)
+
+
+class Span:
+    """
+    One run of a trace.
+
+    Timings are ``perf_counter_ns`` readings, which are monotonic and cheap
+    to take; they become wall-clock datetimes through the clock anchor of
+    the trace's SpanStore only when the trace is exported. Inputs and outputs
+    are kept as given and made JSON safe at export as well. Children point
+    at their parent span; ids are generated on first use, so a span opened
+    in a hot loop costs no uuid until its trace is exported.
+    """
+    __slots__ = ('_id', 'trace_id', 'parent', 'name', 'run_type', 'inputs', 'outputs', 'start_ns', 'end_ns')
+
+    def __init__(self, name, run_type, inputs=None, outputs=None, start_ns=None, end_ns=None, parent=None):
+        self._id = None
+        self.parent = parent
+        # A root span is its own trace
+        self.trace_id = parent.trace_id if parent is not None else self.id
+        self.name = name
+        self.run_type = run_type
+        self.inputs = inputs
+        self.outputs = outputs
+        self.start_ns = start_ns
+        self.end_ns = end_ns
+
+    @property
+    def id(self):
+        if self._id is None:
+            self._id = str(uuid.uuid4())
+        return self._id
+
+    @property
+    def parent_id(self):
+        return self.parent.id if self.parent is not None else None
+
+    @property
+    def duration_ns(self):
+        if self.start_ns is None or self.end_ns is None:
+            return None
+        return self.end_ns - self.start_ns
+
+    def __repr__(self):
+        return f"<Span {self.name} {self.id}>"
+
+
+class SpanStore:
+    """
+    The spans of one trace: its root span and every descendant in the order they were added.
+
+    The wall clock and ``perf_counter_ns`` are read together when the trace
+    starts; every span time is an offset from that anchor.
+    """
+    __slots__ = ('root', 'children', 'metadata', 'wall_start', 'ns_start')
+
+    def __init__(self, root, metadata=None):
+        self.root = root
+        self.children = []
+        self.metadata = metadata or {}
+        self.wall_start = timezone.now()
+        self.ns_start = time.perf_counter_ns()
+        if root.start_ns is None:
+            root.start_ns = self.ns_start
+
+    def to_datetime(self, ns):
+        """Wall-clock datetime of a perf_counter_ns reading"""
+        if ns is None:
+            return None
+        return self.wall_start + timedelta(microseconds=(ns - self.ns_start) // 1000)
+
+    def to_ns(self, value):
+        """perf_counter_ns reading of a wall-clock datetime"""
+        return self.ns_start + round((value - self.wall_start).total_seconds() * 1e9)
+
+    def _isoformat(self, ns):
+        value = self.to_datetime(ns)
+        return value.isoformat() if value else None
+
+    def span_dict(self, span, prepare=None):
+        """The end_trace dict form of a span; prepare makes inputs and outputs JSON safe"""
+        prepare = prepare or (lambda data: data)
+        return {
+            "id": span.id,
+            "name": span.name,
+            "run_type": span.run_type,
+            "start_time": self._isoformat(span.start_ns),
+            "end_time": self._isoformat(span.end_ns),
+            "inputs": prepare(span.inputs),
+            "outputs": prepare(span.outputs),
+        }
+
+    def open_span(self, name, run_type, inputs, parent):
+        """Start a span under parent, timed from now"""
+        span = Span(name, run_type, inputs or {}, None, time.perf_counter_ns(), parent=parent)
+        self.children.append(span)
+        return span
+
+    def walk(self):
+        """
+        Yield (span, path, depth) for every descendant in depth-first order.
+
+        Siblings keep the order of ``children``. The path is the dotted,
+        zero-padded position of each ancestor among its siblings, so sorting
+        by path gives the same order; top-level spans have depth 1.
+        """
+        children_by_parent = {}
+        for child in self.children:
+            children_by_parent.setdefault(child.parent, []).append(child)
+
+        stack = []
+
+        def push_children(parent, parent_path, depth):
+            siblings = children_by_parent.get(parent, ())
+            # Pushed in reverse so the first sibling is walked first
+            for position in range(len(siblings), 0, -1):
+                stack.append((siblings[position - 1], f"{parent_path}{position:0{PATH_SEGMENT_WIDTH}d}", depth))
+
+        push_children(self.root, '', 1)
+        while stack:
+            span, path, depth = stack.pop()
+            yield span, path, depth
+            push_children(span, path + '.', depth + 1)
+
+    def to_dict(self, prepare=None):
+        """The trace as the dict emitted by TracerManager.end_trace, with descendants in tree order"""
+        trace_data = self.span_dict(self.root, prepare)
+        trace_data["children"] = children = []
+        for span, path, depth in self.walk():
+            child_data = self.span_dict(span, prepare)
+            child_data.update(parent_id=span.parent_id, path=path, depth=depth)
+            children.append(child_data)
+        return trace_data
+
+    def to_run_tree(self, project_name, prepare=None):
+        """The trace as a LangSmith RunTree with the children attached"""
+        root_data = self.span_dict(self.root, prepare)
+        root = RunTree(
+            name=self.root.name,
+            run_type=self.root.run_type,
+            inputs=root_data["inputs"] or {},
+            outputs=root_data["outputs"],
+            start_time=self.to_datetime(self.root.start_ns),
+            end_time=self.to_datetime(self.root.end_ns),
+            id=self.root.id,
+            extra={"metadata": self.metadata},
+            project_name=project_name,
+        )
+        run_trees = {self.root: root}
+        for child, _, _ in self.walk():
+            data = self.span_dict(child, prepare)
+            run_trees[child] = run_trees[child.parent].create_child(
+                child.name,
+                child.run_type,
+                run_id=child.id,
+                inputs=data["inputs"] or {},
+                outputs=data["outputs"],
+                start_time=self.to_datetime(child.start_ns),
+                end_time=self.to_datetime(child.end_ns),
+            )
+        return root
+
+
+def bind(store):
+    """Make the root of store the current span of this context"""
+    _current.set((store, store.root))
+
+
+def unbind(store):
+    """Clear the current span of this context if it belongs to store"""
+    current = _current.get()
+    if current is not None and current[0] is store:
+        _current.set(None)
+
+
+def current_span():
+    """The span new spans would be nested under, or None outside a trace"""
+    current = _current.get()
+    return current[1] if current else None
+
+
+class SpanBlock:
+    """Context manager behind ``span``; a class rather than a generator to keep spans cheap"""
+    __slots__ = ('name', 'run_type', 'inputs', 'parent', 'store', 'span', 'token')
+
+    def __init__(self, name, run_type, inputs, parent, store):
+        self.name = name
+        self.run_type = run_type
+        self.inputs = inputs
+        self.parent = parent
+        self.store = store
+        self.span = None
+
+    def __enter__(self):
+        parent, store = self.parent, self.store
+        if parent is None:
+            current = _current.get()
+            if current is None:
+                return None
+            store, parent = current
+        self.span = store.open_span(self.name, self.run_type, self.inputs, parent)
+        self.token = _current.set((store, self.span))
+        return self.span
+
+    def __exit__(self, exc_type, exc, traceback):
+        span = self.span
+        if span is None:
+            return False
+        span.end_ns = time.perf_counter_ns()
+        if exc_type is not None and span.outputs is None:
+            span.outputs = {"error": f"{exc_type.__name__}: {exc}"}
+        _current.reset(self.token)
+        return False
+
+
+def span(name, run_type='chain', inputs=None, parent=None, store=None):
+    """
+    Record a block as a span.
+
+    The span is nested under ``parent`` (which needs its ``store``) or else
+    under the current span, and is the current span inside the block, so
+    spans opened there, including by ``traced`` functions, nest under it.
+    Set ``outputs`` on the yielded span to record them; an exception records
+    itself as the output. Outside a trace the block runs untraced and the
+    yielded span is None.
+    """
+    return SpanBlock(name, run_type, inputs, parent, store)
+
+
+def traced(name=None, run_type='chain'):
+    """
+    Decorator recording every call of a function or coroutine function as a span.
+
+    The span is named after the function unless a name is given and nests
+    under the current span. Usable bare (``@traced``) or with arguments
+    (``@traced('rerank', run_type='retriever')``).
+    """
+    if callable(name):
+        return traced()(name)
+
+    def decorate(func):
+        span_name = name or func.__qualname__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with span(span_name, run_type):
+                    return await func(*args, **kwargs)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with span(span_name, run_type):
+                    return func(*args, **kwargs)
+        return wrapper
+
+    return decorate
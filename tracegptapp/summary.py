@@ -0,0 +1,71 @@
+"""
+Analytics dashboard KPIs computed from the rollups and cached for a few seconds
+"""
+from collections import Counter
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .analytics import ChartDataGenerator
+from .models import ChatExample, ChatTrace, ContactMessage
+from .rollups import RollupManager
+
+SUMMARY_CACHE_KEY = 'tracegptapp:dashboard_summary'
+RECENT_TRACE_COUNT = 5
+RECENT_TRACE_FIELDS = ('id', 'run_id', 'status', 'runtime_seconds', 'created_at')
+
+
+def build_dashboard_summary():
+    """
+    Compute every analytics dashboard KPI.
+
+    Trace totals, runtimes, status counts, tag counts and the runtime
+    histogram all come from a single query over the daily rollups; step
+    runtimes come from the daily step rollups. No query scans the trace or
+    step tables.
+    """
+    rollups = RollupManager.buckets('day').order_by().values_list(
+        'trace_count', 'runtime_sum', 'runtime_max', 'status_counts', 'tag_counts', 'runtime_histogram'
+    )
+
+    trace_count = 0
+    runtime_sum = 0.0
+    max_runtime = None
+    status_counts = Counter()
+    tag_counts = []
+    histograms = []
+    for count, bucket_runtime_sum, bucket_max, statuses, tags, histogram in rollups:
+        trace_count += count
+        runtime_sum += bucket_runtime_sum
+        if bucket_max is not None and (max_runtime is None or bucket_max > max_runtime):
+            max_runtime = bucket_max
+        status_counts.update(statuses)
+        tag_counts.append(tags)
+        histograms.append(histogram)
+
+    recent_traces = list(
+        ChatTrace.objects.order_by('-created_at', '-id').values(*RECENT_TRACE_FIELDS)[:RECENT_TRACE_COUNT]
+    )
+
+    return {
+        'trace_count': trace_count,
+        'example_count': ChatExample.objects.count(),
+        'contact_count': ContactMessage.objects.count(),
+        'avg_runtime': round(runtime_sum / trace_count, 2) if trace_count else 0,
+        'max_runtime': round(max_runtime, 2) if max_runtime else 0,
+        'status_counts': dict(status_counts),
+        'runtime_distribution': ChartDataGenerator.runtime_distribution(histograms),
+        'tags_distribution': ChartDataGenerator.tags_distribution(tag_counts),
+        'step_runtime': ChartDataGenerator.step_runtime_by_type(),
+        'recent_traces': recent_traces,
+        'generated_at': timezone.now(),
+    }
+
+
+def get_dashboard_summary():
+    """Return the dashboard summary, recomputed at most every DASHBOARD_SUMMARY_TTL seconds"""
+    summary = cache.get(SUMMARY_CACHE_KEY)
+    if summary is None:
+        summary = build_dashboard_summary()
+        cache.set(SUMMARY_CACHE_KEY, summary, settings.DASHBOARD_SUMMARY_TTL)
+    return summary
@@ -1,3 +1,960 @@
-from django.test import TestCase
+from datetime import timedelta
+from io import StringIO
+import base64
+import gzip
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from pathlib import Path
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from unittest import mock
 
-# Create your tests here.
+import zstandard
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import compression
+from .exporter import SpanExporter
+from .ingestion import TraceIngestQueue, write_records
+from .pagination import KeysetPaginator, decode_cursor, encode_cursor
+from .langsmith_utils import TracerManager
+from .models import ChatExample, ChatTrace, CompressionDictionary, SnapshotStaleDay, StepRollup, TraceRollup, TraceStep
+from .search import search_traces
+from .rollups import RollupManager
+from .similarity import score_pair, score_pairs
+from .snapshots import get_snapshot_store, load_columns
+
+
+@override_settings(LANGSMITH_EXPORT=False)
+class OrderChildrenTests(SimpleTestCase):
+    STAGES = ['preprocess_input', 'generate_response', 'postprocess_response', 'evaluate_response']
+
+    def test_stage_spans_follow_stage_order_and_other_spans_keep_their_place(self):
+        tracer = TracerManager()
+        root = tracer.start_trace('hello')
+        with tracer.span('retrieval', 'retriever', parent=root) as retrieval:
+            with tracer.span('rerank', 'tool', parent=retrieval):
+                pass
+        # Stages finishing out of order, as they do when run concurrently
+        for name in ['preprocess_input', 'generate_response', 'evaluate_response', 'postprocess_response']:
+            tracer.add_step(root, name, 'chain')
+        with tracer.span('log_feedback', 'tool', parent=root):
+            pass
+
+        tracer.order_children(root, self.STAGES)
+
+        trace_data = tracer.end_trace(root, 'done')
+        self.assertEqual(
+            [(child['name'], child['path']) for child in trace_data['children']],
+            [
+                ('retrieval', '000001'),
+                ('rerank', '000001.000001'),
+                ('preprocess_input', '000002'),
+                ('generate_response', '000003'),
+                ('postprocess_response', '000004'),
+                ('evaluate_response', '000005'),
+                ('log_feedback', '000006'),
+            ],
+        )
+
+
+class SimilarityTests(SimpleTestCase):
+
+    def test_identical_texts_score_one_on_every_metric(self):
+        text = 'The capital of France is Paris, a city on the Seine'
+        for metric, score in score_pair(text, text).items():
+            self.assertAlmostEqual(score, 1.0, msg=metric)
+
+    def test_bm25_of_identical_pairs_in_a_batch(self):
+        texts = ['paris is the capital of france', 'water boils at one hundred degrees', 'hello there']
+        scores = score_pairs(texts, texts)['bm25']
+        self.assertTrue(all(abs(score - 1.0) < 1e-9 for score in scores), scores)
+
+    def test_bm25_stays_within_bounds(self):
+        scores = score_pairs(
+            ['paris', 'paris paris paris', 'nothing in common', ''],
+            ['the capital is paris', 'paris', 'the capital is paris', 'paris'],
+        )['bm25']
+        self.assertTrue(((scores >= 0) & (scores <= 1)).all(), scores)
+        self.assertEqual(scores[2], 0)
+        self.assertEqual(scores[3], 0)
+
+    def test_pair_scores_do_not_depend_on_the_batch(self):
+        response, expected = 'the capital of france is paris', 'paris is the capital city of france'
+        alone = score_pair(response, expected)
+        batch = score_pairs(
+            ['water boils at one hundred degrees', response, 'paris paris paris', 'the the the of of'],
+            ['water boils at 100 degrees celsius', expected, 'paris', 'capital of france'],
+        )
+        for metric, score in alone.items():
+            self.assertAlmostEqual(batch[metric][1], score, msg=metric)
+
+
+class RollupMaintenanceTests(TestCase):
+
+    def create_trace(self, run_id, runtime, status='success', created_at=None):
+        created_at = created_at or timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):
+            trace = ChatTrace.objects.create(run_id=run_id, input_prompt='hi', output_response='hello', status=status,
+                                             runtime_seconds=runtime, created_at=created_at)
+            TraceStep.objects.create(trace=trace, step_name='generate', step_type='generation', runtime_seconds=runtime,
+                                     start_time=created_at, end_time=created_at)
+        return trace
+
+    def daily(self, model=TraceRollup):
+        return model.objects.get(granularity='day')
+
+    def test_edits_and_deletes_rebuild_their_buckets(self):
+        now = timezone.now().replace(hour=12)
+        first = self.create_trace('a', 1.5, created_at=now)
+        self.create_trace('b', 4.0, created_at=now)
+        self.assertEqual(self.daily().trace_count, 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.status = 'error'
+            first.runtime_seconds = 8.0
+            first.save()
+        rollup = self.daily()
+        self.assertEqual(rollup.status_counts, {'success': 1, 'error': 1})
+        self.assertEqual(rollup.runtime_max, 8.0)
+        self.assertEqual(rollup.runtime_sum, 12.0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        rollup = self.daily()
+        self.assertEqual(rollup.trace_count, 1)
+        self.assertEqual(rollup.status_counts, {'success': 1})
+        self.assertEqual(rollup.runtime_histogram, [0, 0, 0, 1, 0, 0])
+        # The step deleted with the trace left its rollups as well
+        self.assertEqual(self.daily(StepRollup).step_count, 1)
+        self.assertEqual(self.daily(StepRollup).runtime_sum, 4.0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ChatTrace.objects.all().delete()
+        self.assertFalse(TraceRollup.objects.exists())
+        self.assertFalse(StepRollup.objects.exists())
+
+    def test_moving_a_trace_to_another_day_rebuilds_both_days(self):
+        now = timezone.now().replace(hour=12)
+        trace = self.create_trace('a', 1.0, created_at=now)
+        with self.captureOnCommitCallbacks(execute=True):
+            trace.created_at = now - timedelta(days=1)
+            trace.save()
+        self.assertEqual(list(RollupManager.buckets('day').values_list('trace_count', flat=True)), [1])
+        self.assertEqual(timezone.localtime(self.daily().bucket_start).date(), timezone.localtime(now - timedelta(days=1)).date())
+
+
+def stored(model, pk, field):
+    """The bytes a CompressedJSONField column holds for a row"""
+    return bytes(model.objects.values_list(field, flat=True).get(pk=pk))
+
+
+def trace_payload(index):
+    """A trace_data dict shaped like the chat pipeline's"""
+    prompt = f'Summarize chapter {index} of the novel about the lighthouse keeper'
+    return {
+        'id': str(uuid.UUID(int=index)),
+        'name': 'chatbot_interaction',
+        'run_type': 'chain',
+        'inputs': {'input': prompt},
+        'outputs': {'output': {'text': f'Chapter {index} follows the keeper through a storm.', 'tokens': 9}},
+        'children': [
+            {'name': 'preprocess_input', 'run_type': 'chain', 'inputs': {'raw_input': prompt},
+             'outputs': {'processed_input': {'text': prompt.lower(), 'tokens': len(prompt.split())}}},
+            {'name': 'generate_response', 'run_type': 'llm', 'inputs': {'processed_input': prompt.lower()},
+             'outputs': {'raw_response': f'Chapter {index} follows the keeper through a storm.'}},
+        ],
+    }
+
+
+class CompressedJSONFieldTests(TestCase):
+
+    def setUp(self):
+        compression.reset_active_dictionary()
+        self.addCleanup(compression.reset_active_dictionary)
+
+    def create_trace(self, index, trace_data=None):
+        return ChatTrace.objects.create(run_id=f'run-{index}', input_prompt='hi', output_response='hello',
+                                        trace_data=trace_payload(index) if trace_data is None else trace_data)
+
+    def test_round_trip_without_a_dictionary(self):
+        trace = self.create_trace(1)
+        data = stored(ChatTrace, trace.pk, 'trace_data')
+        self.assertTrue(data.startswith(compression.ZSTD_MAGIC))
+        self.assertEqual(compression.frame_dictionary(data), 0)
+        self.assertLess(len(data), len(compression.dumps(trace_payload(1))))
+        self.assertEqual(ChatTrace.objects.get(pk=trace.pk).trace_data, trace_payload(1))
+
+    def test_round_trip_with_a_trained_dictionary(self):
+        traces = [self.create_trace(i) for i in range(300)]
+        for trace in traces[:50]:
+            TraceStep.objects.create(trace=trace, step_name='generate', step_type='generation',
+                                     start_time=trace.created_at, end_time=trace.created_at,
+                                     input_data=trace_payload(trace.pk)['children'][1]['inputs'], output_data=None)
+
+        call_command('train_compression_dictionary', '--dict-size', '4096', '--recompress', stdout=StringIO())
+
+        dictionary = CompressionDictionary.objects.get()
+        for trace in traces:
+            self.assertEqual(compression.frame_dictionary(stored(ChatTrace, trace.pk, 'trace_data')), dictionary.dict_id)
+        step = TraceStep.objects.order_by('pk').first()
+        self.assertEqual(compression.frame_dictionary(stored(TraceStep, step.pk, 'input_data')), dictionary.dict_id)
+        self.assertIsNone(step.output_data)
+
+        # Readers load the dictionary from the database, and new rows use it
+        compression._dictionaries.clear()
+        compression._local.__dict__.clear()
+        self.assertEqual(ChatTrace.objects.get(pk=traces[7].pk).trace_data, trace_payload(7))
+        new = self.create_trace(1000)
+        self.assertEqual(compression.frame_dictionary(stored(ChatTrace, new.pk, 'trace_data')), dictionary.dict_id)
+        self.assertEqual(ChatTrace.objects.get(pk=new.pk).trace_data, trace_payload(1000))
+
+    def test_payloads_that_do_not_shrink_are_stored_as_json(self):
+        for value in [{}, {'a': 1}, [1, 2]]:
+            trace = self.create_trace(len(str(value)), trace_data=value)
+            data = stored(ChatTrace, trace.pk, 'trace_data')
+            self.assertFalse(data.startswith(compression.ZSTD_MAGIC))
+            self.assertEqual(data, compression.dumps(value))
+            self.assertEqual(ChatTrace.objects.get(pk=trace.pk).trace_data, value)
+
+    def test_payloads_are_decompressed_on_first_access(self):
+        trace = self.create_trace(1)
+
+        loaded = ChatTrace.objects.get(pk=trace.pk)
+        self.assertIsInstance(loaded.__dict__['trace_data'], bytes)
+        self.assertEqual(loaded.trace_data, trace_payload(1))
+        self.assertIsInstance(loaded.__dict__['trace_data'], dict)
+
+        deferred = ChatTrace.objects.defer('trace_data').get(pk=trace.pk)
+        self.assertNotIn('trace_data', deferred.__dict__)
+        self.assertEqual(deferred.trace_data, trace_payload(1))
+
+        # Saving a row whose payload was never read writes the stored bytes back
+        before = stored(ChatTrace, trace.pk, 'trace_data')
+        untouched = ChatTrace.objects.get(pk=trace.pk)
+        untouched.output_response = 'changed'
+        untouched.save()
+        self.assertEqual(stored(ChatTrace, trace.pk, 'trace_data'), before)
+        self.assertIsInstance(untouched.__dict__['trace_data'], bytes)
+
+
+class CompressedPayloadMigrationTests(TransactionTestCase):
+    before = [('tracegptapp', '0009_tracestep_span_tree')]
+    after = [('tracegptapp', '0010_compressed_payloads')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def search_triggers(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'tracegptapp_chattrace_fts_%'")
+            return sorted(name for name, in cursor.fetchall())
+
+    def create_old_rows(self, apps):
+        OldTrace = apps.get_model('tracegptapp', 'ChatTrace')
+        OldStep = apps.get_model('tracegptapp', 'TraceStep')
+        now = timezone.now()
+        large = OldTrace.objects.create(run_id='large', input_prompt='lighthouse storm', output_response='keeper',
+                                        trace_data=trace_payload(1))
+        small = OldTrace.objects.create(run_id='small', input_prompt='hi', output_response='hello', trace_data={})
+        OldStep.objects.create(trace=large, step_name='generate', step_type='generation', start_time=now, end_time=now,
+                               input_data=trace_payload(2), output_data=None)
+        return large.pk, small.pk
+
+    def test_forward_compresses_payloads_and_keeps_search_working(self):
+        large, small = self.create_old_rows(self.migrate(self.before))
+        self.migrate(self.after)
+
+        self.assertTrue(stored(ChatTrace, large, 'trace_data').startswith(compression.ZSTD_MAGIC))
+        self.assertEqual(stored(ChatTrace, small, 'trace_data'), b'{}')
+        self.assertEqual(ChatTrace.objects.get(pk=large).trace_data, trace_payload(1))
+        self.assertEqual(ChatTrace.objects.get(pk=small).trace_data, {})
+        step = TraceStep.objects.get()
+        self.assertEqual(step.input_data, trace_payload(2))
+        self.assertIsNone(step.output_data)
+
+        if connection.vendor == 'sqlite':
+            self.assertEqual(self.search_triggers(), [
+                'tracegptapp_chattrace_fts_delete',
+                'tracegptapp_chattrace_fts_insert',
+                'tracegptapp_chattrace_fts_update',
+            ])
+        new = ChatTrace.objects.create(run_id='new', input_prompt='albatross sighting', output_response='noted')
+        self.assertEqual(list(search_traces(ChatTrace.objects.all(), 'albatross').values_list('pk', flat=True)), [new.pk])
+        self.assertEqual(list(search_traces(ChatTrace.objects.all(), 'lighthouse').values_list('pk', flat=True)), [large])
+
+    def test_backward_restores_json_payloads(self):
+        large, small = self.create_old_rows(self.migrate(self.before))
+        self.migrate(self.after)
+        apps = self.migrate(self.before)
+
+        OldTrace = apps.get_model('tracegptapp', 'ChatTrace')
+        OldStep = apps.get_model('tracegptapp', 'TraceStep')
+        self.assertEqual(OldTrace.objects.get(pk=large).trace_data, trace_payload(1))
+        self.assertEqual(OldTrace.objects.get(pk=small).trace_data, {})
+        step = OldStep.objects.get()
+        self.assertEqual(step.input_data, trace_payload(2))
+        self.assertIsNone(step.output_data)
+        if connection.vendor == 'sqlite':
+            self.assertEqual(len(self.search_triggers()), 3)
+
+
+def trace_record(index, created_at=None):
+    """An ingestion record shaped like TracerManager.end_trace output"""
+    start = (created_at or timezone.now()).isoformat()
+    return {
+        'id': f'run-{index}',
+        'name': 'chatbot_interaction',
+        'run_type': 'chain',
+        'start_time': start,
+        'end_time': start,
+        'inputs': {'input': f'question {index}'},
+        'outputs': {'output': {'text': f'answer {index}'}},
+        'children': [
+            {'name': 'generate_response', 'run_type': 'llm', 'start_time': start, 'end_time': start,
+             'inputs': {'processed_input': f'question {index}'}, 'outputs': {'raw_response': f'answer {index}'}},
+        ],
+    }
+
+
+class TraceIngestQueueTests(TransactionTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        self.spill_path = self.directory / 'spill.ndjson'
+
+    def make_queue(self, **kwargs):
+        options = {'max_size': 2, 'batch_size': 2, 'workers': 1, 'flush_interval': 0.05,
+                   'put_timeout': 0.01, 'spill_path': self.spill_path}
+        return TraceIngestQueue(**{**options, **kwargs})
+
+    def stored_run_ids(self):
+        return sorted(ChatTrace.objects.values_list('run_id', flat=True))
+
+    def spilled_lines(self, path):
+        return [line for line in Path(path).read_text().splitlines() if line]
+
+    def test_overflow_spills_to_this_process_file_and_reloads_from_it(self):
+        ingest_queue = self.make_queue()
+        for i in range(5):
+            ingest_queue.submit(trace_record(i))
+
+        self.assertEqual(ingest_queue.pending(), 2)
+        self.assertEqual(Path(ingest_queue.spill_file()).name, f'spill.{os.getpid()}.ndjson')
+        self.assertEqual(len(self.spilled_lines(ingest_queue.spill_file())), 3)
+        self.assertFalse(self.spill_path.exists())
+
+        ingest_queue._reload_spill()
+
+        self.assertEqual(self.stored_run_ids(), ['run-2', 'run-3', 'run-4'])
+        self.assertEqual(list(self.directory.iterdir()), [])
+        self.assertEqual(ingest_queue.pending(), 2)
+
+    def test_drain_writes_buffered_and_spilled_records_and_stops_the_workers(self):
+        ingest_queue = self.make_queue(max_size=1)
+        for i in range(4):
+            ingest_queue.submit(trace_record(i))
+        ingest_queue.start()
+
+        ingest_queue.drain(timeout=10)
+
+        self.assertEqual(self.stored_run_ids(), ['run-0', 'run-1', 'run-2', 'run-3'])
+        self.assertEqual(ingest_queue.pending(), 0)
+        self.assertEqual(ingest_queue._workers, [])
+        self.assertEqual(list(self.directory.iterdir()), [])
+        self.assertEqual(TraceStep.objects.count(), 4)
+
+    def test_spill_files_of_exited_processes_are_reloaded(self):
+        ingest_queue = self.make_queue()
+        exited = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'],
+                                capture_output=True, text=True, check=True)
+        dead_pid = int(exited.stdout)
+        live_pid = os.getppid()
+        files = {
+            ingest_queue.spill_file(dead_pid): trace_record(1),
+            self.directory / f'spill.{dead_pid}.0123abcd.reloading': trace_record(2),
+            ingest_queue.spill_file(live_pid): trace_record(3),
+        }
+        for path, record in files.items():
+            Path(path).write_text(compression.dumps(record).decode() + '\n')
+
+        ingest_queue._reload_spill()
+
+        self.assertEqual(self.stored_run_ids(), ['run-1', 'run-2'])
+        # A process that is still running keeps its file
+        self.assertEqual([path.name for path in self.directory.iterdir()], [f'spill.{live_pid}.ndjson'])
+
+
+@override_settings(TRACE_INGEST_API_TOKEN='s3cret')
+class BulkIngestTests(TestCase):
+
+    def post(self, body, encoding='gzip', token='s3cret'):
+        headers = {'Content-Encoding': encoding}
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        if encoding in ('gzip', 'x-gzip'):
+            body = gzip.compress(body)
+        elif encoding == 'zstd':
+            body = zstandard.ZstdCompressor().compress(body)
+        return self.client.post(reverse('api_bulk_ingest'), body, content_type='application/x-ndjson', headers=headers)
+
+    def ndjson(self, *records):
+        return b''.join(
+            (record if isinstance(record, bytes) else compression.dumps(record)) + b'\n' for record in records
+        )
+
+    def test_requires_a_configured_token(self):
+        body = self.ndjson(trace_record(1))
+        with override_settings(TRACE_INGEST_API_TOKEN=''):
+            self.assertEqual(self.post(body).status_code, 403)
+            self.assertEqual(self.post(body, token='').status_code, 403)
+        self.assertEqual(self.post(body, token=None).status_code, 401)
+        self.assertEqual(self.post(body, token='wrong').status_code, 401)
+        self.assertFalse(ChatTrace.objects.exists())
+
+    def test_ingests_gzip_and_zstd_bodies(self):
+        for encoding, index in [('gzip', 1), ('zstd', 2), ('identity', 3)]:
+            response = self.post(self.ndjson(trace_record(index)), encoding=encoding)
+            self.assertEqual(response.status_code, 200, encoding)
+            self.assertEqual(response.json()['accepted'], 1, encoding)
+
+        trace = ChatTrace.objects.get(run_id='run-2')
+        self.assertEqual(trace.input_prompt, 'question 2')
+        self.assertEqual(trace.output_response, 'answer 2')
+        self.assertEqual(list(trace.steps.values_list('step_name', flat=True)), ['generate_response'])
+        self.assertEqual(TraceRollup.objects.get(granularity='day').trace_count, 3)
+
+    def test_reports_why_each_rejected_line_was_rejected(self):
+        self.post(self.ndjson(trace_record(1)))
+        missing_id = trace_record(5)
+        del missing_id['id']
+
+        response = self.post(self.ndjson(
+            trace_record(2),
+            b'{"id": "run-3",',
+            b'[1, 2]',
+            missing_id,
+            trace_record(2),
+            trace_record(1),
+        ) + b'\n\n')
+
+        self.assertEqual(response.status_code, 200)
+        summary = response.json()
+        self.assertEqual((summary['accepted'], summary['rejected']), (1, 5))
+        results = summary['results']
+        self.assertEqual([result['line'] for result in results], [1, 2, 3, 4, 5, 6])
+        self.assertEqual([result['status'] for result in results],
+                         ['accepted', 'rejected', 'rejected', 'rejected', 'rejected', 'rejected'])
+        self.assertEqual(results[2]['error'], 'Record must be a JSON object')
+        self.assertEqual(results[3]['error'], "Trace record is missing 'id'")
+        self.assertEqual(results[4]['error'], 'Duplicate run id in request')
+        self.assertEqual(results[5]['error'], 'Duplicate run id')
+        self.assertEqual(self.stored_run_ids(), ['run-1', 'run-2'])
+
+    def test_corrupt_body_is_a_bad_request(self):
+        body = gzip.compress(self.ndjson(trace_record(1), trace_record(2)))
+        response = self.client.post(reverse('api_bulk_ingest'), body[:len(body) // 2] + b'garbage',
+                                    content_type='application/x-ndjson',
+                                    headers={'Content-Encoding': 'gzip', 'Authorization': 'Bearer s3cret'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.json()['success'])
+        self.assertIn('Could not read request body', response.json()['error'])
+
+    def test_rejects_unknown_encodings_and_chunk_sizes(self):
+        self.assertEqual(self.post(b'', encoding='br').status_code, 415)
+        response = self.client.post(reverse('api_bulk_ingest') + '?chunk_size=0', b'',
+                                    content_type='application/x-ndjson', headers={'Authorization': 'Bearer s3cret'})
+        self.assertEqual(response.status_code, 400)
+
+    def stored_run_ids(self):
+        return sorted(ChatTrace.objects.values_list('run_id', flat=True))
+
+
+class KeysetPaginationTests(TestCase):
+
+    def setUp(self):
+        # Three groups of traces sharing a timestamp, so pages split inside a tie
+        now = timezone.now().replace(microsecond=0)
+        self.traces = [
+            ChatTrace.objects.create(run_id=f'run-{i}', input_prompt=f'q{i}', output_response='a',
+                                     created_at=now - timedelta(minutes=i // 3))
+            for i in range(8)
+        ]
+        self.newest_first = sorted(self.traces, key=lambda trace: (trace.created_at, trace.id), reverse=True)
+
+    def walk(self, paginator):
+        """Page forward to the end, then back to the start; returns the pages' ids in both directions"""
+        pages = [paginator.page()]
+        while pages[-1].has_next:
+            pages.append(paginator.page(pages[-1].next_cursor))
+        backwards = [pages[-1]]
+        while backwards[-1].has_previous:
+            backwards.append(paginator.page(backwards[-1].previous_cursor))
+        ids = lambda page: [trace.id for trace in page]
+        return [ids(page) for page in pages], [ids(page) for page in reversed(backwards)]
+
+    def test_pages_split_ties_on_created_at_by_id(self):
+        forward, backward = self.walk(KeysetPaginator(ChatTrace.objects.all(), per_page=2))
+
+        expected = [trace.id for trace in self.newest_first]
+        self.assertEqual(forward, [expected[i:i + 2] for i in range(0, 8, 2)])
+        self.assertEqual(backward, forward)
+
+    def test_first_and_last_pages_have_no_cursor_beyond_them(self):
+        paginator = KeysetPaginator(ChatTrace.objects.all(), per_page=3)
+        first = paginator.page()
+        self.assertFalse(first.has_previous)
+        self.assertTrue(first.has_next)
+        last = paginator.page(paginator.page(first.next_cursor).next_cursor)
+        self.assertEqual(len(last), 2)
+        self.assertFalse(last.has_next)
+        self.assertTrue(last.has_previous)
+
+        self.assertEqual(len(KeysetPaginator(ChatTrace.objects.all(), per_page=8).page()), 8)
+        self.assertFalse(KeysetPaginator(ChatTrace.objects.all(), per_page=8).page().has_next)
+
+    def test_invalid_cursors_raise_value_error(self):
+        created_at = self.traces[0].created_at
+        self.assertEqual(decode_cursor(encode_cursor(created_at, 5, 'prev')), (created_at, 5, 'prev'))
+        encode = lambda payload: base64.urlsafe_b64encode(payload).decode().rstrip('=')
+        for cursor in [
+            'not a cursor',
+            encode(b'[1, 2]'),
+            encode(b'{"c": "2026-01-01T00:00:00", "i": 1}'),
+            encode(b'{"c": "yesterday", "i": 1, "d": "next"}'),
+            encode(b'{"c": "2026-01-01T00:00:00", "i": "x", "d": "next"}'),
+            encode(b'{"c": "2026-01-01T00:00:00", "i": 1, "d": "sideways"}'),
+        ]:
+            with self.assertRaises(ValueError, msg=cursor):
+                KeysetPaginator(ChatTrace.objects.all()).page(cursor)
+
+    def test_trace_api_walks_every_trace_once(self):
+        seen = []
+        cursor = ''
+        while True:
+            response = self.client.get(reverse('api_traces'), {'limit': 3, 'cursor': cursor})
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            seen.extend(result['id'] for result in data['results'])
+            if not data['next_cursor']:
+                break
+            cursor = data['next_cursor']
+        self.assertEqual(seen, [trace.id for trace in self.newest_first])
+
+    def test_invalid_cursor_is_a_bad_request_for_the_api_and_the_first_page_for_logs(self):
+        response = self.client.get(reverse('api_traces'), {'cursor': 'bogus'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'Invalid cursor')
+
+        response = self.client.get(reverse('logs'), {'cursor': 'bogus'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([trace.id for trace in response.context['page_obj']],
+                         [trace.id for trace in self.newest_first])
+
+
+class ChartImageTests(TestCase):
+
+    def test_chart_not_rendered_in_time_is_a_retryable_503(self):
+        with mock.patch('tracegptapp.views.render_chart', return_value=None) as render_chart:
+            response = self.client.get(reverse('chart_image', args=['tags_pie', 'png']))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '5')
+        render_chart.assert_called_once_with(
+            'tracegptapp.analytics:ChartDataGenerator.generate_matplotlib_chart', ('tags_pie',), 'png')
+
+    def test_unknown_chart_is_not_found(self):
+        self.assertEqual(self.client.get(reverse('chart_image', args=['nope', 'png'])).status_code, 404)
+
+
+class SnapshotTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(TRACE_SNAPSHOT_DIR=Path(directory.name), TRACE_SNAPSHOT_READS=True)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        today = timezone.localtime().replace(hour=12, minute=0, second=0, microsecond=0)
+        self.traces = []
+        for i, created_at in enumerate([today, today, today - timedelta(days=1), today - timedelta(days=1)]):
+            trace = ChatTrace.objects.create(run_id=f'run-{i}', input_prompt='q', output_response='a',
+                                             runtime_seconds=float(i + 1), created_at=created_at)
+            TraceStep.objects.create(trace=trace, step_name='generate', step_type='generation',
+                                     start_time=created_at, end_time=created_at + timedelta(seconds=1))
+            self.traces.append(trace)
+        self.store = get_snapshot_store()
+        self.export()
+
+    def export(self):
+        for table_name in ('traces', 'steps'):
+            self.store.export(table_name)
+
+    def runtimes(self, **kwargs):
+        """Trace id -> runtime as read through the snapshot"""
+        if kwargs:
+            table = self.store.read('traces', ['id', 'runtime_seconds'], **kwargs).to_pandas()
+        else:
+            table = load_columns('traces', ['id', 'runtime_seconds'])
+        return dict(zip(table['id'], table['runtime_seconds']))
+
+    def step_trace_ids(self):
+        return sorted(load_columns('steps', ['trace_id'])['trace_id'])
+
+    def test_deleted_and_edited_traces_drop_out_of_snapshot_reads(self):
+        deleted, edited = self.traces[0].id, self.traces[2]
+        self.traces[0].delete()
+        edited.runtime_seconds = 30.0
+        edited.save()
+
+        expected = {self.traces[1].id: 2.0, edited.id: 30.0, self.traces[3].id: 4.0}
+        self.assertEqual(self.runtimes(), expected)
+        self.assertNotIn(deleted, self.step_trace_ids())
+        # Until the next export the parts still hold the old rows
+        self.assertIn(deleted, self.runtimes(include_tail=False))
+
+        self.export()
+
+        self.assertFalse(SnapshotStaleDay.objects.exists())
+        self.assertEqual(self.runtimes(include_tail=False), expected)
+        self.assertEqual(self.runtimes(), expected)
+        self.assertEqual(self.step_trace_ids(), sorted(trace.id for trace in self.traces[1:]))
+
+    def test_moving_a_trace_to_another_day_rewrites_both_days(self):
+        moved = self.traces[0]
+        moved.created_at -= timedelta(days=1)
+        moved.save()
+        self.assertEqual(sorted(SnapshotStaleDay.objects.values_list('day', flat=True)),
+                         sorted({timezone.localdate(moved.created_at), timezone.localdate(self.traces[1].created_at)}))
+
+        self.export()
+
+        yesterday = timezone.localtime(self.traces[2].created_at)
+        start, end = yesterday.replace(hour=0), yesterday.replace(hour=23)
+        self.assertEqual(sorted(self.runtimes(start=start, end=end, include_tail=False)),
+                         sorted([moved.id, self.traces[2].id, self.traces[3].id]))
+        self.assertEqual(len(self.runtimes(include_tail=False)), 4)
+
+    def test_marks_made_during_an_export_are_kept(self):
+        self.traces[0].delete()
+        stale = self.store.stale_days('traces')
+        # A later edit of the same day, as if made while the export was running
+        SnapshotStaleDay.objects.filter(table_name='traces').update(marked_at=timezone.now() + timedelta(seconds=1))
+        with mock.patch.object(self.store, 'stale_days', return_value=stale):
+            self.store.export('traces')
+        self.assertEqual(SnapshotStaleDay.objects.filter(table_name='traces').count(), 1)
+
+
+class AnalyticsWindowTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        now = timezone.now()
+        for i, (age, runtime, tag) in enumerate([(10, 4.0, 'slow'), (10, 4.5, 'slow'), (0, 0.5, 'correct')]):
+            created_at = now - timedelta(days=age)
+            trace = ChatTrace.objects.create(run_id=f'run-{i}', input_prompt='q', output_response='a',
+                                             runtime_seconds=runtime, tags=[tag], created_at=created_at)
+            TraceStep.objects.create(trace=trace, step_name='generate', step_type='generation', runtime_seconds=runtime,
+                                     start_time=created_at, end_time=created_at + timedelta(seconds=runtime))
+        self.recent = {'start': (timezone.localdate() - timedelta(days=2)).isoformat()}
+
+    def get(self, name, **params):
+        return self.client.get(reverse(f'admin:{name}'), params)
+
+    def test_distributions_cover_the_requested_window(self):
+        everything = self.get('chattrace_runtime_distribution').json()
+        self.assertEqual(dict(zip(everything['labels'], everything['data']))['3-5s'], 2)
+        recent = self.get('chattrace_runtime_distribution', **self.recent).json()
+        self.assertEqual(recent['data'], [1, 0, 0, 0, 0, 0])
+
+        self.assertEqual(self.get('chattrace_tags_distribution').json()['labels'], ['slow', 'correct'])
+        self.assertEqual(self.get('chattrace_tags_distribution', **self.recent).json()['labels'], ['correct'])
+
+        self.assertEqual(self.get('chattrace_step_runtime').json()['data'], [3.0])
+        self.assertEqual(self.get('chattrace_step_runtime', **self.recent).json()['data'], [0.5])
+
+    def test_traces_by_date_accepts_a_window_and_bucket(self):
+        # A date-only end is the start of that day
+        end = (timezone.localdate() + timedelta(days=1)).isoformat()
+        start = (timezone.localdate() - timedelta(days=13)).isoformat()
+        data = self.get('chattrace_traces_by_date', start=start, end=end, bucket='week').json()
+        self.assertEqual(data['bucket'], 'week')
+        self.assertEqual(sum(data['counts']), 3)
+        self.assertEqual(sum(self.get('chattrace_traces_by_date', days=5).json()['counts']), 1)
+
+    def test_performance_report_covers_the_requested_window(self):
+        response = self.get('chattrace_performance_report', **self.recent)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['metrics']['total_traces'], 1)
+        self.assertEqual(self.get('chattrace_performance_report').context['metrics']['total_traces'], 3)
+
+    def test_invalid_windows_are_rejected(self):
+        for name in ['chattrace_traces_by_date', 'chattrace_runtime_distribution', 'chattrace_tags_distribution',
+                     'chattrace_step_runtime', 'chattrace_performance_report']:
+            self.assertEqual(self.get(name, start='yesterday').status_code, 400, name)
+            self.assertEqual(self.get(name, start='2026-02-01', end='2026-01-01').status_code, 400, name)
+        self.assertEqual(self.get('chattrace_traces_by_date', bucket='year').status_code, 400)
+
+
+@override_settings(TRACE_INGEST_API_TOKEN='s3cret', EXAMPLE_RUN_CONCURRENCY=4)
+class ExampleRunApiTests(TestCase):
+
+    def setUp(self):
+        for i, tags in enumerate([['correct'], ['slow'], ['correct', 'slow']]):
+            ChatExample.objects.create(title=f'Example {i}', input_prompt=f'question {i}',
+                                       expected_response=f'answer {i}', tags=tags)
+
+    def start(self, token='s3cret', **params):
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        return self.client.post(reverse('api_run_examples'), compression.dumps(params),
+                                content_type='application/json', headers=headers)
+
+    def status(self, run_label):
+        return self.client.get(reverse('api_example_run', args=[run_label]), headers={'Authorization': 'Bearer s3cret'})
+
+    def wait_for(self, run_label):
+        for _ in range(200):
+            status = self.status(run_label).json()
+            if status['status'] != 'running':
+                return status
+            time.sleep(0.01)
+        self.fail(f'Run {run_label} did not finish')
+
+    def test_requires_a_configured_token(self):
+        with mock.patch('tracegptapp.evaluation.ExampleRunner.run') as run:
+            with override_settings(TRACE_INGEST_API_TOKEN=''):
+                self.assertEqual(self.start().status_code, 403)
+            self.assertEqual(self.start(token=None).status_code, 401)
+            self.assertEqual(self.start(token='wrong').status_code, 401)
+            self.assertEqual(self.client.get(reverse('api_example_run', args=['x'])).status_code, 401)
+        run.assert_not_called()
+
+    def test_run_starts_in_the_background_and_reports_when_finished(self):
+        release = threading.Event()
+        runners = []
+
+        def run(runner, examples):
+            runners.append((runner, examples))
+            release.wait(5)
+            return {'run_label': runner.run_label, 'examples': len(examples)}
+
+        with mock.patch('tracegptapp.evaluation.ExampleRunner.run', autospec=True, side_effect=run):
+            response = self.start(tags=['slow'], concurrency=100)
+            self.assertEqual(response.status_code, 202)
+            run_label = response.json()['run_label']
+            self.assertEqual(response.json()['status_url'], reverse('api_example_run', args=[run_label]))
+            self.assertEqual(self.status(run_label).json()['status'], 'running')
+
+            # One background run per process at a time
+            self.assertEqual(self.start().status_code, 409)
+
+            release.set()
+            status = self.wait_for(run_label)
+
+        self.assertEqual(status['status'], 'finished')
+        self.assertEqual(status['report'], {'run_label': run_label, 'examples': 2})
+        runner, examples = runners[0]
+        self.assertEqual([example['title'] for example in examples], ['Example 1', 'Example 2'])
+        self.assertEqual(runner.concurrency, 4)
+
+    def test_failed_runs_report_their_error(self):
+        with mock.patch('tracegptapp.evaluation.ExampleRunner.run', side_effect=RuntimeError('model unavailable')):
+            status = self.wait_for(self.start().json()['run_label'])
+        self.assertEqual((status['status'], status['error']), ('failed', 'model unavailable'))
+
+    def test_bad_requests(self):
+        self.assertEqual(self.start(limit=0).status_code, 400)
+        self.assertEqual(self.start(tags='slow').status_code, 400)
+        self.assertEqual(self.start(tags=['unknown']).status_code, 404)
+        self.assertEqual(self.status('missing').status_code, 404)
+
+
+class RescoreEvaluationsTests(TestCase):
+
+    def evaluation_record(self, index, response, expected, child_id=None):
+        record = trace_record(index)
+        evaluation = {'name': 'evaluate_response', 'run_type': 'evaluation', 'start_time': record['start_time'],
+                      'end_time': record['end_time'], 'inputs': {'response': response, 'expected': expected},
+                      'outputs': {'evaluation': {'length': len(response), 'similarity_to_expected': 0.0}}}
+        if child_id:
+            evaluation.update(id=child_id, path='000002', depth=1)
+        record['children'].append(evaluation)
+        return record
+
+    def test_rescoring_updates_the_steps_and_their_trace_data(self):
+        write_records([
+            # Steps are matched to their trace_data child by run id, or by position when the child has none
+            self.evaluation_record(1, 'paris is the capital of france', 'the capital of france is paris', 'eval-1'),
+            self.evaluation_record(2, 'water boils at one hundred degrees', 'water boils at 100 degrees'),
+        ])
+
+        call_command('rescore_evaluations', '--chunk-size', '1', stdout=StringIO())
+
+        for step in TraceStep.objects.filter(step_type='evaluation').select_related('trace'):
+            evaluation = step.output_data['evaluation']
+            self.assertEqual(evaluation['similarity'], score_pair(step.input_data['response'], step.input_data['expected']))
+            self.assertEqual(evaluation['similarity_to_expected'], evaluation['similarity']['overlap'])
+            self.assertEqual(evaluation['length'], len(step.input_data['response']))
+            children = step.trace.trace_data['children']
+            self.assertEqual(children[1]['outputs'], step.output_data)
+            # Other children are left as they were
+            self.assertEqual(children[0]['outputs'], {'raw_response': step.trace.output_response})
+
+    def test_dry_run_changes_nothing(self):
+        write_records([self.evaluation_record(1, 'paris', 'paris', 'eval-1')])
+        call_command('rescore_evaluations', '--dry-run', stdout=StringIO())
+        trace = ChatTrace.objects.get()
+        self.assertEqual(trace.steps.get(step_type='evaluation').output_data['evaluation']['similarity_to_expected'], 0.0)
+        self.assertEqual(trace.trace_data['children'][1]['outputs']['evaluation']['similarity_to_expected'], 0.0)
+
+
+class BatchEndpointStub:
+    """A local /runs/batch endpoint answering with scripted status codes, then 200"""
+
+    def __init__(self, statuses=()):
+        self.statuses = list(statuses)
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                stub.requests.append((self.path, dict(self.headers), json.loads(body)))
+                status = stub.statuses.pop(0) if stub.statuses else 200
+                self.send_response(status)
+                if status == 429:
+                    self.send_header('Retry-After', '0')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.endpoint = f'http://127.0.0.1:{self.server.server_port}'
+        threading.Thread(target=self.server.serve_forever, args=(0.01,), daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def batches(self):
+        return [[span['id'] for span in body['post']] for _, _, body in self.requests]
+
+
+class SpanExporterTests(SimpleTestCase):
+
+    def exporter(self, statuses=(), **kwargs):
+        stub = BatchEndpointStub(statuses)
+        self.addCleanup(stub.close)
+        options = dict(api_key='key', batch_size=3, flush_interval=0.05, max_retries=3, backoff=0.001, timeout=2)
+        options.update(kwargs)
+        exporter = SpanExporter(stub.endpoint + '/', **options)
+        self.addCleanup(exporter.shutdown)
+        return exporter, stub
+
+    def spans(self, ids):
+        return [{'id': str(i), 'name': 'step'} for i in ids]
+
+    def test_spans_are_sent_in_batches(self):
+        exporter, stub = self.exporter()
+        exporter.start()
+        exporter.submit(self.spans(range(7)))
+        self.assertTrue(exporter.flush(timeout=5))
+
+        self.assertEqual(stub.batches(), [['0', '1', '2'], ['3', '4', '5'], ['6']])
+        path, headers, _ = stub.requests[0]
+        self.assertEqual(path, '/runs/batch')
+        self.assertEqual(headers['x-api-key'], 'key')
+        self.assertEqual((exporter.exported, exporter.failed, exporter.pending()), (7, 0, 0))
+
+    def test_partial_batches_go_out_after_the_flush_interval(self):
+        exporter, stub = self.exporter()
+        exporter.start()
+        exporter.submit(self.spans(range(2)))
+        for _ in range(200):
+            if exporter.exported:
+                break
+            time.sleep(0.01)
+        self.assertEqual(stub.batches(), [['0', '1']])
+
+    def test_retryable_responses_are_retried_with_backoff(self):
+        exporter, stub = self.exporter(statuses=[503, 429, 500])
+        exporter.start()
+        with mock.patch.object(exporter, '_retry_delay', wraps=exporter._retry_delay) as retry_delay, \
+                self.assertLogs('tracegptapp.exporter', 'WARNING'):
+            exporter.submit(self.spans(range(3)))
+            self.assertTrue(exporter.flush(timeout=5))
+
+        # Three failures, then the same batch is accepted
+        self.assertEqual(stub.batches(), [['0', '1', '2']] * 4)
+        self.assertEqual([call.args[0] for call in retry_delay.call_args_list], [0, 1, 2])
+        self.assertEqual((exporter.exported, exporter.failed), (3, 0))
+
+    def test_rejected_batches_are_not_retried(self):
+        exporter, stub = self.exporter(statuses=[400])
+        exporter.start()
+        with self.assertLogs('tracegptapp.exporter', 'ERROR'):
+            exporter.submit(self.spans(range(4)))
+            self.assertTrue(exporter.flush(timeout=5))
+
+        # The rejected batch is dropped and the next one still goes out
+        self.assertEqual(stub.batches(), [['0', '1', '2'], ['3']])
+        self.assertEqual((exporter.exported, exporter.failed), (1, 3))
+
+    def test_gives_up_after_max_retries(self):
+        exporter, stub = self.exporter(statuses=[503] * 3, max_retries=2)
+        exporter.start()
+        with self.assertLogs('tracegptapp.exporter', 'ERROR'):
+            exporter.submit(self.spans(range(3)))
+            self.assertTrue(exporter.flush(timeout=5))
+        self.assertEqual(len(stub.requests), 3)
+        self.assertEqual((exporter.exported, exporter.failed), (0, 3))
+
+    def test_connection_errors_are_retried_then_given_up(self):
+        exporter, stub = self.exporter(max_retries=1)
+        stub.close()
+        exporter.start()
+        with self.assertLogs('tracegptapp.exporter', 'WARNING') as logs:
+            exporter.submit(self.spans(range(3)))
+            self.assertTrue(exporter.flush(timeout=5))
+        self.assertEqual((exporter.exported, exporter.failed), (0, 3))
+        self.assertEqual(len([line for line in logs.output if 'retrying' in line]), 1)
+
+    def test_full_buffer_drops_the_oldest_spans(self):
+        exporter, stub = self.exporter(max_size=3)
+        exporter.submit(self.spans(range(5)))
+        self.assertEqual(exporter.dropped, 2)
+        exporter.start()
+        self.assertTrue(exporter.flush(timeout=5))
+        self.assertEqual(stub.batches(), [['2', '3', '4']])
+
+    def test_retry_delay_is_jittered_and_honours_retry_after(self):
+        exporter = SpanExporter('http://127.0.0.1:1', backoff=0.5, max_backoff=4)
+        with mock.patch('tracegptapp.exporter.random.uniform', side_effect=lambda low, high: high):
+            self.assertEqual([exporter._retry_delay(attempt) for attempt in range(5)], [0.5, 1, 2, 4, 4])
+            response = mock.Mock(headers={'Retry-After': '3'})
+            self.assertEqual(exporter._retry_delay(0, response), 3)
+            response.headers['Retry-After'] = '60'
+            self.assertEqual(exporter._retry_delay(0, response), 4)
+            response.headers['Retry-After'] = 'soon'
+            self.assertEqual(exporter._retry_delay(1, response), 1)
@@ -1,4 +1,4 @@
-from django.urls import path
+from django.urls import path, re_path
 from . import views
 
 urlpatterns = [
@@ -6,10 +6,18 @@ urlpatterns = [
     path('process_chat/', views.process_chat, name='process_chat'),
     path('logs/', views.logs, name='logs'),
     path('trace/<int:trace_id>/', views.trace_detail, name='trace_detail'),
+    path('trace/run/<str:run_id>/', views.trace_by_run, name='trace_by_run'),
     path('trace/<int:trace_id>/export/', views.export_trace, name='export_trace'),
     path('contact/', views.contact, name='contact'),
     path('analytics/', views.analytics_dashboard, name='analytics'),
     path('visualizations/', views.model_visualizations, name='model_visualizations'),
+    re_path(r'^charts/(?P<name>[\w-]+)\.(?P<fmt>png|svg|webp)$', views.chart_image, name='chart_image'),
+    path('api/traces/', views.api_traces, name='api_traces'),
+    path('api/traces/bulk/', views.api_bulk_ingest, name='api_bulk_ingest'),
+    path('api/examples/run/', views.api_run_examples, name='api_run_examples'),
+    path('api/examples/run/<str:run_label>/', views.api_example_run, name='api_example_run'),
+    path('api/analytics/summary/', views.api_dashboard_summary, name='api_dashboard_summary'),
     path('api/analytics/traces_summary/', views.api_traces_summary, name='api_traces_summary'),
     path('api/analytics/trace_stats/', views.api_trace_stats, name='api_trace_stats'),
+    path('api/analytics/trace_runtimes/', views.api_trace_runtimes, name='api_trace_runtimes'),
 ] 
\ No newline at end of file
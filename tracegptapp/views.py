@@ -1,15 +1,19 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse, HttpResponse
-from django.core.paginator import Paginator
+from django.http import Http404, HttpResponse
 from django.utils import timezone
 from django.contrib import messages
 import time
-import json
 from django.conf import settings
 from django.urls import reverse
+from django.utils.http import urlencode
+from django.utils.dateparse import parse_datetime
+from django.views.decorators.csrf import csrf_exempt
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition, require_POST, require_safe
 from django.db.models import Count, Avg, Sum, Min, Max, F
 from django.db.models.functions import TruncDay, TruncHour
 
+import hmac
 import uuid
 import datetime
 import pandas as pd
@@ -20,9 +24,19 @@ import base64
 from datetime import timedelta
 
 from .models import ChatExample, ChatTrace, TraceStep, ContactMessage
-from .langsmith_utils import TracerManager
-from .analytics import ChartDataGenerator
-from .visualizations import DashboardVisualizations
+from .langsmith_utils import AsyncTracerManager
+from .analytics import ChartDataGenerator, parse_window
+from .downsampling import METHODS
+from .evaluation import get_run_status, select_examples, start_background_run
+from .ingestion import aingest, build_record, ingest_ndjson, open_ndjson_stream
+from .rollups import RollupManager
+from .summary import get_dashboard_summary
+from .pagination import KeysetPaginator, approximate_count
+from .search import highlight, search_traces
+from .serialization import JsonResponse, dumps, loads
+from .chart_cache import CHART_FORMATS, use_format
+from .renderer import render_chart, resolve_chart
+from .visualizations import CHART_IMAGES
 
 def home(request):
     """Home page with chat interface"""
@@ -40,7 +54,7 @@ def home(request):
     
     return render(request, 'home.html', context)
 
-def process_chat(request):
+async def process_chat(request):
     """Process a chat input and return a traced response"""
     if request.method == 'POST':
         input_prompt = request.POST.get('input_prompt')
@@ -50,34 +64,26 @@ def process_chat(request):
         start_time = time.time()
         
         # Initialize LangSmith tracer
-        tracer = TracerManager()
+        tracer = AsyncTracerManager()
         
         # Get example if provided
         example = None
         if example_id:
-            try:
-                example = ChatExample.objects.get(id=example_id)
-            except ChatExample.DoesNotExist:
-                pass
+            example = await ChatExample.objects.filter(id=example_id).afirst()
         
         # Start trace
-        metadata = {"source": "web_interface", "user_id": request.user.id if request.user.is_authenticated else "anonymous"}
+        user = await request.auser()
+        metadata = {"source": "web_interface", "user_id": user.id if user.is_authenticated else "anonymous"}
         run_tree = tracer.start_trace(input_prompt, metadata)
         
-        # Process input
-        processed_input = tracer.process_input(run_tree, input_prompt)
-        
-        # Generate response
-        response = tracer.generate_response(run_tree, processed_input)
-        
-        # Postprocess response
-        final_response = tracer.postprocess_response(run_tree, response)
-        
-        # Evaluate response if we have an example
-        if example:
-            evaluation = tracer.evaluate_response(run_tree, response, example.expected_response)
-        else:
-            evaluation = tracer.evaluate_response(run_tree, response)
+        # Run the pipeline; postprocessing and evaluation run concurrently after generation
+        results = await tracer.arun_pipeline(
+            run_tree,
+            input_prompt,
+            expected=example.expected_response if example else None,
+        )
+        response = results["generate_response"]
+        final_response = results["postprocess_response"]
         
         # End trace
         trace_data = tracer.end_trace(run_tree, final_response)
@@ -86,46 +92,32 @@ def process_chat(request):
         end_time = time.time()
         runtime_seconds = end_time - start_time
         
-        # Save trace to database
-        chat_trace = ChatTrace.objects.create(
-            run_id=run_tree.id,
+        # Hand the trace to the ingestion pipeline (written in the background when enabled)
+        record = build_record(
+            trace_data,
             input_prompt=input_prompt,
             output_response=response,
             status='success',
             runtime_seconds=runtime_seconds,
-            trace_data=trace_data,
+            # Add tags if using an example
+            tags=list(example.tags) if example else [],
         )
+        chat_trace = await aingest(record)
         
-        # Add tags if using an example
-        if example:
-            chat_trace.tags = example.tags
-            chat_trace.save()
-        
-        # Create step records
-        for child_run in tracer.get_children(run_tree.id):
-            TraceStep.objects.create(
-                trace=chat_trace,
-                step_name=child_run.name,
-                step_type=child_run.run_type,
-                input_data=child_run.inputs,
-                output_data=child_run.outputs,
-                start_time=child_run.start_time,
-                end_time=child_run.end_time,
-                runtime_seconds=(child_run.end_time - child_run.start_time).total_seconds()
-            )
-            
         # Prepare response data
         response_data = {
             'success': True,
             'response': response,
-            'trace_id': chat_trace.id,
+            'trace_id': chat_trace.id if chat_trace else None,
+            'run_id': trace_data['id'],
+            'trace_url': reverse('trace_by_run', args=[trace_data['id']]),
             'runtime': runtime_seconds,
             'steps': [
                 {
-                    'name': step.step_name,
-                    'type': step.step_type,
-                    'runtime': step.runtime_seconds
-                } for step in chat_trace.steps.all()
+                    'name': child['name'],
+                    'type': child['run_type'],
+                    'runtime': (parse_datetime(child['end_time']) - parse_datetime(child['start_time'])).total_seconds()
+                } for child in trace_data['children']
             ]
         }
         
@@ -133,8 +125,8 @@ def process_chat(request):
         
     return JsonResponse({'success': False, 'error': 'Invalid request method'})
 
-def logs(request):
-    """Display logs of traced chats"""
+def _trace_listing(request):
+    """Traces filtered by the tag and query parameters shared by the logs page and API"""
     filter_tag = request.GET.get('tag')
     search_query = request.GET.get('query')
     
@@ -142,39 +134,98 @@ def logs(request):
     
     # Filter by tag if provided
     if filter_tag:
-        traces = traces.filter(tags__contains=filter_tag)
+        traces = traces.with_tag(filter_tag)
     
-    # Search if query provided
+    # Search if query provided; listings stay newest first so they can be keyset paginated
     if search_query:
-        traces = traces.filter(input_prompt__icontains=search_query) | traces.filter(output_response__icontains=search_query)
+        traces = search_traces(traces, search_query, order_by_rank=False)
+    
+    return traces, filter_tag, search_query
+
+def logs(request):
+    """Display logs of traced chats"""
+    traces, filter_tag, search_query = _trace_listing(request)
     
-    # Paginate
-    paginator = Paginator(traces, 10)
-    page_number = request.GET.get('page', 1)
-    page_obj = paginator.get_page(page_number)
+    # Keyset paginate on (created_at, id); a bad cursor falls back to the first page
+    paginator = KeysetPaginator(traces, 10)
+    try:
+        page_obj = paginator.page(request.GET.get('cursor'))
+    except ValueError:
+        page_obj = paginator.page()
+    
+    if search_query:
+        for trace in page_obj:
+            trace.search_highlight = highlight(getattr(trace, 'search_snippet', ''))
+    
+    filter_params = {key: value for key, value in (('tag', filter_tag), ('query', search_query)) if value}
     
     context = {
         'page_obj': page_obj,
         'filter_tag': filter_tag,
         'search_query': search_query,
-        'available_tags': set([tag for trace in ChatTrace.objects.all() for tag in trace.tags])
+        'filter_params': urlencode(filter_params),
+        'total': approximate_count(traces),
+        'available_tags': ChatTrace.objects.available_tags()
     }
     
     return render(request, 'logs.html', context)
 
+def api_traces(request):
+    """API endpoint listing traces newest first with cursor pagination"""
+    try:
+        limit = min(int(request.GET.get('limit', 50)), 200)
+        if limit < 1:
+            raise ValueError
+    except ValueError:
+        return JsonResponse({'error': 'limit must be a positive integer'}, status=400)
+    
+    traces, _, _ = _trace_listing(request)
+    try:
+        page = KeysetPaginator(traces, limit).page(request.GET.get('cursor'))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    data = {
+        'results': [
+            {
+                'id': trace.id,
+                'run_id': trace.run_id,
+                'created_at': trace.created_at.isoformat(),
+                'status': trace.status,
+                'runtime_seconds': trace.runtime_seconds,
+                'tags': list(trace.tags),
+                'input_prompt': trace.input_prompt,
+                'url': reverse('trace_detail', args=[trace.id]),
+            }
+            for trace in page
+        ],
+        'next_cursor': page.next_cursor,
+        'previous_cursor': page.previous_cursor,
+    }
+    # The total is opt-in since even an approximate count is extra work
+    if request.GET.get('count') in ('1', 'true'):
+        data['count'] = approximate_count(traces)
+    
+    return JsonResponse(data)
+
 def trace_detail(request, trace_id):
     """Display detail of a specific trace"""
     trace = get_object_or_404(ChatTrace, id=trace_id)
-    steps = trace.steps.all()
+    steps = trace.step_tree()
     
     context = {
         'trace': trace,
         'steps': steps,
-        'trace_data_json': json.dumps(trace.trace_data, indent=2)
+        'trace_data_json': dumps(trace.trace_data, indent=True).decode()
     }
     
     return render(request, 'trace_detail.html', context)
 
+def trace_by_run(request, run_id):
+    """Redirect to a trace by its run id, used while the trace id is not yet known"""
+    trace = get_object_or_404(ChatTrace, run_id=run_id)
+    return redirect('trace_detail', trace_id=trace.id)
+
 def export_trace(request, trace_id):
     """Export trace data as JSON"""
     trace = get_object_or_404(ChatTrace, id=trace_id)
@@ -217,70 +268,196 @@ def contact(request):
 
 def analytics_dashboard(request):
     """View for displaying the analytics dashboard"""
-    # Get high-level metrics
-    trace_count = ChatTrace.objects.count()
-    example_count = ChatExample.objects.count()
-    contact_count = ContactMessage.objects.count()
+    # The KPI cards and the charts (fetched from api_dashboard_summary) share one cached summary
+    summary = get_dashboard_summary()
+    
+    context = {
+        'trace_count': summary['trace_count'],
+        'example_count': summary['example_count'],
+        'contact_count': summary['contact_count'],
+        'avg_runtime': summary['avg_runtime'],
+        'max_runtime': summary['max_runtime'],
+        'recent_traces': summary['recent_traces'],
+        'tags_data': summary['tags_distribution'],
+        'status_counts': summary['status_counts'],
+    }
+    
+    return render(request, 'analytics.html', context)
+
+def api_dashboard_summary(request):
+    """API endpoint for every analytics dashboard KPI in one response"""
+    response = JsonResponse(get_dashboard_summary())
+    patch_cache_control(response, max_age=settings.DASHBOARD_SUMMARY_TTL)
+    return response
+
+def _check_api_token(request):
+    """
+    Return an error response unless the request sends TRACE_INGEST_API_TOKEN as a bearer token.
     
-    if trace_count > 0:
-        avg_runtime = ChatTrace.objects.aggregate(avg=Avg('runtime_seconds'))['avg']
-        max_runtime = ChatTrace.objects.aggregate(max=Max('runtime_seconds'))['max']
-    else:
-        avg_runtime = 0
-        max_runtime = 0
+    The token endpoints are CSRF exempt, so they stay closed while no token is configured.
+    """
+    token = settings.TRACE_INGEST_API_TOKEN
+    if not token:
+        return JsonResponse({'success': False, 'error': 'This endpoint is disabled until TRACE_INGEST_API_TOKEN is set'}, status=403)
+    supplied = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(supplied.encode(), f'Bearer {token}'.encode()):
+        return JsonResponse({'success': False, 'error': 'Invalid or missing API token'}, status=401)
+    return None
+
+@csrf_exempt
+@require_POST
+def api_bulk_ingest(request):
+    """API endpoint accepting gzip/zstd compressed NDJSON batches of traces"""
+    error = _check_api_token(request)
+    if error:
+        return error
     
-    # Get recent traces
-    recent_traces = ChatTrace.objects.order_by('-created_at')[:5]
+    try:
+        chunk_size = int(request.GET.get('chunk_size', settings.TRACE_BULK_CHUNK_SIZE))
+        if chunk_size < 1:
+            raise ValueError
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'chunk_size must be a positive integer'}, status=400)
     
-    # Generate tags histogram
-    tags_data = ChartDataGenerator.tags_distribution()
+    try:
+        stream = open_ndjson_stream(request, request.headers.get('Content-Encoding'))
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=415)
     
-    # Get traces by status
-    status_data = ChatTrace.objects.values('status').annotate(count=Count('id'))
-    status_counts = {item['status']: item['count'] for item in status_data}
+    # Records are parsed line by line as the body is read, never buffering the whole body
+    summary = ingest_ndjson(stream, chunk_size=chunk_size)
+    summary['success'] = 'error' not in summary
     
-    context = {
-        'trace_count': trace_count,
-        'example_count': example_count,
-        'contact_count': contact_count,
-        'avg_runtime': round(avg_runtime, 2) if avg_runtime else 0,
-        'max_runtime': round(max_runtime, 2) if max_runtime else 0,
-        'recent_traces': recent_traces,
-        'tags_data': tags_data,
-        'status_counts': status_counts,
-    }
+    return JsonResponse(summary, status=200 if summary['success'] else 400)
+
+@csrf_exempt
+@require_POST
+def api_run_examples(request):
+    """API endpoint starting a background run of the ChatExample suite, or a tag-filtered subset"""
+    error = _check_api_token(request)
+    if error:
+        return error
     
-    return render(request, 'analytics.html', context)
+    try:
+        params = loads(request.body or b'{}')
+        if not isinstance(params, dict):
+            raise ValueError('Request body must be a JSON object')
+        tags = params.get('tags') or []
+        if not isinstance(tags, list):
+            raise ValueError('tags must be a list')
+        limit = params.get('limit')
+        concurrency = params.get('concurrency')
+        for name, value in (('limit', limit), ('concurrency', concurrency)):
+            if value is not None and (not isinstance(value, int) or value < 1):
+                raise ValueError(f'{name} must be a positive integer')
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    
+    examples = select_examples(tags, limit)
+    if not examples:
+        return JsonResponse({'success': False, 'error': 'No examples to run'}, status=404)
+    
+    # The run continues after the response; its report is fetched from api_example_run
+    try:
+        run_label = start_background_run(examples, min(concurrency or settings.EXAMPLE_RUN_CONCURRENCY,
+                                                       settings.EXAMPLE_RUN_CONCURRENCY))
+    except RuntimeError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=409)
+    
+    return JsonResponse({
+        'success': True,
+        'run_label': run_label,
+        'examples': len(examples),
+        'status_url': reverse('api_example_run', args=[run_label]),
+    }, status=202)
+
+@require_safe
+def api_example_run(request, run_label):
+    """API endpoint for the status of a background example run, with its report once finished"""
+    error = _check_api_token(request)
+    if error:
+        return error
+    
+    status = get_run_status(run_label)
+    if status is None:
+        return JsonResponse({'success': False, 'error': 'Unknown or expired run'}, status=404)
+    return JsonResponse({'success': True, **status})
 
 def api_traces_summary(request):
-    """API endpoint for traces summary data"""
-    days = int(request.GET.get('days', 30))
-    chart_data = ChartDataGenerator.traces_by_date(days)
+    """API endpoint for trace counts per bucket over the last `days` days or a start/end window"""
+    try:
+        window = parse_window(request.GET, default_bucket='day')
+        days = int(request.GET.get('days', 30))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    chart_data = ChartDataGenerator.traces_by_date(days, **window)
     return JsonResponse(chart_data)
 
 def api_trace_stats(request):
-    """API endpoint for trace statistics"""
-    metrics = ChartDataGenerator.trace_performance_metrics()
+    """API endpoint for trace statistics over an optional start/end window, with a per-bucket runtime trend"""
+    try:
+        window = parse_window(request.GET, default_bucket='week')
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    metrics = ChartDataGenerator.trace_performance_metrics(**window)
+    metrics['percentiles'] = RollupManager.runtime_percentiles(window['start'], window['end'])
     return JsonResponse(metrics)
 
-def model_visualizations(request):
-    """View for displaying comprehensive model visualizations dashboard"""
-    # Get all visualizations
-    visualizations = DashboardVisualizations.get_all_visualizations()
+def api_trace_runtimes(request):
+    """API endpoint for trace runtimes over a start/end window, downsampled to a point budget"""
+    try:
+        window = parse_window(request.GET, default_bucket='day')
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
     
-    # Get existing chart images for compatibility with old templates
-    runtime_distribution_img = ChartDataGenerator.generate_matplotlib_chart('runtime_histogram')
-    traces_by_date_img = ChartDataGenerator.generate_matplotlib_chart('trace_count_by_day')
-    tags_distribution_img = ChartDataGenerator.generate_matplotlib_chart('tags_pie')
-    step_runtime_img = ChartDataGenerator.generate_matplotlib_chart('step_runtime')
+    method = request.GET.get('method', 'minmax')
+    if method not in METHODS:
+        return JsonResponse({'error': f"method must be one of: {', '.join(METHODS)}"}, status=400)
     
+    data = ChartDataGenerator.trace_runtimes(window['start'], window['end'], window['max_points'], method)
+    return JsonResponse(data)
+
+def model_visualizations(request):
+    """View for displaying comprehensive model visualizations dashboard"""
+    # Charts are lazy-loaded from chart_image so the page itself renders immediately
     context = {
         'title': 'Model Data Visualizations',
-        'visualizations': visualizations,
-        'runtime_distribution_img': runtime_distribution_img,
-        'traces_by_date_img': traces_by_date_img,
-        'tags_distribution_img': tags_distribution_img,
-        'step_runtime_img': step_runtime_img,
     }
     
     return render(request, 'visualizations.html', context)
+
+def _chart_key(request, name, fmt):
+    """Content-addressed cache key of a chart, used as its ETag"""
+    if name not in CHART_IMAGES:
+        return None
+    path, args = CHART_IMAGES[name]
+    with use_format(fmt):
+        return resolve_chart(path).cache_key(*args)[1]
+
+def _chart_last_modified(request, name, fmt):
+    """Last change of the data a chart is drawn from"""
+    if name not in CHART_IMAGES:
+        return None
+    path, _ = CHART_IMAGES[name]
+    return resolve_chart(path).last_modified()
+
+@require_safe
+@condition(etag_func=_chart_key, last_modified_func=_chart_last_modified)
+def chart_image(request, name, fmt):
+    """Serve a chart as a cacheable png/svg/webp image"""
+    if name not in CHART_IMAGES:
+        raise Http404(f"Unknown chart: {name}")
+    
+    path, args = CHART_IMAGES[name]
+    image = render_chart(path, args, fmt)
+    if not image:
+        # Still rendering or failed; a chart that finishes late is cached for the retry
+        response = HttpResponse(status=503)
+        response['Retry-After'] = '5'
+        return response
+    
+    response = HttpResponse(base64.b64decode(image), content_type=CHART_FORMATS[fmt])
+    patch_cache_control(response, public=True, max_age=settings.CHART_IMAGE_MAX_AGE)
+    return response
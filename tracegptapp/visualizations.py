@@ -14,7 +14,12 @@ from datetime import datetime, timedelta
 from django.utils import timezone
 from collections import Counter
 
-from .models import ChatExample, ChatTrace, TraceStep, ContactMessage
+from .chart_cache import cached_chart, chart_format
+from .models import ChatExample, ChatTrace, TraceStep, TraceTag, ContactMessage
+from .frames import load_frame, local_naive
+from .snapshots import load_columns
+from .rollups import RollupManager
+from .downsampling import downsample
 
 # Set plot styling
 plt.style.use('ggplot')
@@ -36,17 +41,23 @@ STATUS_COLORS = {
     'spam': '#6c757d'
 }
 
+# Maximum points per category drawn in swarm plots
+SWARM_SAMPLE_SIZE = 200
+
+# Maximum points drawn in the runtime scatter plot and its trend line
+SCATTER_MAX_POINTS = 1000
+
 class ModelVisualizations:
     """Class to generate visualizations for all models in the application."""
     
     @staticmethod
     def encode_plot_to_base64(fig=None, close_fig=True):
-        """Utility function to convert matplotlib figure to base64 encoded string"""
+        """Utility function to convert matplotlib figure to base64 encoded string in the current chart format"""
         if fig is None:
             fig = plt.gcf()
             
         buffer = BytesIO()
-        fig.savefig(buffer, format='png', bbox_inches='tight', dpi=100)
+        fig.savefig(buffer, format=chart_format.get(), bbox_inches='tight', dpi=100)
         if close_fig:
             # Safe cleanup for figure to avoid thread issues
             plt.close(fig)
@@ -67,6 +78,7 @@ class ModelVisualizations:
             pass
     
     @staticmethod
+    @cached_chart(ChatExample, ChatTrace, TraceStep, ContactMessage)
     def get_model_counts():
         """Generate bar chart showing record count for each model"""
         # Get counts for each model
@@ -98,6 +110,7 @@ class ModelVisualizations:
         return ModelVisualizations.encode_plot_to_base64(fig)
     
     @staticmethod
+    @cached_chart(ChatExample)
     def chat_examples_tags_distribution():
         """Generate pie chart of tag distribution for ChatExample model"""
         # Get all chat examples
@@ -147,30 +160,34 @@ class ModelVisualizations:
         return ModelVisualizations.encode_plot_to_base64(fig)
     
     @staticmethod
-    def chat_trace_runtime_scatter():
+    @cached_chart(ChatTrace)
+    def chat_trace_runtime_scatter(start=None, end=None, max_points=SCATTER_MAX_POINTS):
         """Generate scatter plot of ChatTrace runtimes over time with tag coloring"""
-        # Get all chat traces
-        traces = ChatTrace.objects.all().values('runtime_seconds', 'created_at', 'tags', 'status')
+        # Get the chat traces of the window
+        df = load_columns('traces', ['runtime_seconds', 'created_at', 'status'], start, end)
         
-        if not traces:
+        if df.empty:
             fig, ax = plt.subplots(figsize=(10, 6))
             ax.text(0.5, 0.5, 'No Chat Traces Available', 
                    ha='center', va='center', fontsize=14)
             return ModelVisualizations.encode_plot_to_base64(fig)
             
-        # Convert to DataFrame
-        df = pd.DataFrame(list(traces))
         df['created_at'] = pd.to_datetime(df['created_at'])
         
         # Sort by date
-        df = df.sort_values('created_at')
+        df = df.dropna(subset=['runtime_seconds']).sort_values('created_at', kind='stable')
+        
+        # Draw at most max_points points, keeping the fastest and slowest
+        # trace of each time slice
+        created_at = df['created_at'].to_numpy(dtype='datetime64[us]')
+        points = df.iloc[downsample(created_at, df['runtime_seconds'].to_numpy(), max_points, 'minmax')]
         
         # Create scatter plot
         fig, ax = plt.subplots(figsize=(12, 7))
         
         # Plot points with different colors based on status
         for status, color in STATUS_COLORS.items():
-            status_df = df[df['status'] == status]
+            status_df = points[points['status'] == status]
             if not status_df.empty:
                 ax.scatter(
                     status_df['created_at'], 
@@ -182,13 +199,14 @@ class ModelVisualizations:
                     s=80
                 )
         
-        # Add trend line using rolling average
+        # Add trend line using rolling average over every trace, downsampled with LTTB
         if len(df) > 1:
-            df['rolling_avg'] = df['runtime_seconds'].rolling(
+            rolling_avg = df['runtime_seconds'].rolling(
                 window=min(5, len(df)), 
                 min_periods=1
-            ).mean()
-            ax.plot(df['created_at'], df['rolling_avg'], 'r--', 
+            ).mean().to_numpy()
+            trend = downsample(created_at, rolling_avg, max_points, 'lttb')
+            ax.plot(created_at[trend], rolling_avg[trend], 'r--', 
                    label='5-point Rolling Avg', linewidth=2)
         
         # Add labels and styling
@@ -213,20 +231,18 @@ class ModelVisualizations:
         return ModelVisualizations.encode_plot_to_base64(fig)
     
     @staticmethod
+    @cached_chart(TraceStep)
     def trace_step_type_boxplot():
         """Generate box plot of runtime distribution by step type"""
         # Get all trace steps
-        steps = TraceStep.objects.all().values('step_type', 'runtime_seconds')
+        df = load_columns('steps', ['step_type', 'runtime_seconds'])
         
-        if not steps:
+        if df.empty:
             fig, ax = plt.subplots(figsize=(10, 6))
             ax.text(0.5, 0.5, 'No Trace Steps Available', 
                    ha='center', va='center', fontsize=14)
             return ModelVisualizations.encode_plot_to_base64(fig)
             
-        # Convert to DataFrame
-        df = pd.DataFrame(list(steps))
-        
         # Get step types with at least 2 entries for meaningful boxplot
         step_counts = df['step_type'].value_counts()
         valid_steps = step_counts[step_counts >= 2].index.tolist()
@@ -239,6 +255,8 @@ class ModelVisualizations:
         
         # Filter dataframe to include only valid steps
         df_filtered = df[df['step_type'].isin(valid_steps)]
+        if isinstance(df_filtered['step_type'].dtype, pd.CategoricalDtype):
+            df_filtered = df_filtered.assign(step_type=df_filtered['step_type'].cat.remove_unused_categories())
         
         # Create boxplot
         fig, ax = plt.subplots(figsize=(12, 8))
@@ -256,11 +274,13 @@ class ModelVisualizations:
             ax=ax
         )
         
-        # Add swarm plot to show individual points
+        # Add swarm plot to show individual points; swarm layout is quadratic in
+        # the number of points, so plot a fixed-size random sample per step type
+        swarm_df = df_filtered.sample(frac=1, random_state=0).groupby('step_type').head(SWARM_SAMPLE_SIZE)
         sns.swarmplot(
             x='step_type',
             y='runtime_seconds',
-            data=df_filtered,
+            data=swarm_df,
             color='black',
             alpha=0.5,
             size=4,
@@ -284,21 +304,18 @@ class ModelVisualizations:
         return ModelVisualizations.encode_plot_to_base64(fig)
     
     @staticmethod
+    @cached_chart(ContactMessage)
     def contact_message_status_stacked():
         """Generate stacked bar chart of contact message statuses over time"""
         # Get all contact messages
-        messages = ContactMessage.objects.all().values('status', 'created_at')
+        df = load_frame(ContactMessage.objects.order_by(), ['status', 'created_at'])
         
-        if not messages:
+        if df.empty:
             fig, ax = plt.subplots(figsize=(10, 6))
             ax.text(0.5, 0.5, 'No Contact Messages Available', 
                    ha='center', va='center', fontsize=14)
             return ModelVisualizations.encode_plot_to_base64(fig)
             
-        # Convert to DataFrame
-        df = pd.DataFrame(list(messages))
-        df['created_at'] = pd.to_datetime(df['created_at'])
-        
         # Group by month and status
         df['month'] = df['created_at'].dt.to_period('M')
         monthly_status = df.groupby(['month', 'status']).size().unstack(fill_value=0)
@@ -342,58 +359,28 @@ class ModelVisualizations:
         return ModelVisualizations.encode_plot_to_base64(fig)
     
     @staticmethod
+    @cached_chart(ChatTrace)
     def weekly_activity_heatmap():
         """Generate heatmap of activity by day of week and hour"""
-        # Get all traces
-        traces = ChatTrace.objects.all().annotate(
-            hour=ExtractHour('created_at'),
-            weekday=ExtractWeekDay('created_at')
-        ).values('hour', 'weekday')
+        # Get the local day x hour counts maintained in the hourly rollups
+        days, counts = RollupManager.activity_matrix()
         
-        if not traces:
+        if not counts.any():
             fig, ax = plt.subplots(figsize=(12, 8))
             ax.text(0.5, 0.5, 'No Chat Traces Available', 
                    ha='center', va='center', fontsize=14)
             return ModelVisualizations.encode_plot_to_base64(fig)
-            
-        # Convert to DataFrame
-        df = pd.DataFrame(list(traces))
-        
-        # Create pivot table with weekdays as rows and hours as columns
-        activity_pivot = df.pivot_table(
-            index='weekday', 
-            columns='hour', 
-            values='hour', 
-            aggfunc='count',
-            fill_value=0
-        )
         
-        # Reindex to ensure all hours are included (0-23)
-        all_hours = list(range(24))
-        activity_pivot = activity_pivot.reindex(columns=all_hours, fill_value=0)
-        
-        # Map weekday numbers to names
-        weekday_names = {
-            1: 'Monday',
-            2: 'Tuesday',
-            3: 'Wednesday',
-            4: 'Thursday',
-            5: 'Friday',
-            6: 'Saturday',
-            7: 'Sunday',
-            # Django's ExtractWeekDay might use 0-indexed values on some databases
-            0: 'Sunday'
-        }
+        # Fold the days onto their weekday (0 is Monday; 1970-01-01 was a Thursday)
+        weekdays = (days.astype(np.int64) + 3) % 7
+        weekly = np.zeros((7, 24), dtype=np.int64)
+        np.add.at(weekly, weekdays, counts)
         
-        # Reindex to ensure all weekdays are included and in order
-        all_weekdays = [day for day in range(1, 8) if day in df['weekday'].unique() or day in range(1, 8)]
-        if 0 in df['weekday'].unique():
-            all_weekdays = [0] + [d for d in all_weekdays if d != 7]  # Replace 7 with 0 if 0 is Sunday
-            
-        activity_pivot = activity_pivot.reindex(all_weekdays, fill_value=0)
-        
-        # Rename index
-        activity_pivot.index = [weekday_names[day] for day in activity_pivot.index]
+        activity_pivot = pd.DataFrame(
+            weekly,
+            index=['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'],
+            columns=range(24),
+        )
         
         # Create heatmap
         fig, ax = plt.subplots(figsize=(14, 8))
@@ -424,31 +411,26 @@ class ModelVisualizations:
         return ModelVisualizations.encode_plot_to_base64(fig)
     
     @staticmethod
+    @cached_chart(ChatTrace)
     def trace_tag_comparison_radar():
         """Generate radar chart comparing performance across different tags"""
-        # Use exclude with empty string instead of filter with len__gt
-        traces = ChatTrace.objects.exclude(tags=[]).values('tags', 'runtime_seconds')
+        # Per-tag trace counts and average runtimes as an indexed GROUP BY
+        tag_rows = TraceTag.objects.values('tag').annotate(
+            count=Count('id'),
+            avg_runtime=Avg('trace__runtime_seconds')
+        ).order_by('tag')
         
-        if not traces:
+        if not tag_rows:
             fig, ax = plt.subplots(figsize=(10, 8))
             ax.text(0.5, 0.5, 'No Tagged Chat Traces Available', 
                    ha='center', va='center', fontsize=14)
             return ModelVisualizations.encode_plot_to_base64(fig)
             
-        # Process data for radar chart
-        # We'll compute average runtime for each tag
-        tag_data = {}
-        
-        for trace in traces:
-            for tag in trace['tags']:
-                if tag not in tag_data:
-                    tag_data[tag] = {'count': 0, 'total_runtime': 0}
-                tag_data[tag]['count'] += 1
-                tag_data[tag]['total_runtime'] += trace['runtime_seconds']
-        
-        # Calculate averages
-        for tag in tag_data:
-            tag_data[tag]['avg_runtime'] = tag_data[tag]['total_runtime'] / tag_data[tag]['count']
+        # Compute average runtime for each tag
+        tag_data = {
+            row['tag']: {'count': row['count'], 'avg_runtime': row['avg_runtime']}
+            for row in tag_rows
+        }
         
         # Prepare data for radar chart
         categories = list(tag_data.keys())
@@ -497,6 +479,7 @@ class ModelVisualizations:
         return ModelVisualizations.encode_plot_to_base64(fig)
     
     @staticmethod
+    @cached_chart(ChatExample, ChatTrace)
     def examples_vs_traces_correlation():
         """Generate scatter plot comparing number of examples to traces over time"""
         # Get counts by month for both models
@@ -521,24 +504,18 @@ class ModelVisualizations:
             count=Count('id')
         ).order_by('month')
         
-        if not examples and not traces:
+        df_examples = load_frame(examples, ['month', 'count'])
+        df_traces = load_frame(traces, ['month', 'count'])
+        
+        if df_examples.empty and df_traces.empty:
             fig, ax = plt.subplots(figsize=(10, 6))
             ax.text(0.5, 0.5, 'No Data Available', 
                    ha='center', va='center', fontsize=14)
             return ModelVisualizations.encode_plot_to_base64(fig)
-            
-        # Convert to DataFrames
-        df_examples = pd.DataFrame(list(examples))
-        df_traces = pd.DataFrame(list(traces))
         
-        # Handle timezone info
-        if not df_examples.empty:
-            # Remove timezone info to avoid conversion warnings
-            df_examples['month'] = df_examples['month'].dt.tz_localize(None)
-        
-        if not df_traces.empty:
-            # Remove timezone info to avoid conversion warnings
-            df_traces['month'] = df_traces['month'].dt.tz_localize(None)
+        # Use naive local month starts to avoid conversion warnings
+        df_examples['month'] = local_naive(df_examples['month'])
+        df_traces['month'] = local_naive(df_traces['month'])
         
         # Create date range for all months
         if not df_examples.empty and not df_traces.empty:
@@ -629,26 +606,23 @@ class ModelVisualizations:
         
         return ModelVisualizations.encode_plot_to_base64(fig)
 
-# Custom dashboard visualizations for all models
-class DashboardVisualizations:
-    """Generate visualizations for the admin dashboard."""
-    
-    @staticmethod
-    def get_all_visualizations():
-        """Generate all visualizations for the dashboard"""
-        try:
-            visualizations = {
-                'model_counts': ModelVisualizations.get_model_counts(),
-                'chat_examples_tags': ModelVisualizations.chat_examples_tags_distribution(),
-                'chat_trace_runtime': ModelVisualizations.chat_trace_runtime_scatter(),
-                'trace_step_boxplot': ModelVisualizations.trace_step_type_boxplot(),
-                'contact_message_status': ModelVisualizations.contact_message_status_stacked(),
-                'weekly_activity': ModelVisualizations.weekly_activity_heatmap(),
-                'tag_comparison_radar': ModelVisualizations.trace_tag_comparison_radar(),
-                'examples_vs_traces': ModelVisualizations.examples_vs_traces_correlation(),
-            }
-        finally:
-            # Ensure all figures are cleaned up properly
-            ModelVisualizations.safe_cleanup()
-            
-        return visualizations 
\ No newline at end of file
+# Charts on the visualizations dashboards as name -> ('module:function', args)
+DASHBOARD_CHARTS = {
+    'model_counts': ('tracegptapp.visualizations:ModelVisualizations.get_model_counts', ()),
+    'chat_examples_tags': ('tracegptapp.visualizations:ModelVisualizations.chat_examples_tags_distribution', ()),
+    'chat_trace_runtime': ('tracegptapp.visualizations:ModelVisualizations.chat_trace_runtime_scatter', ()),
+    'trace_step_boxplot': ('tracegptapp.visualizations:ModelVisualizations.trace_step_type_boxplot', ()),
+    'contact_message_status': ('tracegptapp.visualizations:ModelVisualizations.contact_message_status_stacked', ()),
+    'weekly_activity': ('tracegptapp.visualizations:ModelVisualizations.weekly_activity_heatmap', ()),
+    'tag_comparison_radar': ('tracegptapp.visualizations:ModelVisualizations.trace_tag_comparison_radar', ()),
+    'examples_vs_traces': ('tracegptapp.visualizations:ModelVisualizations.examples_vs_traces_correlation', ()),
+}
+
+# Every chart served by /charts/<name>.<format>
+CHART_IMAGES = {
+    **DASHBOARD_CHARTS,
+    'runtime_histogram': ('tracegptapp.analytics:ChartDataGenerator.generate_matplotlib_chart', ('runtime_histogram',)),
+    'trace_count_by_day': ('tracegptapp.analytics:ChartDataGenerator.generate_matplotlib_chart', ('trace_count_by_day',)),
+    'tags_pie': ('tracegptapp.analytics:ChartDataGenerator.generate_matplotlib_chart', ('tags_pie',)),
+    'step_runtime': ('tracegptapp.analytics:ChartDataGenerator.generate_matplotlib_chart', ('step_runtime',)),
+}